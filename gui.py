@@ -27,6 +27,7 @@ from gui.locked_screen import show_locked_screen
 
 # --- Utils modules ---
 from utils.chat_storage import load_messages, save_message
+from utils.db import close_store, unlock_storage
 from utils.attachment_envelope import parse_attachment_envelope
 from utils.crypto import (
     KEY_FILE,
@@ -276,7 +277,7 @@ class WhisprApp(ctk.CTk):
         # Start WebSocket client (real-time push). Runs alongside polling; polling will idle when ws_connected.
         try:
             self.ws_connected = False
-            start_ws_client(self)
+            self._stop_ws = start_ws_client(self)
         except Exception as e:
             print(f"[gui] failed to start websocket client: {e}")
 
@@ -376,6 +377,11 @@ class WhisprApp(ctk.CTk):
             return
 
         self.private_key, self.signing_key, self.pin, self.username = result
+        # Derive the local database key once; storage calls reuse it for the session
+        if getattr(self, "keyring", None):
+            close_store()
+            self.keyring.close()
+        self.keyring = unlock_storage(self.pin)
         self.public_key = self.private_key.public_key
         self.my_pub_hex = self.public_key.encode().hex()
         self.signing_pub_hex = self.signing_key.verify_key.encode().hex()
@@ -421,7 +427,7 @@ class WhisprApp(ctk.CTk):
                 # Clear the placeholder before synchronous rendering
                 for widget in self.messages_container.winfo_children():
                     widget.destroy()
-                messages = load_messages(self.recipient_pub_hex, self.pin)
+                messages = load_messages(self.recipient_pub_hex, self.keyring)
                 for msg in messages:
                     txt = msg.get("text", "")
                     meta = msg.get("_attachment")
@@ -562,7 +568,7 @@ class WhisprApp(ctk.CTk):
                     placeholder = f"[Attachment] {os.path.basename(path)} ({self.chat_manager._human_size(len(blob))})"
                     ts = _time.time()
                     meta = {"name": os.path.basename(path), "size": len(blob), "att_id": att_id, "type": "file"}
-                    save_message(self.recipient_pub_hex, 'You', placeholder, self.pin, timestamp=ts, attachment=meta)
+                    save_message(self.recipient_pub_hex, 'You', placeholder, self.keyring, timestamp=ts, attachment=meta)
                     self.display_message(self.my_pub_hex, placeholder, ts, attachment_meta=meta)
 
                     def _bg_send(p=path, data=blob):
@@ -788,6 +794,32 @@ class WhisprApp(ctk.CTk):
         except Exception:
             pass
 
+        # Group managers may have started their own crypto pool (no ChatManager pool at the time)
+        for owner in (getattr(self, "groups_panel", None), getattr(self, "sidebar", None)):
+            try:
+                gm = getattr(owner, "gm", None)
+                if gm is not None:
+                    gm.close()
+            except Exception:
+                pass
+
+        try:
+            # No more pushes after this; save the ones buffered since ChatManager.stop
+            if getattr(self, "_stop_ws", None):
+                self._stop_ws()
+            if hasattr(self, "chat_manager") and self.chat_manager:
+                self.chat_manager.incoming.flush()
+        except Exception as e:
+            print(f"[gui] failed to save received messages: {e}")
+
+        try:
+            # Apply queued local writes before the key is wiped
+            close_store()
+            if getattr(self, "keyring", None):
+                self.keyring.close()
+        except Exception:
+            pass
+
         # Finally destroy the window
         try:
             self.destroy()
@@ -115,6 +115,24 @@ class WhisprUILayout:
                                      hover_color=theme.get("button_send_hover", "#357ABD"))
         app.copy_btn.grid(row=0, column=1, padx=5, pady=10)
 
+        # Search button (full-text search over local message history)
+        def _open_search(event=None):
+            try:
+                from gui.widgets.search_dialog import MessageSearchDialog
+                existing = getattr(app, 'search_dialog', None)
+                if existing is not None and existing.winfo_exists():
+                    existing.focus_set()
+                    return
+                app.search_dialog = MessageSearchDialog(app, app, theme=theme)
+            except Exception as e:
+                print("search dialog error", e)
+
+        app.search_btn = ctk.CTkButton(pub_frame, text="Search", command=_open_search,
+                                       fg_color=theme.get("button_send", "#4a90e2"),
+                                       hover_color=theme.get("button_send_hover", "#357ABD"))
+        app.search_btn.grid(row=0, column=2, padx=5, pady=10)
+        app.bind("<Control-f>", _open_search)
+
         # Call button (starts a WebRTC call)
         def _start_call():
             if not app.recipient_pub_hex:
@@ -359,7 +377,7 @@ class WhisprUILayout:
                         # Temporary client-side id (hash) for placeholder; network layer will persist
                         # att_id already derived from store_attachment above (or fallback)
                         meta = {"name": os.path.basename(p), "size": len(data), "att_id": att_id, "type": "file"}
-                        save_message(app.recipient_pub_hex, "You", placeholder, app.pin, timestamp=ts, attachment=meta)
+                        save_message(app.recipient_pub_hex, "You", placeholder, app.keyring, timestamp=ts, attachment=meta)
                         app.display_message(app.my_pub_hex, placeholder, ts, attachment_meta=meta)
 
                         def _bg_send():
@@ -102,7 +102,10 @@ class GroupSettingsDialog(ctk.CTkToplevel):
         ctk.CTkLabel(row2, text='Discoverable').pack(side='left')
         self.public_switch = ctk.CTkSwitch(row2, text='', variable=self.is_public_var, command=self._toggle_public)
         self.public_switch.pack(side='left', padx=12)
-        ctk.CTkButton(row2, text='Force Rekey', width=120, command=self._rekey_group).pack(side='right')
+        self.rekey_btn = ctk.CTkButton(row2, text='Force Rekey', width=120, command=self._rekey_group)
+        self.rekey_btn.pack(side='right')
+        self.rekey_status_var = tk.StringVar(value='')
+        ctk.CTkLabel(row2, textvariable=self.rekey_status_var).pack(side='right', padx=(0, 8))
 
         # Server distribute setting: whether server distributes member keys
         row3 = ctk.CTkFrame(grp, fg_color='transparent')
@@ -245,11 +248,39 @@ class GroupSettingsDialog(ctk.CTkToplevel):
             self.app.notifier.show(f"Failed to update visibility: {e}", type_="error")
 
     def _rekey_group(self):
-        try:
-            self.gm.client.rekey(self.gid)
-            self.app.notifier.show("Rekey requested", type_="success")
-        except Exception as e:
-            self.app.notifier.show(f"Rekey failed: {e}", type_="error")
+        """Rotate the group key and seal it for every member off the UI thread."""
+        import threading
+
+        def _ui(fn):
+            try:
+                self.after(0, fn)
+            except Exception:
+                pass
+
+        def _progress(done, total):
+            _ui(lambda: self.rekey_status_var.set(f"Sealing keys {done}/{total}"))
+
+        def _work():
+            try:
+                info = self.gm.client.get_member_keys(self.gid)
+                members = [m.get('user_id') for m in info.get('members', []) if m.get('user_id')]
+                kv = self.gm.rekey_group(self.gid, members, progress=_progress)
+
+                def _done():
+                    self.rekey_status_var.set('')
+                    self.rekey_btn.configure(state='normal')
+                    self.app.notifier.show(f"Group rekeyed (v{kv}, {len(members)} members)", type_="success")
+                _ui(_done)
+            except Exception as e:
+                def _failed(err=e):
+                    self.rekey_status_var.set('')
+                    self.rekey_btn.configure(state='normal')
+                    self.app.notifier.show(f"Rekey failed: {err}", type_="error")
+                _ui(_failed)
+
+        self.rekey_btn.configure(state='disabled')
+        self.rekey_status_var.set('Rekeying...')
+        threading.Thread(target=_work, daemon=True).start()
 
     def _approve_member(self):
         uid = (self.appr_var.get() or "").strip()
@@ -37,6 +37,10 @@ class GroupsPanel(ctk.CTkFrame):
         self.channel_buttons = {}
         # Channel metadata (id -> dict with type, name, etc.)
         self.channel_meta: dict[str, dict] = {}
+        # Unread message counts per channel (from server-side channel summaries)
+        self.channel_unread: dict[str, int] = {}
+        # Channel lists delivered by the last /groups/sync, consumed once by _load_channels
+        self._synced_channels: dict[str, list[dict]] = {}
         # Placeholder for empty-state label in messages area
         self._empty_messages_label = None
         # Groups list widgets and avatar cache for sidebar-like styling
@@ -44,6 +48,10 @@ class GroupsPanel(ctk.CTkFrame):
         self.group_avatar_cache = {}
         # Polling guard
         self._polling = False
+        # (group_id, channel_id) rendered from an empty cache, waiting for its first fetch
+        self._awaiting_first_fetch = None
+        # Messages behind the media grid of the open media channel (the poll re-renders it)
+        self._media_msgs: list = []
 
         # Left: search + groups list + actions
         left = ctk.CTkFrame(self, fg_color=self.theme.get("sidebar_bg", "#2a2a3a"), width=300)
@@ -392,7 +400,7 @@ class GroupsPanel(ctk.CTkFrame):
                                 from utils.group_crypto import encrypt_text_with_group_key
                                 # Load my stored group key; if missing, try to fetch it from server
                                 from utils.db import load_my_group_key
-                                loaded = load_my_group_key(self.app.pin, self.selected_group_id)
+                                loaded = load_my_group_key(self.app.keyring, self.selected_group_id)
                                 if not loaded:
                                     try:
                                         # Attempt auto-fetch via GroupManager helper
@@ -760,7 +768,7 @@ class GroupsPanel(ctk.CTkFrame):
                     if my and my.get("encrypted_group_key"):
                         from utils.group_crypto import decrypt_group_key_for_me
                         key = decrypt_group_key_for_me(my["encrypted_group_key"], self.app.private_key)
-                        store_my_group_key(self.app.pin, self.selected_group_id, key, kv)
+                        store_my_group_key(self.app.keyring, self.selected_group_id, key, kv)
                         # Retry once
                         import time
                         ts = time.time()
@@ -787,6 +795,16 @@ class GroupsPanel(ctk.CTkFrame):
                      text_color=self.theme.get("sidebar_text", "white")).pack(pady=8)
 
         def work():
+            # One round trip for groups and their channels; fall back to the per-call API
+            try:
+                res = self.gm.sync()
+                chans: dict[str, list[dict]] = {}
+                for ch in res.get("channels", []):
+                    chans.setdefault(ch.get("group_id"), []).append(ch)
+                self._synced_channels = chans
+                return res
+            except Exception:
+                pass
             try:
                 return self.gm.list_groups()
             except Exception:
@@ -814,7 +832,7 @@ class GroupsPanel(ctk.CTkFrame):
                 try:
                     # Already have key?
                     from utils.db import load_my_group_key
-                    if load_my_group_key(self.app.pin, group_id):
+                    if load_my_group_key(self.app.keyring, group_id):
                         return True
                     # Try to fetch from server
                     ensure = getattr(self.gm, '_ensure_have_group_key', None)
@@ -890,15 +908,28 @@ class GroupsPanel(ctk.CTkFrame):
                      text_color=self.theme.get("sidebar_text", "white")).pack(pady=6)
 
         def work():
+            synced = self._synced_channels.pop(group_id, None)
+            if synced is not None:
+                data = {"channels": synced}
+            else:
+                try:
+                    data = self.gm.client.list_channels(group_id)
+                except Exception:
+                    data = {"channels": []}
             try:
-                return self.gm.client.list_channels(group_id)
+                data["unread"] = self.gm.unread_counts(group_id).get("channels", {})
             except Exception:
-                return {"channels": []}
+                data["unread"] = {}
+            return data
 
         def done(data):
             for w in self.channels_list.winfo_children():
                 w.destroy()
             chans = data.get("channels", []) if isinstance(data, dict) else []
+            try:
+                self.channel_unread.update(data.get("unread", {}))
+            except Exception:
+                pass
             # store channel metadata for later decisions (media vs text)
             try:
                 for ch in chans:
@@ -914,7 +945,7 @@ class GroupsPanel(ctk.CTkFrame):
             for ch in chans:
                 cid = ch.get("id")
                 cname = ch.get("name")
-                btn = ctk.CTkButton(self.channels_list, text=f"# {cname}",
+                btn = ctk.CTkButton(self.channels_list, text=self._channel_label(cid, cname),
                                     command=lambda cid=cid, name=cname: self._select_channel(cid, name),
                                     fg_color=self.theme.get("input_bg", "#2e2e3f"),
                                     hover_color=self.theme.get("bubble_you", "#7289da"))
@@ -935,6 +966,28 @@ class GroupsPanel(ctk.CTkFrame):
 
         self._run_bg(work, done)
 
+    def _channel_label(self, channel_id: str, channel_name: str) -> str:
+        n = int(self.channel_unread.get(channel_id, 0) or 0)
+        return f"# {channel_name}  ({n})" if n else f"# {channel_name}"
+
+    def _mark_channel_read(self, channel_id: str):
+        """Clear the local unread badge and advance the server read cursor in the background."""
+        self.channel_unread[channel_id] = 0
+        try:
+            btn = self.channel_buttons.get(channel_id)
+            name = (self.channel_meta.get(channel_id) or {}).get('name')
+            if btn is not None and name:
+                btn.configure(text=self._channel_label(channel_id, name))
+        except Exception:
+            pass
+
+        def work():
+            try:
+                return self.gm.mark_channel_read(channel_id)
+            except Exception:
+                return None
+        self._run_bg(work, None)
+
     def _fetch_my_group_key(self):
         if not self.selected_group_id:
             return
@@ -942,7 +995,7 @@ class GroupsPanel(ctk.CTkFrame):
         def work():
             try:
                 from utils.db import load_my_group_key
-                if load_my_group_key(self.app.pin, gid):
+                if load_my_group_key(self.app.keyring, gid):
                     return True
                 ensure = getattr(self.gm, '_ensure_have_group_key', None)
                 if callable(ensure):
@@ -1055,29 +1108,43 @@ class GroupsPanel(ctk.CTkFrame):
             pass
         # Highlight selected channel button
         self._highlight_channel_btn(channel_id)
+        self._mark_channel_read(channel_id)
         # Load recent messages for the channel in background
         for w in self.messages.winfo_children():
             w.destroy()
         self._show_empty_messages("Loading messages…")
 
+        # Offline-first: render what the local cache has, then the poll fetches only the delta
+        gid, cid = self.selected_group_id, self.selected_channel_id
+
         def work():
             try:
-                return self.gm.fetch_messages(self.selected_group_id, self.selected_channel_id, since=0)
+                return self.gm.cached_messages(gid, cid)
             except Exception:
                 return []
 
         def done(msgs):
+            if (gid, cid) != (self.selected_group_id, self.selected_channel_id):
+                return
             for w in self.messages.winfo_children():
                 w.destroy()
-            msgs = msgs or []
+            msgs = msgs if isinstance(msgs, list) else []
+            self._last_ts[(gid, cid)] = 0.0
             # If this channel is a media channel, render the media grid; otherwise use standard
             # per-message rendering. Keep fallback in case media rendering fails.
             cmeta = self.channel_meta.get(self.selected_channel_id, {})
             ctype = (cmeta.get('type') or 'text') if isinstance(cmeta, dict) else 'text'
-            if ctype == 'media':
+            if ctype == 'media' and not msgs:
+                # Nothing cached (first open / new device): the first fetch draws the grid
+                self._media_msgs = []
+                self._show_empty_messages("Loading messages…")
+                self._awaiting_first_fetch = (gid, cid)
+            elif ctype == 'media':
+                self._media_msgs = list(msgs)
                 try:
                     from gui.widgets.channel_types.media_channel import render_media_grid
                     render_media_grid(self.messages, self.app, msgs, self.selected_group_id, self.theme)
+                    self._empty_messages_label = None
                     # update last_ts
                     try:
                         last_ts = 0.0
@@ -1125,7 +1192,8 @@ class GroupsPanel(ctk.CTkFrame):
                         self._last_ts[(self.selected_group_id, self.selected_channel_id)] = last_ts
             else:
                 if not msgs:
-                    self._show_empty_messages("No messages yet")
+                    self._show_empty_messages("Loading messages…")
+                    self._awaiting_first_fetch = (gid, cid)
                 else:
                     self._clear_empty_messages()
                     last_ts = 0.0
@@ -1156,7 +1224,7 @@ class GroupsPanel(ctk.CTkFrame):
                         except Exception:
                             pass
                     self._last_ts[(self.selected_group_id, self.selected_channel_id)] = last_ts
-            self._schedule_poll()
+            self._schedule_poll(delay_ms=0)
 
         self._run_bg(work, done)
 
@@ -1394,11 +1462,23 @@ class GroupsPanel(ctk.CTkFrame):
             return str(sender_id) if sender_id else "?"
 
     # ----- Helpers -----
-    def _schedule_poll(self):
+    def _schedule_poll(self, delay_ms: int = 2000):
         if not self.selected_group_id or not self.selected_channel_id:
             return
+        # One poll loop at a time (switching channels restarts it)
+        if self._poll_job:
+            try:
+                self.after_cancel(self._poll_job)
+            except Exception:
+                pass
+            self._poll_job = None
+        self._poll_gen = getattr(self, '_poll_gen', 0) + 1
+        gen = self._poll_gen
+
         # poll new messages every 2 seconds
         def _tick():
+            if gen != self._poll_gen:
+                return
             if self._polling:
                 self._poll_job = self.after(2000, _tick)
                 return
@@ -1408,13 +1488,23 @@ class GroupsPanel(ctk.CTkFrame):
 
             def work():
                 try:
-                    return self.gm.fetch_messages(self.selected_group_id, self.selected_channel_id, since=since)
+                    return self.gm.fetch_messages(key[0], key[1], since=since)
                 except Exception:
                     return []
 
             def done(msgs):
                 try:
-                    if msgs:
+                    if key != (self.selected_group_id, self.selected_channel_id):
+                        # Channel switched while fetching; its own poll takes over
+                        return
+                    if self._awaiting_first_fetch == key:
+                        self._awaiting_first_fetch = None
+                        if not msgs:
+                            self._show_empty_messages("No messages yet")
+                    if msgs and self._render_media_delta(key, msgs):
+                        self._mark_channel_read(key[1])
+                    elif msgs:
+                        self._mark_channel_read(key[1])
                         self._clear_empty_messages()
                         for m in msgs:
                             att = m.get("attachment_meta")
@@ -1432,11 +1522,35 @@ class GroupsPanel(ctk.CTkFrame):
                                 pass
                 finally:
                     self._polling = False
-                    self._poll_job = self.after(2000, _tick)
+                    if gen == self._poll_gen:
+                        self._poll_job = self.after(2000, _tick)
 
             self._run_bg(work, done)
 
-        self._poll_job = self.after(2000, _tick)
+        self._poll_job = self.after(delay_ms, _tick)
+
+    def _render_media_delta(self, key, msgs: list) -> bool:
+        """Redraw the media grid of the open media channel with newly fetched msgs.
+
+        Returns False for text channels (or if the grid fails) so the caller appends bubbles.
+        """
+        cmeta = self.channel_meta.get(key[1], {})
+        ctype = (cmeta.get('type') or 'text') if isinstance(cmeta, dict) else 'text'
+        if ctype != 'media':
+            return False
+        try:
+            from gui.widgets.channel_types.media_channel import render_media_grid
+            self._media_msgs = self._media_msgs + list(msgs)
+            render_media_grid(self.messages, self.app, self._media_msgs, key[0], self.theme)
+            self._empty_messages_label = None
+        except Exception:
+            return False
+        for m in msgs:
+            try:
+                self._last_ts[key] = max(self._last_ts.get(key, 0) or 0, float(m.get("timestamp") or 0))
+            except Exception:
+                pass
+        return True
 
     def _run_bg(self, func, callback):
         """Run blocking work in a daemon thread and call callback(result) on UI thread."""
@@ -0,0 +1,183 @@
+import threading
+import tkinter as tk
+from datetime import datetime
+
+import customtkinter as ctk
+
+from utils.db import search_messages
+from utils.recipients import get_recipient_name
+
+
+class MessageSearchDialog(ctk.CTkToplevel):
+    """Full-text search over the local message history.
+
+    Results come newest first, PAGE_SIZE at a time ("Load more" fetches the
+    next page); clicking one opens that conversation around the message.
+    """
+
+    PAGE_SIZE = 20
+
+    def __init__(self, parent, app, theme: dict | None = None):
+        super().__init__(parent)
+        self.app = app
+        self.theme = theme or {}
+        self._search_after = None
+        self._query = ""
+        self._offset = 0
+        self._generation = 0
+        self._names = {}
+
+        self.title("Search Messages")
+        self.geometry("520x560")
+        self.transient(parent)
+
+        # Top controls
+        top = ctk.CTkFrame(self, fg_color="transparent")
+        top.pack(fill="x", padx=10, pady=10)
+        self.q = ctk.CTkEntry(top, placeholder_text="Search messages",
+                              fg_color=self.theme.get("input_bg", "#2e2e3f"))
+        self.q.pack(side="left", expand=True, fill="x")
+        self.q.bind("<KeyRelease>", self._schedule_search)
+        ctk.CTkButton(top, text="Search", command=self._do_search,
+                      fg_color=self.theme.get("sidebar_button", "#4a90e2"),
+                      hover_color=self.theme.get("sidebar_button_hover", "#357ABD")).pack(side="left", padx=6)
+        ctk.CTkButton(top, text="Close", command=self.destroy,
+                      fg_color=self.theme.get("cancel_button", "#9a9a9a"),
+                      hover_color=self.theme.get("cancel_button_hover", "#7a7a7a")).pack(side="left")
+
+        # Scope: all chats or only the open one
+        self.this_chat_var = tk.BooleanVar(value=False)
+        self.this_chat = ctk.CTkCheckBox(self, text="Only this chat", variable=self.this_chat_var,
+                                         command=self._do_search,
+                                         text_color=self.theme.get("sidebar_text", "white"))
+        self.this_chat.pack(anchor="w", padx=12)
+        if not getattr(app, 'recipient_pub_hex', None):
+            self.this_chat.configure(state="disabled")
+
+        # Status
+        self.status_var = tk.StringVar(value="")
+        self.status = ctk.CTkLabel(self, textvariable=self.status_var,
+                                   text_color=self.theme.get("sidebar_text", "white"))
+        self.status.pack(fill="x", padx=12)
+
+        # Results
+        self.list_frame = ctk.CTkScrollableFrame(self, fg_color=self.theme.get("background", "#2e2e3f"))
+        self.list_frame.pack(fill="both", expand=True, padx=10, pady=(6, 10))
+        self.more_btn = None
+
+        try:
+            self.after(100, self.q.focus_set)
+        except Exception:
+            pass
+
+    # ----- UI helpers -----
+    def _set_status(self, msg: str):
+        try:
+            self.status_var.set(msg or "")
+        except Exception:
+            pass
+
+    def _schedule_search(self, _event=None):
+        try:
+            if self._search_after:
+                self.after_cancel(self._search_after)
+        except Exception:
+            pass
+        self._search_after = self.after(400, self._do_search)
+
+    def _scope(self):
+        if self.this_chat_var.get():
+            return getattr(self.app, 'recipient_pub_hex', None)
+        return None
+
+    def _name_for(self, pub_hex: str) -> str:
+        if pub_hex not in self._names:
+            try:
+                name = get_recipient_name(pub_hex, self.app.pin)
+            except Exception:
+                name = None
+            self._names[pub_hex] = name or f"Unknown-{pub_hex[:6]}"
+        return self._names[pub_hex]
+
+    # ----- Data loading -----
+    def _do_search(self):
+        self._query = (self.q.get() or "").strip()
+        self._offset = 0
+        self._generation += 1
+        for w in self.list_frame.winfo_children():
+            w.destroy()
+        self.more_btn = None
+        if not self._query:
+            self._set_status("")
+            return
+        self._load_page()
+
+    def _load_page(self):
+        query, offset, scope, generation = self._query, self._offset, self._scope(), self._generation
+
+        def work():
+            try:
+                return search_messages(self.app.keyring, query, pub_hex=scope, limit=self.PAGE_SIZE, offset=offset)
+            except Exception as e:
+                return e
+
+        def done(res):
+            if generation != self._generation:
+                return  # a newer search replaced this one
+            if isinstance(res, Exception):
+                self._set_status(f"Search failed: {res}")
+                return
+            self._offset += len(res)
+            self._render_items(res, more=len(res) >= self.PAGE_SIZE)
+            self._set_status(f"{self._offset} result(s)" if self._offset else "No messages found")
+
+        self._set_status("Searching…")
+        self._run_bg(work, done)
+
+    def _load_more(self):
+        if self.more_btn is not None:
+            self.more_btn.configure(state="disabled")
+        self._load_page()
+
+    def _run_bg(self, func, callback):
+        def runner():
+            try:
+                res = func()
+            except Exception as e:
+                res = e
+            try:
+                self.after(0, lambda: callback(res) if callable(callback) else None)
+            except Exception:
+                pass
+        threading.Thread(target=runner, daemon=True).start()
+
+    # ----- Rendering -----
+    def _render_items(self, items, more: bool):
+        if self.more_btn is not None:
+            self.more_btn.destroy()
+            self.more_btn = None
+        for pub_hex, ts, snippet in items:
+            row = ctk.CTkFrame(self.list_frame, fg_color=self.theme.get("input_bg", "#2e2e3f"), corner_radius=12)
+            row.pack(fill="x", padx=6, pady=4)
+            try:
+                when = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+            except Exception:
+                when = ""
+            head = ctk.CTkLabel(row, text=f"{self._name_for(pub_hex)}  ·  {when}", font=("Segoe UI", 11, "bold"),
+                                text_color=self.theme.get("sidebar_text", "white"), anchor="w")
+            head.pack(fill="x", padx=10, pady=(6, 0))
+            body = ctk.CTkLabel(row, text=snippet or "", font=("Segoe UI", 11), justify="left", anchor="w",
+                                wraplength=440, text_color=self.theme.get("pub_text", "#cfcfe1"))
+            body.pack(fill="x", padx=10, pady=(0, 6))
+            for w in (row, head, body):
+                w.bind("<Button-1>", lambda e, p=pub_hex, t=ts: self._open(p, t))
+        if more:
+            self.more_btn = ctk.CTkButton(self.list_frame, text="Load more", command=self._load_more,
+                                          fg_color=self.theme.get("button_send", "#4a90e2"),
+                                          hover_color=self.theme.get("button_send_hover", "#357ABD"))
+            self.more_btn.pack(pady=8)
+
+    # ----- Actions -----
+    def _open(self, pub_hex: str, ts: float):
+        if hasattr(self.app, 'chat_manager'):
+            self.app.chat_manager.jump_to_message(pub_hex, ts)
@@ -506,6 +506,13 @@ class Sidebar(ctk.CTkFrame):
                 groups = data.get("groups", [])
         except Exception:
             groups = []
+        # Unread badges come from server-side channel summaries (no message bodies fetched)
+        unread = {}
+        try:
+            if self.gm and groups:
+                unread = self.gm.unread_counts().get("groups", {})
+        except Exception:
+            unread = {}
 
         # filter by search
         q = (self.search_var.get() or "").strip().lower()
@@ -522,6 +529,13 @@ class Sidebar(ctk.CTkFrame):
             tag_txt = "Public" if g.get("is_public") else "Private"
             tag = ctk.CTkLabel(frame, text=tag_txt, fg_color="#3b3b52", corner_radius=8, width=60)
             tag.pack(side="left", padx=6)
+            badge = None
+            n_unread = int(unread.get(g.get("id"), 0) or 0)
+            if n_unread:
+                badge = ctk.CTkLabel(frame, text=str(n_unread) if n_unread < 100 else "99+",
+                                     fg_color=self.theme.get("sidebar_button", "#4a90e2"),
+                                     text_color=text_color, corner_radius=10, width=24)
+                badge.pack(side="right", padx=8)
 
             def open_group(gid=g.get("id"), n=g.get("name")):
                 if callable(self.open_group_callback):
@@ -542,6 +556,8 @@ class Sidebar(ctk.CTkFrame):
             frame.bind("<Button-1>", lambda e: open_group())
             name.bind("<Button-1>", lambda e: open_group())
             tag.bind("<Button-1>", lambda e: open_group())
+            if badge is not None:
+                badge.bind("<Button-1>", lambda e: open_group())
 
             # Hover
             frame.bind("<Enter>", lambda e, f=frame: f.configure(fg_color=hover_bg))
@@ -58,14 +58,11 @@ signal_rooms: dict[str, set] = {}
 signal_lock = threading.Lock()
 
 try:
-    from server_utils.analytics_backend.services.event_collector import register_message, register_attachment  # type: ignore
+    from server_utils.analytics_backend.services.event_collector import register_batch, start_flusher  # type: ignore
     ANALYTICS_ENABLED = True
 except Exception:
     ANALYTICS_ENABLED = False
-    def register_message(*args, **kwargs):
-        return None
-    def register_attachment(*args, **kwargs):
-        return None
+    register_batch = None
 
 if not REDIS_AVAILABLE:
     messages_store = {}
@@ -78,6 +75,18 @@ DEFAULTS = {
     "max_messages_per_second": 10,
     "message_ttl_seconds": 60,
     "attachment_max_size_bytes": 10 * 1024 * 1024,
+    "group_attachment_max_size_bytes": 4 * 1024 * 1024 * 1024,
+    "group_retention_interval_seconds": 3600,
+    "group_retention_max_age_seconds": 0,
+    "group_retention_max_rows_per_channel": 0,
+    "attachment_quota_bytes_per_user": 0,
+    "attachment_dm_ref_ttl_seconds": 30 * 24 * 3600,
+    "attachment_gc_interval_seconds": 3600,
+    "attachment_gc_grace_seconds": 3600,
+    "analytics_flush_interval_seconds": 5,
+    "analytics_retention_interval_seconds": 3600,
+    "analytics_log_max_bytes": 64 * 1024 * 1024,
+    "analytics_log_backups": 3,
 }
 
 config_path = os.path.join(os.path.dirname(__file__), "server_utils", "config", "settings.json")
@@ -95,6 +104,56 @@ MAX_MESSAGES_PER_RECIPIENT = int(cfg.get("max_messages_per_recipient", DEFAULTS[
 MAX_MESSAGES_PER_SECOND = int(cfg.get("max_messages_per_second", DEFAULTS["max_messages_per_second"]))
 MESSAGE_TTL = int(cfg.get("message_ttl_seconds", DEFAULTS["message_ttl_seconds"]))
 ATTACHMENT_MAX_SIZE = int(cfg.get("attachment_max_size_bytes", DEFAULTS["attachment_max_size_bytes"]))
+GROUP_ATTACHMENT_MAX_SIZE = int(cfg.get("group_attachment_max_size_bytes", DEFAULTS["group_attachment_max_size_bytes"]))
+ATTACHMENT_DM_REF_TTL = int(cfg.get("attachment_dm_ref_ttl_seconds", DEFAULTS["attachment_dm_ref_ttl_seconds"]))
+
+# Shared content-addressed attachment store (DM + groups) and its GC sweeper
+from server_utils import blob_store  # type: ignore
+blob_store.configure(
+    quota_bytes_per_user=int(cfg.get("attachment_quota_bytes_per_user", DEFAULTS["attachment_quota_bytes_per_user"])),
+    gc_grace_seconds=int(cfg.get("attachment_gc_grace_seconds", DEFAULTS["attachment_gc_grace_seconds"])),
+)
+# Group uploads (single and chunked) have their own, much larger size limit
+from server_utils.groups_backend import uploads as group_uploads  # type: ignore
+group_uploads.configure(max_upload_bytes=GROUP_ATTACHMENT_MAX_SIZE)
+try:
+    blob_store.start_gc_worker(int(cfg.get("attachment_gc_interval_seconds", DEFAULTS["attachment_gc_interval_seconds"])))
+except Exception as e:
+    print(f"⚠ Attachment GC worker disabled: {e}")
+
+# Group message retention worker (archives/prunes group_messages in the background)
+try:
+    from server_utils.groups_backend.retention import start_retention_worker  # type: ignore
+    # Only the process holding the retention lock file runs it (one per data dir)
+    start_retention_worker(
+        interval_seconds=int(cfg.get("group_retention_interval_seconds", DEFAULTS["group_retention_interval_seconds"])),
+        default_max_age_seconds=int(cfg.get("group_retention_max_age_seconds", DEFAULTS["group_retention_max_age_seconds"])),
+        default_max_rows_per_channel=int(cfg.get("group_retention_max_rows_per_channel", DEFAULTS["group_retention_max_rows_per_channel"])),
+    )
+except Exception as e:
+    print(f"⚠ Group retention worker disabled: {e}")
+
+# Analytics: handlers only enqueue; a background worker aggregates, updates Redis
+# counters or appends the event log (see server_utils/analytics_queue.py)
+from server_utils import analytics_queue  # type: ignore
+analytics_queue.configure(
+    aggregate=register_batch,
+    redis_client=r if REDIS_AVAILABLE else None,
+    write_log=not REDIS_AVAILABLE,
+    log_max_bytes=int(cfg.get("analytics_log_max_bytes", DEFAULTS["analytics_log_max_bytes"])),
+    log_backups=int(cfg.get("analytics_log_backups", DEFAULTS["analytics_log_backups"])),
+)
+analytics_queue.start_worker()
+
+# Analytics rollup flusher (persists the aggregated deltas)
+if ANALYTICS_ENABLED:
+    try:
+        start_flusher(
+            interval_seconds=int(cfg.get("analytics_flush_interval_seconds", DEFAULTS["analytics_flush_interval_seconds"])),
+            retention_interval_seconds=int(cfg.get("analytics_retention_interval_seconds", DEFAULTS["analytics_retention_interval_seconds"])),
+        )
+    except Exception as e:
+        print(f"⚠ Analytics flusher disabled: {e}")
 
 server_private = PrivateKey.generate()
 server_public = server_private.public_key
@@ -120,10 +179,6 @@ class AttachmentUpload(BaseModel):
 attachments_store = {}
 attachments_lock = threading.Lock()
 
-# Persistent attachment storage directory (for recipient attachments)
-ATT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'server_utils', 'data', 'attachments'))
-os.makedirs(ATT_DIR, exist_ok=True)
-
 # Persistent server inbox (SQLite)
 DB_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'server_utils', 'data'))
 os.makedirs(DB_DIR, exist_ok=True)
@@ -320,25 +375,6 @@ async def send_message(msg: Message):
             except Exception:
                 pass
 
-        try:
-            import datetime, math, json
-            dt_utc = datetime.datetime.utcfromtimestamp(now)
-            day_key = dt_utc.strftime('%Y%m%d')
-            hour_key = dt_utc.strftime('%Y%m%d%H')
-            size_bytes = len(base64.b64decode(msg.message)) if msg.message else 0
-            pipe = r.pipeline()
-            pipe.incr(f'metrics:messages:count:{day_key}')
-            if size_bytes:
-                pipe.incrby(f'metrics:messages:bytes:{day_key}', size_bytes)
-            pipe.incr(f'metrics:messages:day:{day_key}')
-            pipe.incr(f'metrics:messages:hour:{hour_key}')
-            pipe.sadd('metrics:users:all', msg.from_)
-            pipe.sadd(f'metrics:users:new:{day_key}', msg.from_)
-            pipe.zadd('metrics:active_users', {msg.from_: now})
-            pipe.zremrangebyscore('metrics:active_users', 0, now - 86400)
-            pipe.execute()
-        except Exception:
-            pass
     else:
         with store_lock:
             timestamps = rate_limit_store.get(msg.from_, [])
@@ -369,27 +405,10 @@ async def send_message(msg: Message):
         except Exception:
             pass
 
-    try:
-        size_bytes = len(base64.b64decode(msg.message))
-    except Exception:
-        size_bytes = len(msg.message)
-    register_message(size_bytes=size_bytes, sender=msg.from_, recipient=msg.to, ts=stored_msg["timestamp"])
-
-    if not REDIS_AVAILABLE:
-        try:
-            from pathlib import Path
-            import json
-            log_path = Path('analytics_events.log')
-            event = {
-                'ts': stored_msg["timestamp"],
-                'size': size_bytes,
-                'from': msg.from_,
-                'to': msg.to
-            }
-            with log_path.open('a', encoding='utf-8') as f:
-                f.write(json.dumps(event, separators=(',', ':')) + '\n')
-        except Exception:
-            pass
+    # Decoded payload size from the base64 length (no need to decode it again)
+    m = msg.message or ""
+    size_bytes = len(m) * 3 // 4 - m[-2:].count("=")
+    analytics_queue.enqueue("message", size_bytes, msg.from_, msg.to, stored_msg["timestamp"])
 
     try:
         # Broadcast to recipient and also to sender (if sender has active WS)
@@ -465,87 +484,76 @@ def upload_attachment(att: AttachmentUpload):
     if not isinstance(att.sha256, str) or not re.fullmatch(r"[0-9a-fA-F]{64}", att.sha256):
         raise HTTPException(status_code=400, detail="Invalid attachment id")
     import base64, hashlib, time as _time
+    safe_name = att.sha256.lower()
+    now = _time.time()
+
+    # Always verify, also for content that is already stored: the hash is the proof
+    # that the sender holds these bytes (blob_store.put skips the write for duplicates).
     try:
         blob_bytes = base64.b64decode(att.blob)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid blob base64")
-    calc_hash = hashlib.sha256(blob_bytes).hexdigest()
-    if calc_hash != att.sha256:
+    if hashlib.sha256(blob_bytes).hexdigest() != safe_name:
         raise HTTPException(status_code=400, detail="sha256 mismatch")
-    now = _time.time()
+    expires_at = now + ATTACHMENT_DM_REF_TTL if ATTACHMENT_DM_REF_TTL > 0 else None
+    path = None
+    try:
+        blob_store.put(blob_bytes, safe_name, "dm", f"{att.from_}:{att.to}", owner=att.from_, expires_at=expires_at)
+        path = blob_store.locate(safe_name)
+    except blob_store.QuotaExceeded:
+        raise HTTPException(status_code=413, detail="Attachment quota exceeded")
+    except Exception:
+        # If disk write fails, still keep in-memory store as fallback
+        pass
     with attachments_lock:
-        # Persist raw blob to disk for durability and lazy download
-        safe_name = att.sha256.lower()
-        path = os.path.join(ATT_DIR, f"{safe_name}.bin")
-        if not os.path.exists(path):
-            try:
-                tmp = path + '.tmp'
-                with open(tmp, 'wb') as f:
-                    f.write(blob_bytes)
-                    try: f.flush(); os.fsync(f.fileno())
-                    except Exception: pass
-                os.replace(tmp, path)
-            except Exception:
-                # If disk write fails, still keep in-memory store as fallback
-                pass
-        attachments_store[safe_name] = {
+        entry = attachments_store.setdefault(safe_name, {"blob": None, "path": None, "grants": {}})
+        if path:
+            entry["path"] = path
+            entry["blob"] = None  # served from the blob store
+        elif entry["blob"] is None:
+            entry["blob"] = att.blob  # verified above
+        # One grant per recipient, so a second sender of the same bytes doesn't lock out the first
+        entry["grants"][att.to] = {
             "from": att.from_,
-            "to": att.to,
             "enc_pub": att.enc_pub,
-            "blob": att.blob,
             "name": att.name,
             "size": att.size,
             "ts": now,
-            "path": path if os.path.exists(path) else None,
         }
 
-    try:
-        register_attachment(size_bytes=att.size, sender=att.from_, recipient=att.to, ts=now)
-        if REDIS_AVAILABLE:
-            import datetime as _dt
-            day_key = _dt.datetime.utcfromtimestamp(now).strftime('%Y%m%d')
-            hour_key = _dt.datetime.utcfromtimestamp(now).strftime('%Y%m%d%H')
-            try:
-                pipe = r.pipeline()
-                pipe.incr(f'metrics:attachments:count:{day_key}')
-                pipe.incrby(f'metrics:attachments:bytes:{day_key}', att.size)
-                pipe.incr(f'metrics:attachments:hour:{hour_key}')
-                pipe.execute()
-            except Exception:
-                pass
-        else:
-            try:
-                from pathlib import Path
-                import json as _json
-                log_path = Path('analytics_events.log')
-                event = {
-                    'ts': now,
-                    'size': att.size,
-                    'from': att.from_,
-                    'to': att.to,
-                    'type': 'attachment'
-                }
-                with log_path.open('a', encoding='utf-8') as f:
-                    f.write(_json.dumps(event, separators=(',', ':')) + '\n')
-            except Exception:
-                pass
-    except Exception:
-        pass
+    analytics_queue.enqueue("attachment", att.size, att.from_, att.to, now)
     return {"att_id": att.sha256, "status": "ok"}
 
 
-@app.get("/download/{att_id}")
-def download_attachment(att_id: str, recipient: str):
+def _attachment_grant(att_id: str, recipient: str):
+    """(entry, grant) for a live upload of att_id, (None, None) if unknown or expired.
+
+    Raises 403 if the attachment is known but was not sent to recipient.
+    """
     import time as _time
     with attachments_lock:
         entry = attachments_store.get(att_id)
-        if entry and _time.time() - entry.get("ts", 0) > MESSAGE_TTL:
+        if not entry:
+            return None, None
+        now = _time.time()
+        for to in [t for t, g in entry["grants"].items() if now - g.get("ts", 0) > MESSAGE_TTL]:
+            entry["grants"].pop(to, None)
+        if not entry["grants"]:
             attachments_store.pop(att_id, None)
-            entry = None
+            return None, None
+        grant = entry["grants"].get(recipient)
+        if grant is None:
+            raise HTTPException(status_code=403, detail="Not authorized for this attachment")
+        return entry, grant
+
+
+@app.get("/download/{att_id}")
+def download_attachment(att_id: str, recipient: str):
+    entry, grant = _attachment_grant(att_id, recipient)
     if not entry:
         # Try disk fallback for persisted uploads
-        path = os.path.join(ATT_DIR, f"{att_id}.bin")
-        if os.path.exists(path):
+        path = blob_store.locate(att_id)
+        if path:
             try:
                 with open(path, 'rb') as f:
                     blob_bytes = f.read()
@@ -563,32 +571,32 @@ def download_attachment(att_id: str, recipient: str):
             except Exception:
                 raise HTTPException(status_code=404, detail="Not found")
         raise HTTPException(status_code=404, detail="Not found")
-    if entry.get("to") != recipient:
-        raise HTTPException(status_code=403, detail="Not authorized for this attachment")
+    blob_b64 = entry["blob"]
+    if blob_b64 is None:
+        path = entry.get("path") or blob_store.locate(att_id)
+        if not path or not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Not found")
+        import base64
+        with open(path, 'rb') as f:
+            blob_b64 = base64.b64encode(f.read()).decode()
     return {
         "att_id": att_id,
-        "blob": entry["blob"],
-        "name": entry["name"],
-        "size": entry["size"],
-        "from": entry["from"],
-        "to": entry["to"],
+        "blob": blob_b64,
+        "name": grant["name"],
+        "size": grant["size"],
+        "from": grant["from"],
+        "to": recipient,
     }
 
 
 @app.get('/download/raw/{att_id}')
 def download_attachment_raw(att_id: str, recipient: str):
     # Stream raw bytes for clients that prefer direct binary download
-    with attachments_lock:
-        entry = attachments_store.get(att_id)
-    path = None
-    if entry:
-        if entry.get('to') != recipient:
-            raise HTTPException(status_code=403, detail='Not authorized for this attachment')
-        path = entry.get('path')
+    entry, _grant = _attachment_grant(att_id, recipient)
+    path = entry.get('path') if entry else None
     # fallback to disk path
-    disk_path = os.path.join(ATT_DIR, f"{att_id}.bin")
-    if not path and os.path.exists(disk_path):
-        path = disk_path
+    if not path:
+        path = blob_store.locate(att_id)
     if not path or not os.path.exists(path):
         raise HTTPException(status_code=404, detail='Not found')
     def iterfile():
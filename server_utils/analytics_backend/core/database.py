@@ -0,0 +1,30 @@
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+try:
+    from .config import get_settings
+    DATABASE_URL = get_settings().database_url
+except Exception:  # settings backend unavailable (e.g. imported from server.py without pydantic-settings)
+    DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./analytics.db")
+
+_connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+engine = create_engine(DATABASE_URL, connect_args=_connect_args)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+if DATABASE_URL.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        # The chat server writes rollups while the analytics API reads them
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA busy_timeout=5000")
+        cur.close()
+
+
+def init_db() -> None:
+    from ..models.base import Base
+    from ..models import metrics  # noqa: F401  (register tables)
+    Base.metadata.create_all(bind=engine)
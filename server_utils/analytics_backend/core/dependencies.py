@@ -0,0 +1,34 @@
+"""Reusable FastAPI dependencies for bearer-token auth (analytics and groups admin)."""
+from typing import Optional
+
+from fastapi import Header, HTTPException, status
+
+from .config import get_settings
+from .security import decode_token
+
+
+def _bearer(authorization: Optional[str]) -> Optional[str]:
+    if not authorization or not authorization.lower().startswith('bearer '):
+        return None
+    parts = authorization.split()
+    return parts[1] if len(parts) > 1 else None
+
+
+def require_user(authorization: Optional[str] = Header(None)) -> str:
+    """Subject of the bearer token; 401 when missing or invalid."""
+    token = _bearer(authorization)
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    sub = decode_token(token)
+    if not sub:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return sub
+
+
+def admin_token(authorization: Optional[str] = Header(None)) -> bool:
+    """True when a bearer token is present and belongs to the configured admin."""
+    token = _bearer(authorization)
+    if not token:
+        return False
+    sub = decode_token(token)
+    return bool(sub) and sub == get_settings().admin_username
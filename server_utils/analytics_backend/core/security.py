@@ -1,11 +1,21 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
+import hashlib
+import threading
+import time
 import jwt
 from passlib.context import CryptContext
 from .config import get_settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Verified tokens: sha256(token) -> (subject, exp). Polling dashboards send the same
+# token every few seconds, so skip the HMAC check + JSON decode until it expires.
+TOKEN_CACHE_SIZE = 256
+_verified: "OrderedDict[bytes, tuple[str, float]]" = OrderedDict()
+_verified_lock = threading.Lock()
+
 
 def verify_password(plain_password: str, stored_password: str, stored_hash: str | None = None) -> bool:
     if stored_hash:
@@ -29,10 +39,40 @@ def create_access_token(subject: str, expires_minutes: Optional[int] = None) ->
     return token
 
 
-def decode_token(token: str) -> Optional[str]:
+def _decode_uncached(token: str) -> Optional[dict]:
     settings = get_settings()
     try:
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        return payload.get("sub")
+        return jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
     except Exception:
         return None
+
+
+def decode_token(token: str) -> Optional[str]:
+    """Subject of a valid token, or None. Results are cached per token until its exp."""
+    if not token:
+        return None
+    key = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    with _verified_lock:
+        hit = _verified.get(key)
+        if hit is not None:
+            if hit[1] > now:
+                _verified.move_to_end(key)
+                return hit[0]
+            del _verified[key]
+    payload = _decode_uncached(token)
+    if not payload:
+        return None
+    sub = payload.get("sub")
+    exp = payload.get("exp")
+    if sub is None or not isinstance(exp, (int, float)):
+        # Never cache tokens without an expiry
+        return sub
+    with _verified_lock:
+        if len(_verified) >= TOKEN_CACHE_SIZE:
+            for k in [k for k, v in _verified.items() if v[1] <= now]:
+                del _verified[k]
+            while len(_verified) >= TOKEN_CACHE_SIZE:
+                _verified.popitem(last=False)
+        _verified[key] = (sub, float(exp))
+    return sub
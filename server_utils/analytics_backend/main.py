@@ -4,6 +4,7 @@ from .routes import auth as auth_routes
 from .routes import stats as stats_routes
 from server_utils.groups_backend import routes as groups_routes
 from .core.config import get_settings
+from .services import event_collector, log_ingester, metrics_service
 
 """Whispr Analytics Backend
 
@@ -29,6 +30,18 @@ app.include_router(stats_routes.router)
 # Expose groups management endpoints under /api (so frontend can call /api/groups/...)
 app.include_router(groups_routes.router, prefix="/api")
 
+@app.on_event("startup")
+def _start_rollups():
+    event_collector.start_flusher()
+    log_ingester.start_ingester()
+    metrics_service.start_system_sampler()
+
+@app.on_event("shutdown")
+def _stop_rollups():
+    metrics_service.stop_system_sampler()
+    log_ingester.stop_ingester()
+    event_collector.stop_flusher()
+
 @app.get('/health')
 async def health():
     return {"status": "ok"}
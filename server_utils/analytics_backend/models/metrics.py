@@ -1,22 +1,34 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, String, Float, BigInteger, LargeBinary
 from .base import Base
 
-class MessageMetric(Base):
-    __tablename__ = 'message_metrics'
-    id = Column(Integer, primary_key=True, index=True)
-    period = Column(String, index=True)  # e.g. 'hour', 'day'
-    period_start = Column(DateTime, index=True)
-    message_count = Column(Integer, default=0)
-    avg_message_size = Column(Float, default=0.0)
-    created_at = Column(DateTime, server_default=func.now())
+class MetricRollup(Base):
+    """Event counters pre-aggregated per time bucket.
 
-class UserMetric(Base):
-    __tablename__ = 'user_metrics'
-    id = Column(Integer, primary_key=True, index=True)
-    total_users = Column(Integer, default=0)
-    active_users = Column(Integer, default=0)
-    new_users = Column(Integer, default=0)
-    period = Column(String, index=True)
-    period_start = Column(DateTime, index=True)
-    created_at = Column(DateTime, server_default=func.now())
+    One row per (kind, granularity, period_start); the collector adds to count/bytes
+    with upserts, so dashboard queries never touch raw events.
+    """
+    __tablename__ = 'metric_rollups'
+    kind = Column(String, primary_key=True)  # 'message' | 'attachment'
+    granularity = Column(String, primary_key=True)  # 'minute' | 'hour' | 'day'
+    period_start = Column(Integer, primary_key=True)  # unix seconds, UTC, bucket aligned
+    count = Column(Integer, nullable=False, default=0)
+    bytes = Column(BigInteger, nullable=False, default=0)
+
+class HllSketch(Base):
+    """HyperLogLog registers for distinct-user counts (constant size per sketch).
+
+    Names: 'users:all', 'users:before:<day>' (snapshot of users:all taken at the
+    first flush of that UTC day) and 'users:active:<minute>'.
+    """
+    __tablename__ = 'hll_sketches'
+    name = Column(String, primary_key=True)
+    registers = Column(LargeBinary, nullable=False)
+    updated_at = Column(Float, nullable=False, index=True)
+
+class IngestCursor(Base):
+    """How far the log ingester has read a file (inode + byte offset), across restarts."""
+    __tablename__ = 'ingest_cursors'
+    path = Column(String, primary_key=True)
+    inode = Column(BigInteger, nullable=False, default=0)
+    byte_offset = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(Float, nullable=False)
@@ -1,36 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header, Response
-from ..services.metrics_service import get_system_stats, get_user_stats, get_message_stats, get_attachment_stats
+import asyncio
+import json
+import time
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Response, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from ..services.metrics_service import get_system_stats, get_user_stats, get_message_stats, get_attachment_stats, get_dashboard
 from ..core.security import decode_token
+from ..core.dependencies import require_user
+from ..services import export_service
+from ..services.live_feed import feed
 
 router = APIRouter(prefix="/api/stats", tags=["stats"])
 
-def _auth(authorization: str = Header(None)):
-    if not authorization or not authorization.lower().startswith('bearer '):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    token = authorization.split()[1]
-    sub = decode_token(token)
-    if not sub:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    return sub
+def _auth_header_or_query(authorization: str = Header(None), token: str | None = Query(None)):
+    # EventSource and browser WebSockets can't set headers, so accept ?token= too
+    if token:
+        sub = decode_token(token)
+        if not sub:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        return sub
+    return require_user(authorization)
 
 @router.get('/system')
-async def system_stats(user=Depends(_auth)):
+async def system_stats(user=Depends(require_user)):
     return get_system_stats()
 
 @router.get('/users')
-async def user_stats(user=Depends(_auth)):
+async def user_stats(user=Depends(require_user)):
     return get_user_stats()
 
 @router.get('/messages')
-async def message_stats(user=Depends(_auth)):
+async def message_stats(user=Depends(require_user)):
     return get_message_stats()
 
 @router.get('/attachments')
-async def attachment_stats(user=Depends(_auth)):
+async def attachment_stats(user=Depends(require_user)):
     return get_attachment_stats()
 
+@router.get('/dashboard')
+async def dashboard(user=Depends(require_user)):
+    return get_dashboard()
+
 @router.get('/export.csv')
-async def export_csv(user=Depends(_auth)):
+async def export_csv(user=Depends(require_user)):
     sys_stats = get_system_stats()
     user_stats = get_user_stats()
     msg_stats = get_message_stats()
@@ -55,3 +66,75 @@ async def export_csv(user=Depends(_auth)):
     ]
     content = '\n'.join(lines)
     return Response(content, media_type='text/csv', headers={'Content-Disposition': 'attachment; filename="analytics_export.csv"'})
+
+@router.get('/export')
+async def export_rollups(
+    start: str | None = Query(None, description="unix seconds or ISO 8601; default: 30 days ago"),
+    end: str | None = Query(None, description="unix seconds or ISO 8601 (exclusive); default: now"),
+    granularity: str = Query('hour'),
+    kind: str | None = Query(None),
+    format: str = Query('csv'),
+    user=Depends(require_user),
+):
+    """Stream persisted rollups for a time range as CSV or Parquet."""
+    now = time.time()
+    try:
+        export_service.validate(granularity, kind)
+        t_end = export_service.parse_time(end, now)
+        t_start = export_service.parse_time(start, t_end - 30 * 86400)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if t_start >= t_end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    name = f'analytics_{granularity}_{int(t_start)}_{int(t_end)}'
+    if format == 'parquet':
+        if not export_service.PARQUET_AVAILABLE:
+            raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+        return StreamingResponse(
+            export_service.parquet_stream(granularity, t_start, t_end, kind),
+            media_type='application/vnd.apache.parquet',
+            headers={'Content-Disposition': f'attachment; filename="{name}.parquet"'},
+        )
+    if format != 'csv':
+        raise HTTPException(status_code=400, detail="format must be csv or parquet")
+    return StreamingResponse(
+        export_service.csv_stream(granularity, t_start, t_end, kind),
+        media_type='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{name}.csv"'},
+    )
+
+# Seconds between SSE comments that keep idle proxies from closing the stream
+SSE_KEEPALIVE_SECONDS = 15
+
+@router.get('/stream')
+async def stream(user=Depends(_auth_header_or_query)):
+    """Server-sent events: a snapshot, then deltas every tick (see services/live_feed.py)."""
+    async def events():
+        q = feed.subscribe()
+        try:
+            while True:
+                try:
+                    msg = await asyncio.wait_for(q.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {msg['type']}\nid: {msg['seq']}\ndata: {json.dumps(msg, separators=(',', ':'))}\n\n"
+        finally:
+            feed.unsubscribe(q)
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@router.websocket('/ws')
+async def stats_ws(websocket: WebSocket, token: str | None = Query(None)):
+    """WebSocket variant of /stream (token as ?token=)."""
+    if not token or not decode_token(token):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    q = feed.subscribe()
+    try:
+        while True:
+            await websocket.send_json(await q.get())
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        feed.unsubscribe(q)
@@ -1,47 +1,106 @@
-"""In-memory aggregation of message and user analytics.
+"""Rollup-based aggregation of message and user analytics.
 
-This avoids hitting a database for each dashboard refresh while providing
-quick approximate stats. For production persistence, mirror updates to
-SQLAlchemy models and periodically compact.
+register_message / register_attachment only add to small in-memory deltas keyed
+by (kind, granularity, bucket start); a background flusher upserts them into the
+metric_rollups table (minute, hour and day granularity) every few seconds, so
+counts survive restarts and are shared by every process using the same analytics
+database. Distinct users are counted with HyperLogLog sketches (hll_sketches), so
+user stats take constant space and time however many senders there are. Old
+buckets are dropped by a timed retention pass rather than on each event. The
+get_*_stats readers only read the precomputed rollups and sketches and add the
+in-memory deltas on top; they never flush.
 """
 from __future__ import annotations
 
-from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
 from threading import Lock
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from ..core.database import engine, init_db
+from .hll import HyperLogLog
 
 UTC = timezone.utc
 
 lock = Lock()
 
-@dataclass
-class HourBucket:
-    count: int = 0
-    bytes: int = 0
-
-@dataclass
-class DayBucket:
-    count: int = 0
-    bytes: int = 0
-
-# Aggregates
-hour_buckets: Dict[datetime, HourBucket] = {}
-day_buckets: Dict[datetime, DayBucket] = {}
-# Separate attachment aggregates (kept distinct to avoid mixing semantics)
-att_hour_buckets: Dict[datetime, HourBucket] = {}
-att_day_buckets: Dict[datetime, DayBucket] = {}
-first_seen: Dict[str, datetime] = {}
-last_seen: Dict[str, datetime] = {}
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+GRANULARITIES = (('minute', MINUTE), ('hour', HOUR), ('day', DAY))
 
 RETENTION_DAYS = 7
 ACTIVE_WINDOW_SECONDS = 300  # 5 minutes
+# How long each rollup granularity is kept
+MINUTE_RETENTION_SECONDS = 2 * DAY
+HOUR_RETENTION_SECONDS = (RETENTION_DAYS + 1) * DAY
+DAY_RETENTION_SECONDS = 400 * DAY
+
+FLUSH_INTERVAL_SECONDS = 5
+RETENTION_INTERVAL_SECONDS = 3600
+
+# Pending deltas not yet written: (kind, granularity, period_start) -> [count, bytes]
+_pending: Dict[Tuple[str, str, int], List[int]] = {}
+# sender -> last event ts, folded into the HLL sketches on flush
+_pending_users: Dict[str, float] = {}
+
+_db_ready = False
+_db_lock = Lock()
+_flush_lock = Lock()
+_stop = threading.Event()
+_worker: Optional[threading.Thread] = None
+
+_UPSERT_ROLLUP = text(
+    "INSERT INTO metric_rollups(kind, granularity, period_start, count, bytes) "
+    "VALUES (:kind, :gran, :start, :count, :bytes) "
+    "ON CONFLICT(kind, granularity, period_start) DO UPDATE SET "
+    "count = metric_rollups.count + excluded.count, bytes = metric_rollups.bytes + excluded.bytes"
+)
+_UPSERT_SKETCH = text(
+    "INSERT INTO hll_sketches(name, registers, updated_at) VALUES (:name, :regs, :now) "
+    "ON CONFLICT(name) DO UPDATE SET registers = excluded.registers, updated_at = excluded.updated_at"
+)
+_SNAPSHOT_SKETCH = text(
+    "INSERT INTO hll_sketches(name, registers, updated_at) VALUES (:name, :regs, :now) "
+    "ON CONFLICT(name) DO NOTHING"
+)
+SKETCH_ALL = 'users:all'
+
+
+def ensure_db() -> None:
+    global _db_ready
+    if _db_ready:
+        return
+    with _db_lock:
+        if not _db_ready:
+            init_db()
+            _db_ready = True
+
 
-def _truncate_hour(dt: datetime) -> datetime:
-    return dt.replace(minute=0, second=0, microsecond=0, tzinfo=UTC)
+def _record_locked(kind: str, size_bytes: int, sender: str, ts: float | None) -> None:
+    now = time.time() if ts is None else float(ts)
+    sec = int(now)
+    size_bytes = int(size_bytes or 0)
+    for gran, width in GRANULARITIES:
+        key = (kind, gran, sec - sec % width)
+        acc = _pending.get(key)
+        if acc is None:
+            _pending[key] = [1, size_bytes]
+        else:
+            acc[0] += 1
+            acc[1] += size_bytes
+    if sender and now > _pending_users.get(sender, 0.0):
+        _pending_users[sender] = now
+
+
+def _record(kind: str, size_bytes: int, sender: str, ts: float | None) -> None:
+    with lock:
+        _record_locked(kind, size_bytes, sender, ts)
 
-def _truncate_day(dt: datetime) -> datetime:
-    return dt.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=UTC)
 
 def register_message(size_bytes: int, sender: str, recipient: str, ts: float | None = None) -> None:
     """Record a message event.
@@ -50,171 +109,272 @@ def register_message(size_bytes: int, sender: str, recipient: str, ts: float | N
     sender / recipient: user identifiers (NOT stored beyond aggregation)
     ts: unix timestamp (seconds)
     """
-    if ts is None:
-        now = datetime.now(UTC)
-    else:
-        now = datetime.fromtimestamp(ts, UTC)
-
-    hour_key = _truncate_hour(now)
-    day_key = _truncate_day(now)
+    _record('message', size_bytes, sender, ts)
 
-    with lock:
-        hb = hour_buckets.get(hour_key)
-        if hb is None:
-            hb = HourBucket()
-            hour_buckets[hour_key] = hb
-        hb.count += 1
-        hb.bytes += size_bytes
-
-        db = day_buckets.get(day_key)
-        if db is None:
-            db = DayBucket()
-            day_buckets[day_key] = db
-        db.count += 1
-        db.bytes += size_bytes
-
-        if sender not in first_seen:
-            first_seen[sender] = day_key
-        last_seen[sender] = now
-
-        _retention_cleanup()
 
 def register_attachment(size_bytes: int, sender: str, recipient: str, ts: float | None = None) -> None:
-    """Record an attachment event (encrypted payload size)."""
-    if ts is None:
-        now = datetime.now(UTC)
-    else:
-        now = datetime.fromtimestamp(ts, UTC)
-    hour_key = _truncate_hour(now)
-    day_key = _truncate_day(now)
+    """Record an attachment event (encrypted payload size). Attachments count as user activity."""
+    _record('attachment', size_bytes, sender, ts)
+
+
+def register_batch(events) -> None:
+    """Record many (kind, size_bytes, sender, recipient, ts) events under one lock acquisition."""
     with lock:
-        hb = att_hour_buckets.get(hour_key)
-        if hb is None:
-            hb = HourBucket()
-            att_hour_buckets[hour_key] = hb
-        hb.count += 1
-        hb.bytes += size_bytes
-
-        db = att_day_buckets.get(day_key)
-        if db is None:
-            db = DayBucket()
-            att_day_buckets[day_key] = db
-        db.count += 1
-        db.bytes += size_bytes
-
-        # Track users (attachments count as activity)
-        if sender not in first_seen:
-            first_seen[sender] = day_key
-        last_seen[sender] = now
-
-        _retention_cleanup()
-
-def _retention_cleanup():
-    cutoff = datetime.now(UTC) - timedelta(days=RETENTION_DAYS + 1)
-    # Remove old hour buckets
-    for bucket_map in (hour_buckets, att_hour_buckets):
-        for k in list(bucket_map.keys()):
-            if k < cutoff:
-                del bucket_map[k]
-    # Remove old day buckets beyond retention
-    for bucket_map in (day_buckets, att_day_buckets):
-        for k in list(bucket_map.keys()):
-            if k < cutoff:
-                del bucket_map[k]
+        for kind, size_bytes, sender, _recipient, ts in events:
+            _record_locked('attachment' if kind == 'attachment' else 'message', size_bytes, sender, ts)
+
+
+def flush() -> int:
+    """Write pending deltas to the rollup tables. Returns rollup rows touched."""
+    global _pending, _pending_users
+    with _flush_lock:
+        with lock:
+            if not _pending and not _pending_users:
+                return 0
+            rollups, users = _pending, _pending_users
+            _pending, _pending_users = {}, {}
+        try:
+            ensure_db()
+            with engine.begin() as conn:
+                if rollups:
+                    conn.execute(_UPSERT_ROLLUP, [
+                        {'kind': k, 'gran': g, 'start': s, 'count': c, 'bytes': b}
+                        for (k, g, s), (c, b) in rollups.items()
+                    ])
+                if users:
+                    days = {s for (_, g, s) in rollups if g == 'day'}
+                    _flush_sketches(conn, users, days)
+        except Exception:
+            # Put the deltas back so the next flush retries them
+            with lock:
+                for key, (c, b) in rollups.items():
+                    acc = _pending.setdefault(key, [0, 0])
+                    acc[0] += c
+                    acc[1] += b
+                for user, seen in users.items():
+                    if seen > _pending_users.get(user, 0.0):
+                        _pending_users[user] = seen
+            raise
+        return len(rollups)
+
+
+def _load_sketch(conn, name: str) -> Optional[HyperLogLog]:
+    row = conn.execute(text("SELECT registers FROM hll_sketches WHERE name = :name"), {'name': name}).first()
+    return HyperLogLog(row[0]) if row else None
+
+
+def _flush_sketches(conn, users: Dict[str, float], days) -> None:
+    """Fold a batch of senders into users:all and the per-minute active sketches."""
+    now = time.time()
+    total = _load_sketch(conn, SKETCH_ALL) or HyperLogLog()
+    # New users of a day = |users:all| now minus |users:all| before the day's
+    # first flush, so snapshot users:all before merging this batch into it
+    today = int(now) - int(now) % DAY
+    for day in sorted(days):
+        if day >= today - DAY:
+            conn.execute(_SNAPSHOT_SKETCH, {'name': f'users:before:{day}', 'regs': total.to_bytes(), 'now': now})
+    by_minute: Dict[int, List[str]] = {}
+    for user, seen in users.items():
+        total.add(user)
+        sec = int(seen)
+        by_minute.setdefault(sec - sec % MINUTE, []).append(user)
+    conn.execute(_UPSERT_SKETCH, {'name': SKETCH_ALL, 'regs': total.to_bytes(), 'now': now})
+    for minute, members in by_minute.items():
+        if minute < now - ACTIVE_WINDOW_SECONDS - MINUTE:
+            continue  # replayed old events can't affect the active window
+        name = f'users:active:{minute}'
+        sketch = _load_sketch(conn, name) or HyperLogLog()
+        sketch.update(members)
+        conn.execute(_UPSERT_SKETCH, {'name': name, 'regs': sketch.to_bytes(), 'now': now})
+    conn.execute(
+        text("DELETE FROM hll_sketches WHERE name LIKE 'users:active:%' AND updated_at < :cutoff"),
+        {'cutoff': now - 2 * ACTIVE_WINDOW_SECONDS},
+    )
+
+
+def run_retention(now: float | None = None) -> int:
+    """Drop rollup buckets older than their granularity's retention. Returns rows deleted."""
+    now = time.time() if now is None else now
+    ensure_db()
+    deleted = 0
+    with engine.begin() as conn:
+        for gran, keep in (('minute', MINUTE_RETENTION_SECONDS), ('hour', HOUR_RETENTION_SECONDS), ('day', DAY_RETENTION_SECONDS)):
+            res = conn.execute(
+                text("DELETE FROM metric_rollups WHERE granularity = :gran AND period_start < :cutoff"),
+                {'gran': gran, 'cutoff': int(now - keep)},
+            )
+            deleted += res.rowcount or 0
+        # Day snapshots are only read on their own day
+        res = conn.execute(
+            text("DELETE FROM hll_sketches WHERE name != :all AND updated_at < :cutoff"),
+            {'all': SKETCH_ALL, 'cutoff': now - 2 * DAY},
+        )
+        deleted += res.rowcount or 0
+    return deleted
+
+
+def start_flusher(interval_seconds: int = FLUSH_INTERVAL_SECONDS, retention_interval_seconds: int = RETENTION_INTERVAL_SECONDS) -> threading.Thread:
+    """Start (once) a daemon thread flushing deltas and running retention on a timer."""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    _stop.clear()
+
+    def _loop():
+        next_retention = 0.0
+        while not _stop.is_set():
+            try:
+                flush()
+            except Exception as e:
+                print(f"[analytics] rollup flush failed: {e}")
+            if time.time() >= next_retention:
+                try:
+                    run_retention()
+                except Exception as e:
+                    print(f"[analytics] rollup retention failed: {e}")
+                next_retention = time.time() + max(60, int(retention_interval_seconds))
+            _stop.wait(max(1, int(interval_seconds)))
+
+    _worker = threading.Thread(target=_loop, name="analytics-flusher", daemon=True)
+    _worker.start()
+    return _worker
+
+
+def stop_flusher() -> None:
+    _stop.set()
+    try:
+        flush()
+    except Exception:
+        pass
+
+
+atexit.register(stop_flusher)
+
+
+def _read_rollups(kind: str, granularity: str, since: int) -> Dict[int, Tuple[int, int]]:
+    """Stored rollups plus the deltas not flushed yet; never writes.
+
+    Holding _flush_lock only waits out a flush already in progress (its deltas are
+    neither pending nor committed while it runs), so stored + pending is exact.
+    """
+    ensure_db()
+    with _flush_lock:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT period_start, count, bytes FROM metric_rollups "
+                     "WHERE kind = :kind AND granularity = :gran AND period_start >= :since"),
+                {'kind': kind, 'gran': granularity, 'since': int(since)},
+            ).fetchall()
+        out = {int(r[0]): (int(r[1] or 0), int(r[2] or 0)) for r in rows}
+        with lock:
+            for (k, g, start), (c, b) in _pending.items():
+                if k == kind and g == granularity and start >= since:
+                    prev = out.get(start, (0, 0))
+                    out[start] = (prev[0] + c, prev[1] + b)
+    return out
+
+
+def _kind_stats(kind: str, label: str) -> dict:
+    now = int(time.time())
+    hour_now = now - now % HOUR
+    day_now = now - now % DAY
+    hours = _read_rollups(kind, 'hour', hour_now - 23 * HOUR)
+    days = _read_rollups(kind, 'day', day_now - (RETENTION_DAYS - 1) * DAY)
+
+    hour_series: List[dict] = []
+    for i in range(23, -1, -1):
+        h = hour_now - i * HOUR
+        hour_series.append({
+            'hour': datetime.fromtimestamp(h, UTC).strftime('%H:00'),
+            label: hours.get(h, (0, 0))[0]
+        })
+    day_series: List[dict] = []
+    for i in range(RETENTION_DAYS - 1, -1, -1):
+        d = day_now - i * DAY
+        day_series.append({
+            'day': datetime.fromtimestamp(d, UTC).strftime('%Y-%m-%d'),
+            label: days.get(d, (0, 0))[0]
+        })
+
+    count_today, bytes_today = days.get(day_now, (0, 0))
+    avg_size = (bytes_today / count_today) if count_today else 0.0
+    total_bytes = sum(b for _, b in days.values())
+    return {
+        'today': count_today,
+        'avg_size': avg_size,
+        'per_hour': hour_series,
+        'per_day': day_series,
+        'bytes_today': bytes_today,
+        'total_bytes': total_bytes,
+        'total_mb': round(total_bytes / (1024 * 1024), 2),
+        'total_gb': round(total_bytes / (1024 * 1024 * 1024), 3)
+    }
+
 
 def get_user_stats() -> dict:
-    now = datetime.now(UTC)
-    with lock:
-        total_users = len(first_seen)
-        active_users = sum(1 for ts in last_seen.values() if (now - ts).total_seconds() <= ACTIVE_WINDOW_SECONDS)
-        today_key = _truncate_day(now)
-        new_users_today = sum(1 for u, d in first_seen.items() if d == today_key)
+    """Stored sketches with the not yet flushed senders folded into copies; never writes."""
+    ensure_db()
+    now = time.time()
+    sec = int(now)
+    today = sec - sec % DAY
+    with _flush_lock:
+        with engine.connect() as conn:
+            total = _load_sketch(conn, SKETCH_ALL)
+            before = _load_sketch(conn, f'users:before:{today}')
+            rows = conn.execute(
+                text("SELECT registers FROM hll_sketches WHERE name IN ("
+                     + ", ".join(f"'users:active:{m}'" for m in _active_minutes(sec)) + ")")
+            ).fetchall()
+        with lock:
+            pending_users = dict(_pending_users)
+    total = total or HyperLogLog()
+    if before is None and any(seen >= today for seen in pending_users.values()):
+        # The next flush would snapshot users:all as it is now
+        before = HyperLogLog(total.to_bytes())
+    total.update(pending_users)
+    active = HyperLogLog.union(HyperLogLog(r[0]) for r in rows) if rows else HyperLogLog()
+    active.update(u for u, seen in pending_users.items() if seen >= now - ACTIVE_WINDOW_SECONDS - MINUTE)
+    total_users = total.count()
+    # No snapshot yet means nobody has been seen today
+    new_users_today = max(0, total_users - before.count()) if before is not None else 0
+    active_users = active.count()
     return {
         'total_users': total_users,
         'active_users': active_users,
         'new_users_today': new_users_today
     }
 
-def get_message_stats() -> dict:
-    now = datetime.now(UTC)
-    today_key = _truncate_day(now)
-    hour_series: List[dict] = []
-    day_series: List[dict] = []
 
-    with lock:
-        # Per hour (last 24 hours)
-        for i in range(23, -1, -1):
-            h = _truncate_hour(now - timedelta(hours=i))
-            hb = hour_buckets.get(h)
-            hour_series.append({
-                'hour': h.strftime('%H:00'),
-                'messages': hb.count if hb else 0
-            })
-        # Per day (last 7 days)
-        for i in range(6, -1, -1):
-            d = _truncate_day(now - timedelta(days=i))
-            db = day_buckets.get(d)
-            day_series.append({
-                'day': d.strftime('%Y-%m-%d'),
-                'messages': db.count if db else 0
-            })
-
-        today_bucket = day_buckets.get(today_key)
-        messages_today = today_bucket.count if today_bucket else 0
-        bytes_today = today_bucket.bytes if today_bucket else 0
-        avg_size = (bytes_today / messages_today) if messages_today else 0.0
-        total_bytes = sum(db.bytes for db in day_buckets.values())
-        total_mb = total_bytes / (1024 * 1024)
-        total_gb = total_bytes / (1024 * 1024 * 1024)
+def _active_minutes(sec: int) -> List[int]:
+    """Minute buckets overlapping the last ACTIVE_WINDOW_SECONDS."""
+    current = sec - sec % MINUTE
+    return list(range(current - ACTIVE_WINDOW_SECONDS, current + 1, MINUTE))
 
+
+def get_message_stats() -> dict:
+    s = _kind_stats('message', 'messages')
     return {
-        'messages_today': messages_today,
-        'avg_message_size': avg_size,
-        'per_hour': hour_series,
-        'per_day': day_series,
-        'bytes_today': bytes_today,
-        'total_bytes': total_bytes,
-        'total_mb': round(total_mb, 2),
-        'total_gb': round(total_gb, 3)
+        'messages_today': s['today'],
+        'avg_message_size': s['avg_size'],
+        'per_hour': s['per_hour'],
+        'per_day': s['per_day'],
+        'bytes_today': s['bytes_today'],
+        'total_bytes': s['total_bytes'],
+        'total_mb': s['total_mb'],
+        'total_gb': s['total_gb']
     }
 
+
 def get_attachment_stats() -> dict:
     """Return attachment analytics (counts & average sizes)."""
-    now = datetime.now(UTC)
-    today_key = _truncate_day(now)
-    hour_series: List[dict] = []
-    day_series: List[dict] = []
-    with lock:
-        # Per hour last 24h
-        for i in range(23, -1, -1):
-            h = _truncate_hour(now - timedelta(hours=i))
-            hb = att_hour_buckets.get(h)
-            hour_series.append({
-                'hour': h.strftime('%H:00'),
-                'attachments': hb.count if hb else 0
-            })
-        # Per day last 7 days
-        for i in range(6, -1, -1):
-            d = _truncate_day(now - timedelta(days=i))
-            db = att_day_buckets.get(d)
-            day_series.append({
-                'day': d.strftime('%Y-%m-%d'),
-                'attachments': db.count if db else 0
-            })
-        today_bucket = att_day_buckets.get(today_key)
-        attachments_today = today_bucket.count if today_bucket else 0
-        bytes_today = today_bucket.bytes if today_bucket else 0
-        avg_size = (bytes_today / attachments_today) if attachments_today else 0.0
-        total_bytes = sum(db.bytes for db in att_day_buckets.values())
-        total_mb = total_bytes / (1024 * 1024)
-        total_gb = total_bytes / (1024 * 1024 * 1024)
+    s = _kind_stats('attachment', 'attachments')
     return {
-        'attachments_today': attachments_today,
-        'avg_attachment_size': avg_size,
-        'per_hour': hour_series,
-        'per_day': day_series,
-        'bytes_today': bytes_today,
-        'total_bytes': total_bytes,
-        'total_mb': round(total_mb, 2),
-        'total_gb': round(total_gb, 3)
+        'attachments_today': s['today'],
+        'avg_attachment_size': s['avg_size'],
+        'per_hour': s['per_hour'],
+        'per_day': s['per_day'],
+        'bytes_today': s['bytes_today'],
+        'total_bytes': s['total_bytes'],
+        'total_mb': s['total_mb'],
+        'total_gb': s['total_gb']
     }
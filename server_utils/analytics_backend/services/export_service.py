@@ -0,0 +1,147 @@
+"""Streaming export of the persisted rollups (CSV or Parquet).
+
+Rows are read in keyset-paginated pages of PAGE_SIZE, so no read transaction
+stays open for the whole download and memory is bounded by one page whatever
+the time range. Parquet needs pyarrow (optional); each page becomes a row group.
+"""
+import csv
+import io
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from sqlalchemy import text
+
+from ..core.database import engine
+from .event_collector import GRANULARITIES, ensure_db, flush
+
+PAGE_SIZE = 5000
+KINDS = ('message', 'attachment')
+COLUMNS = ('period_start', 'kind', 'granularity', 'count', 'bytes')
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+    PARQUET_AVAILABLE = True
+except Exception:  # optional dependency
+    PARQUET_AVAILABLE = False
+
+
+def parse_time(value: Optional[str], default: float) -> float:
+    """Unix seconds or ISO 8601 (naive = UTC). Raises ValueError."""
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def validate(granularity: str, kind: Optional[str]) -> None:
+    if granularity not in {g for g, _ in GRANULARITIES}:
+        raise ValueError('granularity must be minute, hour or day')
+    if kind and kind not in KINDS:
+        raise ValueError('kind must be message or attachment')
+
+
+def iter_pages(granularity: str, start: float, end: float, kind: Optional[str] = None) -> Iterator[list]:
+    """Yield lists of (period_start, kind, count, bytes) ordered by time, start <= t < end."""
+    try:
+        flush()
+    except Exception:
+        pass
+    ensure_db()
+    kind_filter = "AND kind = :kind " if kind else ""
+    last_p, last_k = int(start) - 1, ''
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT period_start, kind, count, bytes FROM metric_rollups "
+                "WHERE granularity = :gran " + kind_filter +
+                "AND period_start >= :start AND period_start < :end "
+                "AND (period_start > :p OR (period_start = :p AND kind > :k)) "
+                "ORDER BY period_start, kind LIMIT :lim"
+            ), {'gran': granularity, 'kind': kind, 'start': int(start), 'end': int(end), 'p': last_p, 'k': last_k, 'lim': PAGE_SIZE}).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < PAGE_SIZE:
+            return
+        last_p, last_k = int(rows[-1][0]), rows[-1][1]
+
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def csv_stream(granularity: str, start: float, end: float, kind: Optional[str] = None) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    yield buf.getvalue().encode()
+    for rows in iter_pages(granularity, start, end, kind):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows((_iso(p), k, granularity, c, b) for p, k, c, b in rows)
+        yield buf.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file for ParquetWriter: keeps the absolute position (footer offsets
+    depend on it) while handing out and forgetting what was written so far."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: list = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_stream(granularity: str, start: float, end: float, kind: Optional[str] = None) -> Iterator[bytes]:
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError('pyarrow is not installed')
+    schema = pa.schema([
+        ('period_start', pa.timestamp('s', tz='UTC')),
+        ('kind', pa.string()),
+        ('granularity', pa.string()),
+        ('count', pa.int64()),
+        ('bytes', pa.int64()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in iter_pages(granularity, start, end, kind):
+            writer.write_table(pa.table({
+                'period_start': [int(r[0]) for r in rows],
+                'kind': [r[1] for r in rows],
+                'granularity': [granularity] * len(rows),
+                'count': [int(r[2] or 0) for r in rows],
+                'bytes': [int(r[3] or 0) for r in rows],
+            }, schema=schema))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    tail = sink.drain()
+    if tail:
+        yield tail
@@ -0,0 +1,96 @@
+"""Push channel for the analytics dashboard.
+
+One asyncio task per process computes the consolidated dashboard payload every
+TICK_SECONDS (while at least one dashboard is connected) and fans it out to all
+subscribers: a full 'snapshot' when a client joins or falls behind, then 'delta'
+messages holding only the fields that changed since the previous tick. The cost
+is one computation per tick however many admins are watching.
+
+Messages: {"type": "snapshot", "seq": n, "data": {...}} and
+{"type": "delta", "seq": n, "changes": {section: {field: value}}}; a client that
+sees a gap in seq can reconnect for a fresh snapshot.
+"""
+import asyncio
+from typing import Optional
+
+from .metrics_service import get_dashboard
+
+TICK_SECONDS = 2.0
+# Messages buffered per client before it is considered slow and resynced
+SUBSCRIBER_QUEUE_SIZE = 8
+
+
+def _diff(old: dict, new: dict) -> dict:
+    changes: dict = {}
+    for section, values in new.items():
+        prev = old.get(section) or {}
+        if not isinstance(values, dict):
+            if values != prev:
+                changes[section] = values
+            continue
+        changed = {k: v for k, v in values.items() if prev.get(k) != v}
+        if changed:
+            changes[section] = changed
+    return changes
+
+
+class LiveFeed:
+    def __init__(self, tick_seconds: float = TICK_SECONDS):
+        self.tick_seconds = tick_seconds
+        self._subscribers: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._snapshot: Optional[dict] = None
+        self._seq = 0
+
+    def _snapshot_message(self) -> dict:
+        return {"type": "snapshot", "seq": self._seq, "data": self._snapshot}
+
+    def subscribe(self) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        if self._snapshot is not None:
+            q.put_nowait(self._snapshot_message())
+        self._subscribers.add(q)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue) -> None:
+        self._subscribers.discard(q)
+
+    def _publish(self, message: dict) -> None:
+        for q in list(self._subscribers):
+            try:
+                q.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow client: drop its backlog and resync it with the full state
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(self._snapshot_message())
+
+    async def _run(self) -> None:
+        try:
+            while self._subscribers:
+                try:
+                    snapshot = await asyncio.to_thread(get_dashboard)
+                except Exception as e:
+                    print(f"[analytics] live snapshot failed: {e}")
+                    snapshot = None
+                if snapshot is not None:
+                    previous = self._snapshot
+                    self._snapshot = snapshot
+                    if previous is None:
+                        self._seq += 1
+                        self._publish(self._snapshot_message())
+                    else:
+                        changes = _diff(previous, snapshot)
+                        if changes:
+                            self._seq += 1
+                            self._publish({"type": "delta", "seq": self._seq, "changes": changes})
+                await asyncio.sleep(self.tick_seconds)
+        finally:
+            # Nobody is watching: forget the state so the next client gets a fresh one
+            if not self._subscribers:
+                self._snapshot = None
+
+
+feed = LiveFeed()
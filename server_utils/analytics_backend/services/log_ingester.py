@@ -0,0 +1,169 @@
+"""Background tailer for analytics_events.log (chat server without Redis).
+
+Every few seconds new complete lines are read in large blocks, decoded (orjson
+when installed) and fed to the rollup collector in one batch; the collector is
+flushed before the (inode, offset) cursor is saved in ingest_cursors, so a
+restart resumes where it stopped instead of re-reading the whole file. A crash
+between the flush and the cursor save can re-count at most that one block.
+
+Rotation (analytics_queue renames the log to .1, .2, ...) is detected by inode:
+the rest of the rotated file is finished first, then the new file is read from
+the start. A file that shrank under the same inode was truncated and is re-read
+from 0. Stats requests never wait on ingestion.
+"""
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import text
+
+from ..core.database import engine
+from . import event_collector
+
+try:
+    import orjson  # type: ignore
+    _loads = orjson.loads
+except Exception:  # optional dependency
+    _loads = json.loads
+
+LOG_PATH = os.getenv("ANALYTICS_EVENTS_LOG", "analytics_events.log")
+# Rotated generations analytics_queue keeps (analytics_events.log.1 .. .N)
+MAX_ROTATED = 9
+READ_BLOCK_BYTES = 4 * 1024 * 1024
+INTERVAL_SECONDS = 2
+
+_stop = threading.Event()
+_worker: Optional[threading.Thread] = None
+_lock = threading.Lock()
+
+
+def _load_cursor(path: str) -> tuple[int, int]:
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT inode, byte_offset FROM ingest_cursors WHERE path = :p"), {"p": path}).first()
+    return (int(row[0]), int(row[1])) if row else (0, 0)
+
+
+def _save_cursor(path: str, inode: int, offset: int) -> None:
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO ingest_cursors(path, inode, byte_offset, updated_at) VALUES (:p, :i, :o, :t) "
+            "ON CONFLICT(path) DO UPDATE SET inode = excluded.inode, byte_offset = excluded.byte_offset, updated_at = excluded.updated_at"
+        ), {"p": path, "i": inode, "o": offset, "t": time.time()})
+
+
+def _rotated_with_inode(path: str, inode: int) -> Optional[str]:
+    for n in range(1, MAX_ROTATED + 1):
+        candidate = f"{path}.{n}"
+        try:
+            if os.stat(candidate).st_ino == inode:
+                return candidate
+        except OSError:
+            continue
+    return None
+
+
+def _parse(block: bytes) -> list:
+    events = []
+    for line in block.split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            evt = _loads(line)
+        except Exception:
+            continue
+        if not isinstance(evt, dict) or evt.get("agg"):
+            # agg: the chat server already wrote this event into the shared rollups
+            continue
+        kind = "attachment" if evt.get("type") == "attachment" else "message"
+        events.append((kind, evt.get("size", 0) or 0, evt.get("from", "?"), evt.get("to", "?"), evt.get("ts")))
+    return events
+
+
+def _consume(path: str, offset: int, on_block) -> int:
+    """Feed complete lines of path from offset to on_block(events, new_offset). Returns the final offset."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while not _stop.is_set():
+            block = f.read(READ_BLOCK_BYTES)
+            if not block:
+                break
+            end = block.rfind(b"\n")
+            if end < 0:
+                if len(block) < READ_BLOCK_BYTES:
+                    break  # partial line still being written
+                end = len(block) - 1  # oversized garbage line: skip it
+            offset += end + 1
+            on_block(_parse(block[:end + 1]), offset)
+            if end + 1 < len(block):
+                f.seek(offset)
+    return offset
+
+
+def ingest_once(path: str = LOG_PATH) -> int:
+    """Ingest everything new in path (and the unread tail of its rotated predecessor)."""
+    with _lock:
+        event_collector.ensure_db()
+        saved_inode, offset = _load_cursor(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        ingested = 0
+
+        def _commit(inode):
+            def on_block(events, new_offset):
+                nonlocal ingested
+                if events:
+                    event_collector.register_batch(events)
+                    ingested += len(events)
+                    try:
+                        event_collector.flush()
+                    except Exception:
+                        pass  # kept pending by the collector; re-reading the block would double count
+                _save_cursor(path, inode, new_offset)
+            return on_block
+
+        if saved_inode and (st is None or st.st_ino != saved_inode):
+            rotated = _rotated_with_inode(path, saved_inode)
+            if rotated:
+                _consume(rotated, offset, _commit(saved_inode))
+            offset = 0
+            if st is None:
+                _save_cursor(path, 0, 0)
+                return ingested
+            _save_cursor(path, st.st_ino, 0)
+        if st is None:
+            return ingested
+        if st.st_size < offset:
+            offset = 0  # truncated in place
+        if st.st_size > offset:
+            _consume(path, offset, _commit(st.st_ino))
+        elif not saved_inode:
+            _save_cursor(path, st.st_ino, offset)
+        return ingested
+
+
+def start_ingester(interval_seconds: int = INTERVAL_SECONDS, path: str = LOG_PATH) -> threading.Thread:
+    """Start (once) a daemon thread tailing path every interval_seconds."""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    _stop.clear()
+
+    def _loop():
+        while not _stop.is_set():
+            try:
+                ingest_once(path)
+            except Exception as e:
+                print(f"[analytics] log ingestion failed: {e}")
+            _stop.wait(max(1, int(interval_seconds)))
+
+    _worker = threading.Thread(target=_loop, name="analytics-log-ingester", daemon=True)
+    _worker.start()
+    return _worker
+
+
+def stop_ingester() -> None:
+    _stop.set()
@@ -1,13 +1,13 @@
 import psutil
 import time
 import os
+import threading
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from .event_collector import (
     get_user_stats as ec_user_stats,
     get_message_stats as ec_message_stats,
     get_attachment_stats as ec_attachment_stats,
-    register_message as ec_register_message,
-    register_attachment as ec_register_attachment,
 )
 
 # Optional Redis integration for cross-process metrics
@@ -22,168 +22,180 @@ except Exception:
     _redis_client = None
 
 _process_start_time = time.time()
+psutil.cpu_percent(interval=None)  # prime the non-blocking CPU measurement
 
-def get_system_stats() -> dict:
-    cpu = psutil.cpu_percent(interval=0.05)
+# Stats payloads are reused for this long, so an auto-refreshing dashboard (or
+# several) costs one computation per TTL instead of one per request
+STATS_CACHE_TTL_SECONDS = 2.0
+SYSTEM_SAMPLE_INTERVAL_SECONDS = 2.0
+
+_cache: dict = {}
+_cache_lock = threading.Lock()
+_system_sample: Optional[dict] = None
+_system_lock = threading.Lock()
+_stop = threading.Event()
+_sampler: Optional[threading.Thread] = None
+
+
+def _cached(key: str, compute, ttl: float = STATS_CACHE_TTL_SECONDS):
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+    value = compute()
+    with _cache_lock:
+        _cache[key] = (now + ttl, value)
+    return value
+
+
+def _sample_system() -> dict:
+    # interval=None compares against the previous call: no sleeping
+    cpu = psutil.cpu_percent(interval=None)
     mem = psutil.virtual_memory().percent
     disk = psutil.disk_usage('/') .percent
     net = psutil.net_io_counters()
-    sent_mb = net.bytes_sent / (1024 * 1024)
-    recv_mb = net.bytes_recv / (1024 * 1024)
-    uptime = int(time.time() - _process_start_time)
     return {
         'cpu': cpu,
         'memory': mem,
         'disk': disk,
-        'net_sent_mb': round(sent_mb, 2),
-        'net_recv_mb': round(recv_mb, 2),
-        'uptime_seconds': uptime
+        'net_sent_mb': round(net.bytes_sent / (1024 * 1024), 2),
+        'net_recv_mb': round(net.bytes_recv / (1024 * 1024), 2),
     }
 
+
+def start_system_sampler(interval_seconds: float = SYSTEM_SAMPLE_INTERVAL_SECONDS) -> threading.Thread:
+    """Start (once) a daemon thread refreshing the system stats sample."""
+    global _sampler
+    if _sampler is not None and _sampler.is_alive():
+        return _sampler
+    _stop.clear()
+
+    def _loop():
+        global _system_sample
+        while not _stop.is_set():
+            try:
+                sample = _sample_system()
+                with _system_lock:
+                    _system_sample = sample
+            except Exception as e:
+                print(f"[analytics] system sample failed: {e}")
+            _stop.wait(max(0.5, float(interval_seconds)))
+
+    _sampler = threading.Thread(target=_loop, name="analytics-system-sampler", daemon=True)
+    _sampler.start()
+    return _sampler
+
+
+def stop_system_sampler() -> None:
+    _stop.set()
+
+
+def get_system_stats() -> dict:
+    global _system_sample
+    with _system_lock:
+        sample = _system_sample
+    if sample is None:
+        # Sampler not running (or first request before its first tick)
+        sample = _sample_system()
+        with _system_lock:
+            _system_sample = sample
+    stats = dict(sample)
+    stats['uptime_seconds'] = int(time.time() - _process_start_time)
+    return stats
+
+
 def _redis_user_stats():
-    import datetime
-    now = datetime.datetime.utcnow()
-    day_key = now.strftime('%Y%m%d')
-    total_users = _redis_client.scard('metrics:users:all') or 0
-    new_users_today = _redis_client.scard(f'metrics:users:new:{day_key}') or 0
-    cutoff = time.time() - 300
-    try:
-        _redis_client.zremrangebyscore('metrics:active_users', 0, time.time() - 86400)
-    except Exception:
-        pass
-    active_users = _redis_client.zcount('metrics:active_users', cutoff, '+inf') or 0
+    day_key = datetime.now(timezone.utc).strftime('%Y%m%d')
+    # HyperLogLog sketches written by the chat server's analytics queue (O(1) counts)
+    before_key = f'metrics:hll:users:before:{day_key}'
+    sec = int(time.time())
+    minute = sec - sec % 60
+    active_keys = [f'metrics:hll:users:active:{m}' for m in range(minute - 300, minute + 1, 60)]
+    pipe = _redis_client.pipeline(transaction=False)
+    pipe.pfcount('metrics:hll:users:all')
+    pipe.exists(before_key)
+    pipe.pfcount(before_key)
+    pipe.pfcount(*active_keys)
+    total, has_before, before, active = pipe.execute()
+    total_users = int(total or 0)
+    new_users_today = max(0, total_users - int(before or 0)) if has_before else 0
     return {
         'total_users': total_users,
-        'active_users': active_users,
+        'active_users': int(active or 0),
         'new_users_today': new_users_today
     }
 
-def _redis_message_stats():
-    import datetime
-    now = datetime.datetime.utcnow()
-    day_key = now.strftime('%Y%m%d')
-    messages_today = int(_redis_client.get(f'metrics:messages:count:{day_key}') or 0)
-    bytes_today = int(_redis_client.get(f'metrics:messages:bytes:{day_key}') or 0)
-    avg_size = (bytes_today / messages_today) if messages_today else 0.0
-    # Approximate total bytes (retention 7 days) by summing last 7 keys
-    total_bytes = 0
-    for i in range(0, 7):
-        d = now - datetime.timedelta(days=i)
-        d_key = d.strftime('%Y%m%d')
-        total_bytes += int(_redis_client.get(f'metrics:messages:bytes:{d_key}') or 0)
-    total_mb = total_bytes / (1024 * 1024)
-    total_gb = total_bytes / (1024 * 1024 * 1024)
-    per_hour = []
-    for i in range(23, -1, -1):
-        h = now - datetime.timedelta(hours=i)
-        hour_key = h.strftime('%Y%m%d%H')
-        count = int(_redis_client.get(f'metrics:messages:hour:{hour_key}') or 0)
-        per_hour.append({'hour': h.strftime('%H:00'), 'messages': count})
-    per_day = []
-    for i in range(6, -1, -1):
-        d = now - datetime.timedelta(days=i)
-        d_key = d.strftime('%Y%m%d')
-        count = int(_redis_client.get(f'metrics:messages:count:{d_key}') or 0)
-        per_day.append({'day': d.strftime('%Y-%m-%d'), 'messages': count})
+
+def _redis_series(kind: str, label: str) -> dict:
+    """Day/hour counters for kind ('messages' | 'attachments') with a single MGET."""
+    now = datetime.now(timezone.utc)
+    days = [now - timedelta(days=i) for i in range(6, -1, -1)]
+    hours = [now - timedelta(hours=i) for i in range(23, -1, -1)]
+    keys = (
+        [f'metrics:{kind}:count:{d.strftime("%Y%m%d")}' for d in days]
+        + [f'metrics:{kind}:bytes:{d.strftime("%Y%m%d")}' for d in days]
+        + [f'metrics:{kind}:hour:{h.strftime("%Y%m%d%H")}' for h in hours]
+    )
+    values = [int(v or 0) for v in _redis_client.mget(keys)]
+    counts, day_bytes, hour_counts = values[:7], values[7:14], values[14:]
+    count_today, bytes_today = counts[-1], day_bytes[-1]
+    total_bytes = sum(day_bytes)
     return {
-        'messages_today': messages_today,
-        'avg_message_size': avg_size,
-        'per_hour': per_hour,
-        'per_day': per_day,
+        'today': count_today,
+        'avg_size': (bytes_today / count_today) if count_today else 0.0,
+        'per_hour': [{'hour': h.strftime('%H:00'), label: c} for h, c in zip(hours, hour_counts)],
+        'per_day': [{'day': d.strftime('%Y-%m-%d'), label: c} for d, c in zip(days, counts)],
         'bytes_today': bytes_today,
         'total_bytes': total_bytes,
-        'total_mb': round(total_mb, 2),
-        'total_gb': round(total_gb, 3)
+        'total_mb': round(total_bytes / (1024 * 1024), 2),
+        'total_gb': round(total_bytes / (1024 * 1024 * 1024), 3)
+    }
+
+
+def _redis_message_stats():
+    s = _redis_series('messages', 'messages')
+    return {
+        'messages_today': s['today'],
+        'avg_message_size': s['avg_size'],
+        'per_hour': s['per_hour'],
+        'per_day': s['per_day'],
+        'bytes_today': s['bytes_today'],
+        'total_bytes': s['total_bytes'],
+        'total_mb': s['total_mb'],
+        'total_gb': s['total_gb']
     }
 
+
 def _redis_attachment_stats():
-    import datetime
-    now = datetime.datetime.utcnow()
-    day_key = now.strftime('%Y%m%d')
-    attachments_today = int(_redis_client.get(f'metrics:attachments:count:{day_key}') or 0)
-    bytes_today = int(_redis_client.get(f'metrics:attachments:bytes:{day_key}') or 0)
-    avg_size = (bytes_today / attachments_today) if attachments_today else 0.0
-    total_bytes = 0
-    for i in range(0, 7):
-        d = now - datetime.timedelta(days=i)
-        d_key = d.strftime('%Y%m%d')
-        total_bytes += int(_redis_client.get(f'metrics:attachments:bytes:{d_key}') or 0)
-    total_mb = total_bytes / (1024 * 1024)
-    total_gb = total_bytes / (1024 * 1024 * 1024)
-    per_hour = []
-    for i in range(23, -1, -1):
-        h = now - datetime.timedelta(hours=i)
-        hour_key = h.strftime('%Y%m%d%H')
-        count = int(_redis_client.get(f'metrics:attachments:hour:{hour_key}') or 0)
-        per_hour.append({'hour': h.strftime('%H:00'), 'attachments': count})
-    per_day = []
-    for i in range(6, -1, -1):
-        d = now - datetime.timedelta(days=i)
-        d_key = d.strftime('%Y%m%d')
-        count = int(_redis_client.get(f'metrics:attachments:count:{d_key}') or 0)
-        per_day.append({'day': d.strftime('%Y-%m-%d'), 'attachments': count})
+    s = _redis_series('attachments', 'attachments')
     return {
-        'attachments_today': attachments_today,
-        'avg_attachment_size': avg_size,
-        'per_hour': per_hour,
-        'per_day': per_day,
-        'bytes_today': bytes_today,
-        'total_bytes': total_bytes,
-        'total_mb': round(total_mb, 2),
-        'total_gb': round(total_gb, 3)
+        'attachments_today': s['today'],
+        'avg_attachment_size': s['avg_size'],
+        'per_hour': s['per_hour'],
+        'per_day': s['per_day'],
+        'bytes_today': s['bytes_today'],
+        'total_bytes': s['total_bytes'],
+        'total_mb': s['total_mb'],
+        'total_gb': s['total_gb']
     }
 
-# Lightweight ingestion from file log when Redis absent
-_last_ingested_offset = 0
-def _ingest_file_events():
-    global _last_ingested_offset
-    log_file = 'analytics_events.log'
-    try:
-        import os, json
-        if not os.path.exists(log_file):
-            return
-        size = os.path.getsize(log_file)
-        if size < _last_ingested_offset:
-            # file rotated or truncated
-            _last_ingested_offset = 0
-        with open(log_file, 'r', encoding='utf-8') as f:
-            f.seek(_last_ingested_offset)
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    evt = json.loads(line)
-                    if evt.get('type') == 'attachment':
-                        ec_register_attachment(size_bytes=evt.get('size',0), sender=evt.get('from','?'), recipient=evt.get('to','?'), ts=evt.get('ts'))
-                    else:
-                        ec_register_message(size_bytes=evt.get('size',0), sender=evt.get('from','?'), recipient=evt.get('to','?'), ts=evt.get('ts'))
-                except Exception:
-                    continue
-            _last_ingested_offset = f.tell()
-    except Exception:
-        pass
-
-# Wrap original functions so they trigger ingestion when Redis is not in use
-_orig_ec_user_stats = ec_user_stats
-_orig_ec_message_stats = ec_message_stats
-_orig_ec_attachment_stats = ec_attachment_stats
-
-def get_user_stats():  # type: ignore[override]
-    if _redis_client:
-        return _redis_user_stats()
-    _ingest_file_events()
-    return _orig_ec_user_stats()
-
-def get_message_stats():  # type: ignore[override]
-    if _redis_client:
-        return _redis_message_stats()
-    _ingest_file_events()
-    return _orig_ec_message_stats()
-
-def get_attachment_stats():  # type: ignore[override]
-    if _redis_client:
-        return _redis_attachment_stats()
-    _ingest_file_events()
-    return _orig_ec_attachment_stats()
+# Without Redis, analytics_events.log is tailed by services/log_ingester.py in the
+# background; these only read the rollups.
+def get_user_stats():
+    return _cached('users', _redis_user_stats if _redis_client else ec_user_stats)
+
+def get_message_stats():
+    return _cached('messages', _redis_message_stats if _redis_client else ec_message_stats)
+
+def get_attachment_stats():
+    return _cached('attachments', _redis_attachment_stats if _redis_client else ec_attachment_stats)
 
+def get_dashboard() -> dict:
+    """Everything the dashboard shows, assembled once per cache TTL."""
+    return _cached('dashboard', lambda: {
+        'system': get_system_stats(),
+        'users': get_user_stats(),
+        'messages': get_message_stats(),
+        'attachments': get_attachment_stats(),
+    })
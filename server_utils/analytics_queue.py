@@ -0,0 +1,285 @@
+"""Analytics ingestion queue for the chat server's request handlers.
+
+/send and /upload call enqueue(), which appends a small tuple to a bounded deque
+(atomic in CPython, no lock and no datetime work in the handler). A background
+thread drains the deque in batches and, per batch:
+- hands the events to the in-process rollup collector (if importable)
+- sends one Redis pipeline with the day/hour counters and HyperLogLog user
+  sketches (if Redis is available)
+- appends the events to analytics_events.log through a buffered handle that is
+  flushed once per batch and rotated by size (when Redis is not available; the
+  analytics API ingests this file)
+
+If the deque is full the oldest events are dropped; analytics never block or
+fail message delivery.
+
+Older servers kept exact Redis sets (metrics:users:all, metrics:users:new:<day>)
+and a metrics:active_users zset; the worker folds those into the sketches once
+on start-up and then deletes them.
+"""
+import atexit
+import collections
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+LOG_PATH = "analytics_events.log"
+MAX_PENDING = 100_000
+BATCH_SIZE = 5000
+DRAIN_INTERVAL_SECONDS = 1.0
+LOG_MAX_BYTES = 64 * 1024 * 1024
+LOG_BACKUPS = 3
+LOG_BUFFER_BYTES = 64 * 1024
+# Per-minute active-user sketches only need to outlive the active window
+HLL_ACTIVE_KEY_TTL = 900
+LEGACY_SCAN_COUNT = 1000
+
+_queue: collections.deque = collections.deque(maxlen=MAX_PENDING)
+_aggregate: Optional[Callable[[list], None]] = None
+_redis = None
+_write_log = False
+_log_path = LOG_PATH
+_log_max_bytes = LOG_MAX_BYTES
+_log_backups = LOG_BACKUPS
+_log_file = None
+_hll_snapshot_day: Optional[str] = None
+
+_drain_lock = threading.Lock()
+_stop = threading.Event()
+_worker: Optional[threading.Thread] = None
+
+
+def configure(aggregate: Optional[Callable[[list], None]] = None, redis_client=None, write_log: bool = False,
+              log_path: str = LOG_PATH, log_max_bytes: int = LOG_MAX_BYTES, log_backups: int = LOG_BACKUPS) -> None:
+    """Set the sinks. aggregate(events) receives lists of (kind, size, sender, recipient, ts)."""
+    global _aggregate, _redis, _write_log, _log_path, _log_max_bytes, _log_backups
+    _aggregate = aggregate
+    _redis = redis_client
+    _write_log = bool(write_log)
+    _log_path = log_path
+    _log_max_bytes = max(0, int(log_max_bytes))
+    _log_backups = max(0, int(log_backups))
+
+
+def enqueue(kind: str, size_bytes: int, sender: str, recipient: str, ts: Optional[float] = None) -> None:
+    """Queue one 'message' or 'attachment' event; O(1), never raises into the handler."""
+    _queue.append((kind, size_bytes, sender, recipient, ts if ts is not None else time.time()))
+
+
+def pending() -> int:
+    return len(_queue)
+
+
+def _take(limit: int) -> list:
+    batch = []
+    popleft = _queue.popleft
+    try:
+        for _ in range(limit):
+            batch.append(popleft())
+    except IndexError:
+        pass
+    return batch
+
+
+def _hll_day_snapshot(day_key: str) -> None:
+    """Snapshot metrics:hll:users:all once per UTC day (first writer wins), before that
+    day's first user is added, so new users today = PFCOUNT(all) - PFCOUNT(before:<day>)."""
+    global _hll_snapshot_day
+    if _hll_snapshot_day == day_key:
+        return
+    if _redis.set(f'metrics:hll:users:before:{day_key}:lock', 1, nx=True, ex=2 * 86400):
+        _redis.pfmerge(f'metrics:hll:users:before:{day_key}', 'metrics:hll:users:all')
+        _redis.expire(f'metrics:hll:users:before:{day_key}', 2 * 86400)
+    _hll_snapshot_day = day_key
+
+
+def _seed_hll_from_legacy() -> None:
+    """Fold the pre-HyperLogLog user sets into the sketches, then delete them.
+
+    The old keys are their own marker: once deleted there is nothing left to
+    seed, and a short NX lock keeps concurrent server processes from both
+    doing it.
+    """
+    if not _redis.exists('metrics:users:all', 'metrics:active_users'):
+        return
+    if not _redis.set('metrics:hll:seed:lock', 1, nx=True, ex=600):
+        return
+    now = time.time()
+    day_key = datetime.fromtimestamp(now, timezone.utc).strftime('%Y%m%d')
+    before_key = f'metrics:hll:users:before:{day_key}'
+    # Today's snapshot is everyone except today's new users, unless one was already taken
+    seed_before = bool(_redis.set(f'{before_key}:lock', 1, nx=True, ex=2 * 86400))
+    new_today = set(_redis.smembers(f'metrics:users:new:{day_key}')) if seed_before else set()
+
+    pipe = _redis.pipeline(transaction=False)
+    cursor = 0
+    while True:
+        cursor, members = _redis.sscan('metrics:users:all', cursor, count=LEGACY_SCAN_COUNT)
+        if members:
+            pipe.pfadd('metrics:hll:users:all', *members)
+            if seed_before:
+                old = [m for m in members if m not in new_today]
+                if old:
+                    pipe.pfadd(before_key, *old)
+            pipe.execute()
+        if not cursor:
+            break
+    if seed_before:
+        pipe.pfadd(before_key)  # creates the sketch even when every user is new today
+        pipe.expire(before_key, 2 * 86400)
+
+    active: dict = {}
+    for member, score in _redis.zrangebyscore('metrics:active_users', now - HLL_ACTIVE_KEY_TTL, '+inf',
+                                              withscores=True):
+        sec = int(score)
+        active.setdefault(sec - sec % 60, []).append(member)
+    for minute, members in active.items():
+        key = f'metrics:hll:users:active:{minute}'
+        pipe.pfadd(key, *members)
+        pipe.expire(key, HLL_ACTIVE_KEY_TTL)
+    pipe.execute()
+
+    legacy = ['metrics:users:all', 'metrics:active_users']
+    legacy.extend(_redis.scan_iter(match='metrics:users:new:*', count=LEGACY_SCAN_COUNT))
+    _redis.delete(*legacy)
+    _redis.delete('metrics:hll:seed:lock')
+    print(f"[analytics] seeded HyperLogLog user counts from {len(legacy)} legacy Redis keys")
+
+
+def _to_redis(batch: list) -> None:
+    counters: dict = collections.Counter()
+    users_all = set()
+    active: dict = {}
+    days = set()
+    for kind, size, sender, _recipient, ts in batch:
+        dt = datetime.fromtimestamp(ts, timezone.utc)
+        day_key = dt.strftime('%Y%m%d')
+        hour_key = dt.strftime('%Y%m%d%H')
+        if kind == 'attachment':
+            counters[f'metrics:attachments:count:{day_key}'] += 1
+            counters[f'metrics:attachments:bytes:{day_key}'] += size
+            counters[f'metrics:attachments:hour:{hour_key}'] += 1
+            continue
+        days.add(day_key)
+        counters[f'metrics:messages:count:{day_key}'] += 1
+        counters[f'metrics:messages:bytes:{day_key}'] += size
+        counters[f'metrics:messages:day:{day_key}'] += 1
+        counters[f'metrics:messages:hour:{hour_key}'] += 1
+        users_all.add(sender)
+        sec = int(ts)
+        active.setdefault(sec - sec % 60, set()).add(sender)
+    for day_key in sorted(days):
+        _hll_day_snapshot(day_key)
+    pipe = _redis.pipeline()
+    for key, n in counters.items():
+        if n:
+            pipe.incrby(key, n)
+    if users_all:
+        pipe.pfadd('metrics:hll:users:all', *users_all)
+    for minute, members in active.items():
+        key = f'metrics:hll:users:active:{minute}'
+        pipe.pfadd(key, *members)
+        pipe.expire(key, HLL_ACTIVE_KEY_TTL)
+    pipe.execute()
+
+
+def _rotate_log() -> None:
+    global _log_file
+    if _log_file is not None:
+        _log_file.close()
+        _log_file = None
+    if _log_backups <= 0:
+        os.remove(_log_path)
+        return
+    for n in range(_log_backups - 1, 0, -1):
+        src = f"{_log_path}.{n}"
+        if os.path.exists(src):
+            os.replace(src, f"{_log_path}.{n + 1}")
+    os.replace(_log_path, _log_path + ".1")
+
+
+def _to_log(batch: list) -> None:
+    global _log_file
+    aggregated = _aggregate is not None
+    lines = []
+    for kind, size, sender, recipient, ts in batch:
+        event = {'ts': ts, 'size': size, 'from': sender, 'to': recipient}
+        if kind == 'attachment':
+            event['type'] = 'attachment'
+        if aggregated:
+            # Already rolled up in-process; the analytics API must not count it again
+            event['agg'] = 1
+        lines.append(json.dumps(event, separators=(',', ':')))
+    if _log_file is None:
+        _log_file = open(_log_path, 'a', encoding='utf-8', buffering=LOG_BUFFER_BYTES)
+    _log_file.write('\n'.join(lines) + '\n')
+    _log_file.flush()
+    if _log_max_bytes and _log_file.tell() >= _log_max_bytes:
+        _rotate_log()
+
+
+def drain() -> int:
+    """Process everything queued so far. Returns the number of events handled."""
+    handled = 0
+    with _drain_lock:
+        while True:
+            batch = _take(BATCH_SIZE)
+            if not batch:
+                return handled
+            handled += len(batch)
+            if _aggregate is not None:
+                try:
+                    _aggregate(batch)
+                except Exception as e:
+                    print(f"[analytics] aggregation failed: {e}")
+            if _redis is not None:
+                try:
+                    _to_redis(batch)
+                except Exception as e:
+                    print(f"[analytics] redis metrics failed: {e}")
+            elif _write_log:
+                try:
+                    _to_log(batch)
+                except Exception as e:
+                    print(f"[analytics] event log write failed: {e}")
+
+
+def start_worker(interval_seconds: float = DRAIN_INTERVAL_SECONDS) -> threading.Thread:
+    """Start (once) the daemon thread draining the queue every interval_seconds."""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    _stop.clear()
+
+    def _loop():
+        if _redis is not None:
+            try:
+                _seed_hll_from_legacy()
+            except Exception as e:
+                print(f"[analytics] legacy user set migration failed: {e}")
+        while not _stop.is_set():
+            drain()
+            _stop.wait(max(0.05, float(interval_seconds)))
+
+    _worker = threading.Thread(target=_loop, name="analytics-queue", daemon=True)
+    _worker.start()
+    return _worker
+
+
+def stop_worker() -> None:
+    global _log_file
+    _stop.set()
+    drain()
+    with _drain_lock:
+        if _log_file is not None:
+            try:
+                _log_file.close()
+            except Exception:
+                pass
+            _log_file = None
+
+
+atexit.register(stop_worker)
@@ -0,0 +1,494 @@
+"""Content-addressed attachment store shared by the DM relay and the groups backend.
+
+Blobs are the raw (already end-to-end encrypted) attachment bytes, named by their
+sha256 and sharded two levels deep: data/blobs/ab/cd/abcd...ef.bin. Identical
+uploads are written once; every user of a blob holds a reference row in a small
+SQLite index (blob_index.db):
+
+    blobs(sha256, size, created_at, last_ref_at)
+    blob_refs(sha256, kind, ref_id, owner, created_at, expires_at)
+
+`kind`/`ref_id` say what keeps the blob alive ("group"/<group_id> for group
+attachments, "dm"/<from>:<to> for direct messages). DM references expire; group
+references are released when the group is deleted. The GC sweeper removes blobs
+that have had no live reference for longer than the grace period. Per-user quotas
+count each distinct blob a user references once.
+
+Files found in the old flat attachment directories are moved into the sharded
+layout the first time they are looked up.
+
+Several processes may use the store (server.py workers, the analytics API which
+mounts the groups router). Every write checks for the blob file and adds its
+reference inside one BEGIN IMMEDIATE transaction on the index, and GC re-checks
+references and unlinks inside one too, so a blob cannot be collected between
+"already stored" and the new reference. start_gc_worker takes an exclusive lock
+file, so only one process sweeps.
+"""
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Optional
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+BLOB_DIR = os.path.join(DATA_DIR, "blobs")
+INDEX_PATH = os.path.join(DATA_DIR, "blob_index.db")
+GC_LOCK_PATH = os.path.join(DATA_DIR, "blob_gc.lock")
+# Flat <sha256>.bin directories used before the shared store existed
+LEGACY_DIRS = [
+    os.path.join(DATA_DIR, "attachments"),
+    os.path.abspath(os.path.join(BASE_DIR, "..", "data", "attachments")),
+]
+
+_SHA_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# 0 disables the per-user quota
+QUOTA_BYTES_PER_USER = 0
+GC_GRACE_SECONDS = 3600
+
+_lock = threading.RLock()
+_stop = threading.Event()
+_worker: Optional[threading.Thread] = None
+_gc_lock_file = None
+
+os.makedirs(BLOB_DIR, exist_ok=True)
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class BlobMissing(Exception):
+    """put() was called without data for a blob that is not stored."""
+
+
+def configure(quota_bytes_per_user: Optional[int] = None, gc_grace_seconds: Optional[int] = None) -> None:
+    global QUOTA_BYTES_PER_USER, GC_GRACE_SECONDS
+    if quota_bytes_per_user is not None:
+        QUOTA_BYTES_PER_USER = max(0, int(quota_bytes_per_user))
+    if gc_grace_seconds is not None:
+        GC_GRACE_SECONDS = max(0, int(gc_grace_seconds))
+
+
+def _conn() -> sqlite3.Connection:
+    conn = sqlite3.connect(INDEX_PATH, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def _init_index() -> None:
+    conn = _conn()
+    try:
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_ref_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS blob_refs (
+                sha256 TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                ref_id TEXT NOT NULL,
+                owner TEXT,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (sha256, kind, ref_id)
+            );
+            CREATE INDEX IF NOT EXISTS ix_blob_refs_owner ON blob_refs(owner);
+            CREATE INDEX IF NOT EXISTS ix_blob_refs_kind_ref ON blob_refs(kind, ref_id);
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+_init_index()
+
+
+def normalize_id(sha256: str) -> Optional[str]:
+    """Return the lowercase hex id, or None when it is not a sha256 hex digest."""
+    if not isinstance(sha256, str):
+        return None
+    s = sha256.lower()
+    return s if _SHA_RE.fullmatch(s) else None
+
+
+def blob_path(sha256: str) -> str:
+    s = normalize_id(sha256)
+    if not s:
+        raise ValueError("invalid blob id")
+    return os.path.join(BLOB_DIR, s[:2], s[2:4], f"{s}.bin")
+
+
+def _write_tmp(path: str, data: bytes) -> str:
+    """Write data next to path (fsynced) and return the temp name; os.replace() publishes it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        try:
+            f.flush()
+            os.fsync(f.fileno())
+        except Exception:
+            pass
+    return tmp
+
+
+def _remove_quietly(path: Optional[str]) -> None:
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _stored_path(sha256: str, located: Optional[str]) -> Optional[str]:
+    """The blob's file as seen inside the index transaction (located may be a legacy file served in place)."""
+    path = blob_path(sha256)
+    if os.path.isfile(path):
+        return path
+    if located and located != path and os.path.isfile(located):
+        return located
+    return None
+
+
+def _begin(conn: sqlite3.Connection) -> None:
+    # Takes the index write lock: serializes the file check + new reference here
+    # against collect_garbage's re-check + unlink, across processes
+    conn.execute("BEGIN IMMEDIATE")
+
+
+def _register(conn: sqlite3.Connection, sha256: str, size: int, now: float) -> None:
+    conn.execute(
+        "INSERT OR IGNORE INTO blobs(sha256, size, created_at, last_ref_at) VALUES (?,?,?,?)",
+        (sha256, int(size), now, now),
+    )
+
+
+def _migrate_legacy(sha256: str) -> Optional[str]:
+    for d in LEGACY_DIRS:
+        old = os.path.join(d, f"{sha256}.bin")
+        if not os.path.isfile(old):
+            continue
+        new = blob_path(sha256)
+        try:
+            os.makedirs(os.path.dirname(new), exist_ok=True)
+            os.replace(old, new)
+        except OSError:
+            # Different filesystem or read-only legacy dir: serve it in place
+            return old
+        now = time.time()
+        conn = _conn()
+        try:
+            _register(conn, sha256, os.path.getsize(new), now)
+            # Nothing records who used pre-store files, so pin them
+            conn.execute(
+                "INSERT OR IGNORE INTO blob_refs(sha256, kind, ref_id, owner, created_at, expires_at) VALUES (?,?,?,?,?,NULL)",
+                (sha256, "legacy", sha256, None, now),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return new
+    return None
+
+
+def locate(sha256: str) -> Optional[str]:
+    """Path of the stored blob (migrating a legacy flat file if needed), or None."""
+    s = normalize_id(sha256)
+    if not s:
+        return None
+    path = blob_path(s)
+    if os.path.isfile(path):
+        return path
+    with _lock:
+        if os.path.isfile(path):
+            return path
+        return _migrate_legacy(s)
+
+
+def exists(sha256: str) -> bool:
+    return locate(sha256) is not None
+
+
+def blob_size(sha256: str) -> Optional[int]:
+    path = locate(sha256)
+    if not path:
+        return None
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def holds(sha256: str, owner: Optional[str], kind: Optional[str] = None, ref_id: Optional[str] = None) -> bool:
+    """True if owner already has a live reference to the blob, or (kind, ref_id) does.
+
+    Guards link(): naming a sha256 is not proof of having its bytes, so only blobs
+    the caller (or the target of the link) already references may be linked
+    without an upload.
+    """
+    s = normalize_id(sha256)
+    if not s:
+        return False
+    conn = _conn()
+    try:
+        row = conn.execute(
+            "SELECT 1 FROM blob_refs WHERE sha256 = ? AND (expires_at IS NULL OR expires_at > ?)"
+            " AND (owner = ? OR (kind = ? AND ref_id = ?)) LIMIT 1",
+            (s, time.time(), owner, kind, ref_id),
+        ).fetchone()
+        return bool(row)
+    finally:
+        conn.close()
+
+
+def _usage(conn: sqlite3.Connection, owner: str, now: float) -> int:
+    row = conn.execute(
+        "SELECT COALESCE(SUM(size), 0) FROM blobs WHERE sha256 IN ("
+        " SELECT sha256 FROM blob_refs WHERE owner = ? AND (expires_at IS NULL OR expires_at > ?))",
+        (owner, now),
+    ).fetchone()
+    return int(row[0] or 0)
+
+
+def usage(owner: str) -> int:
+    """Bytes of distinct blobs currently referenced by owner."""
+    conn = _conn()
+    try:
+        return _usage(conn, owner, time.time())
+    finally:
+        conn.close()
+
+
+def _check_quota(conn: sqlite3.Connection, owner: Optional[str], sha256: str, size: int, now: float) -> None:
+    if not owner or QUOTA_BYTES_PER_USER <= 0:
+        return
+    held = conn.execute(
+        "SELECT 1 FROM blob_refs WHERE sha256 = ? AND owner = ? AND (expires_at IS NULL OR expires_at > ?) LIMIT 1",
+        (sha256, owner, now),
+    ).fetchone()
+    if held:
+        return
+    if _usage(conn, owner, now) + int(size) > QUOTA_BYTES_PER_USER:
+        raise QuotaExceeded(f"attachment quota of {QUOTA_BYTES_PER_USER} bytes exceeded")
+
+
+def _add_ref(conn: sqlite3.Connection, sha256: str, kind: str, ref_id: str, owner: Optional[str], expires_at: Optional[float], now: float) -> None:
+    # Re-uploading extends an expiring reference instead of adding a duplicate
+    conn.execute(
+        "INSERT INTO blob_refs(sha256, kind, ref_id, owner, created_at, expires_at) VALUES (?,?,?,?,?,?)"
+        " ON CONFLICT(sha256, kind, ref_id) DO UPDATE SET expires_at = CASE"
+        "  WHEN blob_refs.expires_at IS NULL OR excluded.expires_at IS NULL THEN NULL"
+        "  ELSE MAX(blob_refs.expires_at, excluded.expires_at) END",
+        (sha256, kind, ref_id, owner, now, expires_at),
+    )
+    conn.execute("UPDATE blobs SET last_ref_at = ? WHERE sha256 = ?", (now, sha256))
+
+
+def put(data: Optional[bytes], sha256: str, kind: str, ref_id: str, owner: Optional[str] = None, expires_at: Optional[float] = None) -> dict:
+    """Store data under sha256 (already verified by the caller) and reference it.
+
+    The bytes are only written when the blob is not stored yet; data may be None when
+    the caller already knows it is (BlobMissing is raised if it was collected since).
+    Raises QuotaExceeded when owner would go over the per-user quota. Returns
+    {id, size, created}.
+    """
+    s = normalize_id(sha256)
+    if not s:
+        raise ValueError("invalid blob id")
+    located = locate(s)  # migrates a legacy flat file before the index lock is taken
+    # Write new bytes before taking the lock; the transaction only publishes them
+    tmp = _write_tmp(blob_path(s), data) if located is None and data is not None else None
+    now = time.time()
+    try:
+        conn = _conn()
+        try:
+            _begin(conn)
+            path = _stored_path(s, located)
+            if path is None and tmp is None:
+                if data is None:
+                    raise BlobMissing(s)
+                tmp = _write_tmp(blob_path(s), data)  # collected since locate()
+            size = os.path.getsize(path) if path else len(data)
+            _check_quota(conn, owner, s, size, now)
+            created = path is None
+            if created:
+                os.replace(tmp, blob_path(s))
+                tmp = None
+            _register(conn, s, size, now)
+            _add_ref(conn, s, kind, ref_id, owner, expires_at, now)
+            conn.commit()
+        finally:
+            conn.close()
+    finally:
+        _remove_quietly(tmp)
+    return {"id": s, "size": size, "created": created}
+
+
+def put_file(src_path: str, sha256: str, kind: str, ref_id: str, owner: Optional[str] = None, expires_at: Optional[float] = None) -> dict:
+    """Like put() for bytes already on disk: src_path is moved into place (or dropped if a duplicate)."""
+    s = normalize_id(sha256)
+    if not s:
+        raise ValueError("invalid blob id")
+    located = locate(s)
+    now = time.time()
+    conn = _conn()
+    try:
+        _begin(conn)
+        path = _stored_path(s, located)
+        size = os.path.getsize(path) if path else os.path.getsize(src_path)
+        _check_quota(conn, owner, s, size, now)
+        created = path is None
+        if created:
+            dest = blob_path(s)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(src_path, dest)
+        _register(conn, s, size, now)
+        _add_ref(conn, s, kind, ref_id, owner, expires_at, now)
+        conn.commit()
+    finally:
+        conn.close()
+    if not created:
+        _remove_quietly(src_path)
+    return {"id": s, "size": size, "created": created}
+
+
+def link(sha256: str, kind: str, ref_id: str, owner: Optional[str] = None, expires_at: Optional[float] = None) -> Optional[dict]:
+    """Reference an already stored blob without uploading it again. None if unknown.
+
+    Callers acting for a client must check holds() first.
+    """
+    s = normalize_id(sha256)
+    if not s:
+        return None
+    located = locate(s)
+    if not located:
+        return None
+    now = time.time()
+    conn = _conn()
+    try:
+        _begin(conn)
+        path = _stored_path(s, located)
+        if not path:
+            return None
+        size = os.path.getsize(path)
+        _check_quota(conn, owner, s, size, now)
+        _register(conn, s, size, now)
+        _add_ref(conn, s, kind, ref_id, owner, expires_at, now)
+        conn.commit()
+    finally:
+        conn.close()
+    return {"id": s, "size": size, "created": False}
+
+
+def release(kind: str, ref_id: str) -> int:
+    """Drop every reference held by (kind, ref_id); GC reclaims orphaned blobs later."""
+    conn = _conn()
+    try:
+        cur = conn.execute("DELETE FROM blob_refs WHERE kind = ? AND ref_id = ?", (kind, ref_id))
+        conn.commit()
+        return cur.rowcount or 0
+    finally:
+        conn.close()
+
+
+def collect_garbage(grace_seconds: Optional[int] = None) -> dict:
+    """Delete expired references and blobs left without a live one for grace_seconds."""
+    grace = GC_GRACE_SECONDS if grace_seconds is None else max(0, int(grace_seconds))
+    now = time.time()
+    removed = freed = 0
+    conn = _conn()
+    try:
+        _begin(conn)
+        conn.execute("DELETE FROM blob_refs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        # Selected, deleted and unlinked under the same write lock writers take to add a reference
+        rows = conn.execute(
+            "SELECT b.sha256, b.size FROM blobs b"
+            " WHERE b.last_ref_at < ?"
+            " AND NOT EXISTS (SELECT 1 FROM blob_refs r WHERE r.sha256 = b.sha256)",
+            (now - grace,),
+        ).fetchall()
+        for sha, size in rows:
+            conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha,))
+            try:
+                os.remove(blob_path(sha))
+                removed += 1
+                freed += int(size or 0)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[blob gc] could not remove {sha}: {e}")
+        conn.commit()
+    finally:
+        conn.close()
+    # Leftovers from interrupted writes (no lock needed: live temp files are fresh)
+    for dirpath, _dirs, files in os.walk(BLOB_DIR):
+        for name in files:
+            if not name.endswith(".tmp"):
+                continue
+            p = os.path.join(dirpath, name)
+            try:
+                if os.path.getmtime(p) < now - max(grace, 3600):
+                    os.remove(p)
+            except OSError:
+                pass
+    return {"removed": removed, "bytes": freed}
+
+
+def _acquire_gc_lock() -> bool:
+    """Non-blocking exclusive lock held for the life of the process."""
+    global _gc_lock_file
+    if _gc_lock_file is not None:
+        return True
+    f = open(GC_LOCK_PATH, "a+")
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _gc_lock_file = f
+    return True
+
+
+def start_gc_worker(interval_seconds: int = 3600) -> Optional[threading.Thread]:
+    """Start (once) a daemon thread running collect_garbage every interval_seconds.
+
+    Returns None without starting anything if another process holds the GC lock.
+    """
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    if not _acquire_gc_lock():
+        return None
+    _stop.clear()
+
+    def _loop():
+        while not _stop.is_set():
+            try:
+                res = collect_garbage()
+                if res["removed"]:
+                    print(f"[blob gc] removed={res['removed']} bytes={res['bytes']}", flush=True)
+            except Exception as e:
+                print(f"[blob gc] pass failed: {e}")
+            _stop.wait(max(60, int(interval_seconds)))
+
+    _worker = threading.Thread(target=_loop, name="blob-gc", daemon=True)
+    _worker.start()
+    return _worker
+
+
+def stop_gc_worker() -> None:
+    _stop.set()
@@ -0,0 +1,75 @@
+"""Append-only compressed archive for pruned group message ciphertext.
+
+Each channel gets a directory of numbered segment files under
+data/group_archive/<group_id>/<channel_id>/. A segment is a sequence of gzip
+members, one per appended batch, holding JSON lines; a new segment is started
+once the current one exceeds SEGMENT_MAX_BYTES. Only ciphertext and routing
+metadata are stored, exactly as they were in the hot table.
+"""
+import gzip
+import json
+import os
+import re
+import threading
+from typing import Iterable, Iterator
+
+from .db import DATA_DIR
+
+
+ARCHIVE_DIR = os.path.join(DATA_DIR, "group_archive")
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+_SEGMENT_RE = re.compile(r"^(\d{8})\.jsonl\.gz$")
+_ID_RE = re.compile(r"^[0-9A-Za-z_-]{1,64}$")
+
+_lock = threading.Lock()
+
+
+def _channel_dir(group_id: str, channel_id: str) -> str:
+    # Ids come from the database (uuid hex) but are path components: validate anyway
+    if not _ID_RE.fullmatch(group_id or "") or not _ID_RE.fullmatch(channel_id or ""):
+        raise ValueError("invalid group/channel id for archive path")
+    return os.path.join(ARCHIVE_DIR, group_id, channel_id)
+
+
+def _segments(path: str) -> list[str]:
+    try:
+        names = [n for n in os.listdir(path) if _SEGMENT_RE.match(n)]
+    except FileNotFoundError:
+        return []
+    return sorted(names)
+
+
+def append_messages(group_id: str, channel_id: str, rows: Iterable[dict]) -> int:
+    """Append rows to the channel's current segment and fsync. Returns rows written."""
+    lines = [json.dumps(r, separators=(",", ":")) for r in rows]
+    if not lines:
+        return 0
+    path = _channel_dir(group_id, channel_id)
+    with _lock:
+        os.makedirs(path, exist_ok=True)
+        segs = _segments(path)
+        if segs and os.path.getsize(os.path.join(path, segs[-1])) < SEGMENT_MAX_BYTES:
+            name = segs[-1]
+        else:
+            n = int(_SEGMENT_RE.match(segs[-1]).group(1)) + 1 if segs else 0
+            name = f"{n:08d}.jsonl.gz"
+        with open(os.path.join(path, name), "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as gz:
+                gz.write(("\n".join(lines) + "\n").encode("utf-8"))
+            raw.flush()
+            try:
+                os.fsync(raw.fileno())
+            except Exception:
+                pass
+    return len(lines)
+
+
+def iter_archived(group_id: str, channel_id: str) -> Iterator[dict]:
+    """Yield archived rows for a channel, oldest segment first."""
+    path = _channel_dir(group_id, channel_id)
+    for name in _segments(path):
+        with gzip.open(os.path.join(path, name), "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
@@ -13,6 +13,7 @@ from sqlalchemy import (
     ForeignKey,
     create_engine,
     UniqueConstraint,
+    Index,
 )
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from sqlalchemy import text
@@ -50,6 +51,8 @@ class Group(Base):
     invite_code = Column(String, unique=True, nullable=False)
     key_version = Column(Integer, default=1)
     created_at = Column(Float, default=lambda: time.time())
+    # Bumped on any change to the row so /groups/sync can return only what changed
+    updated_at = Column(Float, default=lambda: time.time(), onupdate=lambda: time.time(), index=True)
 
     channels = relationship("Channel", back_populates="group", cascade="all, delete-orphan")
     members = relationship("GroupMember", back_populates="group", cascade="all, delete-orphan")
@@ -64,6 +67,7 @@ class GroupMember(Base):
     encrypted_group_key = Column(Text, nullable=True)  # base64 sealed to user
     key_version = Column(Integer, default=1)
     pending = Column(Boolean, default=False)  # for admin-approval flow
+    updated_at = Column(Float, default=lambda: time.time(), onupdate=lambda: time.time())
 
     group = relationship("Group", back_populates="members")
 
@@ -75,6 +79,7 @@ class Channel(Base):
     name = Column(String, nullable=False)
     type = Column(String, default="text")  # text|voice|announcement
     created_at = Column(Float, default=lambda: time.time())
+    updated_at = Column(Float, default=lambda: time.time(), onupdate=lambda: time.time())
 
     group = relationship("Group", back_populates="channels")
 
@@ -94,6 +99,14 @@ class GroupMessage(Base):
     attachment_meta = Column(Text, nullable=True)
     key_version = Column(Integer, default=1)
     timestamp = Column(Float, default=lambda: time.time(), index=True)
+    # Per-channel sequence number assigned from ChannelSummary.last_seq on insert.
+    # NULL for rows stored before sequences were introduced.
+    seq = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # Serves per-channel range scans (fetch, sync, retention pruning)
+        Index("ix_group_messages_channel_ts", "channel_id", "timestamp"),
+    )
 
 
 class ChannelMeta(Base):
@@ -103,6 +116,61 @@ class ChannelMeta(Base):
     description = Column(Text, nullable=True)
 
 
+class ChannelSummary(Base):
+    """Latest sequence/timestamp per channel, maintained on every message insert.
+
+    Lets clients render unread badges and last-activity for many channels without
+    fetching message bodies.
+    """
+    __tablename__ = "channel_summaries"
+    channel_id = Column(String, ForeignKey("channels.id", ondelete="CASCADE"), primary_key=True)
+    group_id = Column(String, ForeignKey("groups.id", ondelete="CASCADE"), index=True, nullable=False)
+    last_seq = Column(Integer, default=0, nullable=False)
+    last_ts = Column(Float, nullable=True)
+    last_message_id = Column(String, nullable=True)
+    last_sender_id = Column(String, nullable=True)
+
+
+class ReadCursor(Base):
+    """Highest channel sequence a member has read, and has been delivered by fetch/sync."""
+    __tablename__ = "read_cursors"
+    channel_id = Column(String, ForeignKey("channels.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(String, primary_key=True)
+    read_seq = Column(Integer, default=0, nullable=False)
+    # Used by retention: with history off, rows every current member has fetched are purged.
+    # Timestamp of the newest message delivered without gaps (fetch/sync page by timestamp).
+    fetched_ts = Column(Float, default=0.0, nullable=False)
+    updated_at = Column(Float, default=lambda: time.time(), onupdate=lambda: time.time())
+
+
+class RetentionPolicy(Base):
+    """Per-group retention applied by the background worker in retention.py.
+
+    NULL/0 limits mean "no limit" (server-wide defaults from settings.json still apply).
+    Pruned rows are appended to compressed archive segments first when `archive` is set.
+    """
+    __tablename__ = "retention_policies"
+    group_id = Column(String, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)
+    max_age_seconds = Column(Integer, nullable=True)
+    max_rows_per_channel = Column(Integer, nullable=True)
+    archive = Column(Boolean, default=True)
+    updated_at = Column(Float, default=lambda: time.time(), onupdate=lambda: time.time())
+
+
+class MemberKeyHistory(Base):
+    """Every sealed group key a member has been given, by key version.
+
+    group_members only holds the current one; this lets clients recover the key for
+    messages written before a rekey.
+    """
+    __tablename__ = "member_key_history"
+    group_id = Column(String, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(String, primary_key=True)
+    key_version = Column(Integer, primary_key=True)
+    encrypted_group_key = Column(Text, nullable=False)
+    created_at = Column(Float, default=lambda: time.time())
+
+
 def init_db():
     Base.metadata.create_all(bind=engine)
     # Ensure older databases get the new attachment_meta column without requiring a full migration tool.
@@ -114,6 +182,12 @@ def init_db():
             if 'attachment_meta' not in cols:
                 # Add the column in-place (SQLite supports adding a nullable column)
                 conn.execute(text("ALTER TABLE group_messages ADD COLUMN attachment_meta TEXT"))
+            if 'seq' not in cols:
+                conn.execute(text("ALTER TABLE group_messages ADD COLUMN seq INTEGER"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_group_messages_channel_ts ON group_messages(channel_id, timestamp)"))
+            rc_cols = [r[1] for r in conn.execute(text("PRAGMA table_info('read_cursors')")).fetchall()]
+            if 'fetched_ts' not in rc_cols:
+                conn.execute(text("ALTER TABLE read_cursors ADD COLUMN fetched_ts REAL NOT NULL DEFAULT 0"))
             # Add server_distribute flag to groups table if missing
             res2 = conn.execute(text("PRAGMA table_info('groups')"))
             gcols = [r[1] for r in res2.fetchall()]
@@ -129,6 +203,49 @@ def init_db():
                     conn.execute(text("ALTER TABLE groups ADD COLUMN server_store_history INTEGER DEFAULT 0"))
                 except Exception:
                     pass
+            # Change-tracking columns used by /groups/sync. Rows that predate the column
+            # keep NULL and are treated as changed at their creation/join time.
+            for table, tcols in (
+                ('groups', gcols),
+                ('channels', [r[1] for r in conn.execute(text("PRAGMA table_info('channels')")).fetchall()]),
+                ('group_members', [r[1] for r in conn.execute(text("PRAGMA table_info('group_members')")).fetchall()]),
+            ):
+                if 'updated_at' not in tcols:
+                    try:
+                        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN updated_at REAL"))
+                    except Exception:
+                        pass
     except Exception:
         # Don't fail startup for edge case DB locks or permission issues; fallback is to recreate DB manually
         pass
+    # Seed channel summaries for databases that already hold messages. Counts stand in
+    # for sequences so unread math keeps working; older rows simply have no seq.
+    # Current members start with everything read, otherwise the upgrade would show
+    # each of them the whole channel history as unread.
+    try:
+        with engine.begin() as conn:
+            has_summaries = conn.execute(text("SELECT 1 FROM channel_summaries LIMIT 1")).first()
+            if not has_summaries:
+                conn.execute(text(
+                    "INSERT INTO channel_summaries(channel_id, group_id, last_seq, last_ts) "
+                    "SELECT channel_id, MAX(group_id), COUNT(1), MAX(timestamp) FROM group_messages GROUP BY channel_id"
+                ))
+                conn.execute(text(
+                    "INSERT OR IGNORE INTO read_cursors(channel_id, user_id, read_seq, fetched_ts, updated_at) "
+                    "SELECT s.channel_id, m.user_id, s.last_seq, 0, :now FROM channel_summaries s "
+                    "JOIN group_members m ON m.group_id = s.group_id"
+                ), {"now": time.time()})
+    except Exception:
+        pass
+    # Seed key history with the keys members currently hold
+    try:
+        with engine.begin() as conn:
+            has_history = conn.execute(text("SELECT 1 FROM member_key_history LIMIT 1")).first()
+            if not has_history:
+                conn.execute(text(
+                    "INSERT OR IGNORE INTO member_key_history(group_id, user_id, key_version, encrypted_group_key, created_at) "
+                    "SELECT group_id, user_id, COALESCE(key_version, 1), encrypted_group_key, joined_at FROM group_members "
+                    "WHERE encrypted_group_key IS NOT NULL"
+                ))
+    except Exception:
+        pass
@@ -0,0 +1,226 @@
+"""Background retention for group_messages.
+
+Per group, rows are pruned when any of these apply:
+- older than the policy's max_age_seconds
+- beyond the newest max_rows_per_channel rows of their channel
+- the group has server_store_history off and every current member has already
+  fetched them (tracked by read_cursors.fetched_ts)
+
+Age/row-limit pruning appends the ciphertext to archive segments first (unless the
+policy disables it); fetched rows of history-off groups are simply dropped. Deletes
+run in bounded batches with a commit per batch so senders are never blocked for
+long, and freed pages are returned with incremental VACUUM once the database has
+been switched to auto_vacuum=INCREMENTAL offline:
+
+    python -m server_utils.groups_backend.retention --enable-incremental-vacuum
+
+start_retention_worker takes an exclusive lock file, so with several server
+workers only one of them runs retention (and no rows are archived twice).
+"""
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import and_, func, text
+
+from .db import DATA_DIR, SessionLocal, engine, Group, GroupMember, Channel, GroupMessage, ReadCursor, RetentionPolicy
+from . import archive
+
+
+BATCH_SIZE = 500
+# Upper bound per channel per pass so one huge channel can't starve the others
+MAX_BATCHES_PER_CHANNEL = 20
+VACUUM_PAGES = 2000
+LOCK_PATH = os.path.join(DATA_DIR, "groups_retention.lock")
+
+_stop = threading.Event()
+_worker: Optional[threading.Thread] = None
+_lock_file = None
+
+
+def _archive_row(m: GroupMessage) -> dict:
+    return {
+        "id": m.id,
+        "group_id": m.group_id,
+        "channel_id": m.channel_id,
+        "sender_id": m.sender_id,
+        "ciphertext": m.ciphertext,
+        "nonce": m.nonce,
+        "attachment_meta": m.attachment_meta,
+        "key_version": m.key_version,
+        "timestamp": m.timestamp,
+        "seq": m.seq,
+    }
+
+
+def _prune(db, ch: Channel, cond, do_archive: bool) -> int:
+    deleted = 0
+    for _ in range(MAX_BATCHES_PER_CHANNEL):
+        rows = (
+            db.query(GroupMessage)
+            .filter(GroupMessage.channel_id == ch.id, cond)
+            .order_by(GroupMessage.timestamp.asc())
+            .limit(BATCH_SIZE)
+            .all()
+        )
+        if not rows:
+            break
+        if do_archive:
+            archive.append_messages(ch.group_id, ch.id, [_archive_row(m) for m in rows])
+        db.query(GroupMessage).filter(GroupMessage.id.in_([m.id for m in rows])).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(rows)
+        if len(rows) < BATCH_SIZE:
+            break
+    return deleted
+
+
+def _min_fetched_ts(db, group_id: str, channel_id: str) -> float:
+    """Lowest fetched_ts across current members; 0 if anyone has never fetched."""
+    n_members = (
+        db.query(func.count(GroupMember.user_id))
+        .filter(GroupMember.group_id == group_id, GroupMember.pending == False)
+        .scalar()
+        or 0
+    )
+    n_cursors, min_ts = (
+        db.query(func.count(ReadCursor.user_id), func.min(ReadCursor.fetched_ts))
+        .join(GroupMember, and_(GroupMember.user_id == ReadCursor.user_id, GroupMember.group_id == group_id, GroupMember.pending == False))
+        .filter(ReadCursor.channel_id == channel_id)
+        .one()
+    )
+    if not n_members or int(n_cursors or 0) < int(n_members):
+        return 0.0
+    return float(min_ts or 0.0)
+
+
+def enable_incremental_vacuum() -> bool:
+    """Switch the DB to auto_vacuum=INCREMENTAL (a full VACUUM: run offline, server stopped).
+
+    Returns False if it already was.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        mode = conn.execute(text("PRAGMA auto_vacuum")).scalar()
+        if int(mode or 0) == 2:
+            return False
+        conn.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+        return True
+
+
+def _incremental_vacuum(pages: int = VACUUM_PAGES) -> None:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # No-op unless enable_incremental_vacuum() has been run
+        conn.execute(text(f"PRAGMA incremental_vacuum({int(pages)})"))
+
+
+def _acquire_worker_lock() -> bool:
+    """Non-blocking exclusive lock held for the life of the process."""
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
+    f = open(LOCK_PATH, "a+")
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _lock_file = f
+    return True
+
+
+def run_retention_pass(default_max_age_seconds: int = 0, default_max_rows_per_channel: int = 0) -> dict:
+    """Apply retention to every group once. Returns counts of archived and purged rows."""
+    now = time.time()
+    archived = purged = 0
+    db = SessionLocal()
+    try:
+        policies = {p.group_id: p for p in db.query(RetentionPolicy).all()}
+        for g in db.query(Group).all():
+            p = policies.get(g.id)
+            max_age = int((p.max_age_seconds if p and p.max_age_seconds else default_max_age_seconds) or 0)
+            max_rows = int((p.max_rows_per_channel if p and p.max_rows_per_channel else default_max_rows_per_channel) or 0)
+            do_archive = bool(p.archive) if p is not None and p.archive is not None else True
+            history_off = not bool(getattr(g, 'server_store_history', False))
+            if not (max_age or max_rows or history_off):
+                continue
+            for ch in db.query(Channel).filter(Channel.group_id == g.id).all():
+                if history_off:
+                    min_ts = _min_fetched_ts(db, g.id, ch.id)
+                    if min_ts:
+                        purged += _prune(db, ch, GroupMessage.timestamp <= min_ts, False)
+                conds = []
+                if max_age:
+                    conds.append(GroupMessage.timestamp < now - max_age)
+                if max_rows:
+                    boundary = (
+                        db.query(GroupMessage.timestamp)
+                        .filter(GroupMessage.channel_id == ch.id)
+                        .order_by(GroupMessage.timestamp.desc())
+                        .offset(max_rows)
+                        .limit(1)
+                        .scalar()
+                    )
+                    if boundary is not None:
+                        conds.append(GroupMessage.timestamp <= boundary)
+                for cond in conds:
+                    n = _prune(db, ch, cond, do_archive)
+                    if do_archive:
+                        archived += n
+                    else:
+                        purged += n
+    finally:
+        db.close()
+    if archived or purged:
+        try:
+            _incremental_vacuum()
+        except Exception:
+            pass
+    return {"archived": archived, "purged": purged}
+
+
+def start_retention_worker(interval_seconds: int = 3600, default_max_age_seconds: int = 0, default_max_rows_per_channel: int = 0) -> Optional[threading.Thread]:
+    """Start (once) a daemon thread running run_retention_pass every interval_seconds.
+
+    Returns None without starting anything if another process holds the worker lock.
+    """
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    if not _acquire_worker_lock():
+        return None
+    _stop.clear()
+
+    def _loop():
+        while not _stop.is_set():
+            try:
+                res = run_retention_pass(default_max_age_seconds, default_max_rows_per_channel)
+                if res["archived"] or res["purged"]:
+                    print(f"[groups retention] archived={res['archived']} purged={res['purged']}", flush=True)
+            except Exception as e:
+                print(f"[groups retention] pass failed: {e}")
+            _stop.wait(max(60, int(interval_seconds)))
+
+    _worker = threading.Thread(target=_loop, name="groups-retention", daemon=True)
+    _worker.start()
+    return _worker
+
+
+def stop_retention_worker() -> None:
+    _stop.set()
+
+
+if __name__ == "__main__":
+    if "--enable-incremental-vacuum" in sys.argv[1:]:
+        changed = enable_incremental_vacuum()
+        print("auto_vacuum=INCREMENTAL enabled" if changed else "auto_vacuum=INCREMENTAL already enabled")
+    else:
+        print(__doc__)
@@ -1,15 +1,42 @@
-from fastapi import APIRouter, HTTPException, Header, status, Body, File, UploadFile, Request
+from fastapi import APIRouter, HTTPException, Header, status, Body, File, UploadFile, Request, Depends
 import base64
 from typing import Optional
 import json
 import os
 import hashlib
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 import secrets
 import time
 import re
 
-from .db import SessionLocal, init_db, Group, GroupMember, Channel, GroupMessage, ChannelMeta
+from sqlalchemy import and_, func
+
+from server_utils import blob_store
+from . import uploads
+from . import search
+
+try:
+    # Cached admin-token check shared with the analytics API
+    from server_utils.analytics_backend.core.dependencies import admin_token
+except Exception:  # analytics backend (pydantic-settings/PyJWT) not installed
+    def admin_token(authorization: Optional[str] = Header(None)) -> bool:
+        return False
+
+from .db import (
+    SessionLocal,
+    init_db,
+    gen_id,
+    Group,
+    GroupMember,
+    Channel,
+    GroupMessage,
+    ChannelMeta,
+    ChannelSummary,
+    ReadCursor,
+    RetentionPolicy,
+    MemberKeyHistory,
+)
 from .schemas import (
     CreateGroupRequest,
     CreateGroupResponse,
@@ -21,6 +48,8 @@ from .schemas import (
     RenameChannelRequest,
     SendGroupMessageRequest,
     FetchGroupMessagesRequest,
+    SyncRequest,
+    BulkMemberKeysRequest,
 )
 
 
@@ -28,6 +57,7 @@ router = APIRouter(prefix="/groups", tags=["groups"])
 
 # Ensure DB schema is ready on module import
 init_db()
+search.init_index()
 
 
 def _require_member(db, group_id: str, user_id: str) -> GroupMember:
@@ -37,6 +67,134 @@ def _require_member(db, group_id: str, user_id: str) -> GroupMember:
     return gm
 
 
+def _history_floor(g: Group, gm: GroupMember, requested_since: float) -> float:
+    """Earliest timestamp a member may read in a group.
+
+    If server_store_history is False, do not return messages older than the member's
+    join time (prevents new members from reading history before they joined). If True,
+    server will return messages regardless of join time (clients still must handle
+    decryption/key versions).
+    """
+    if not bool(getattr(g, 'server_store_history', False)):
+        return max(requested_since, float(gm.joined_at or 0.0))
+    return requested_since
+
+
+def _bump_channel_summary(db, msg: GroupMessage) -> int:
+    """Advance the channel's sequence and latest-message fields; return the new seq.
+
+    The UPDATE takes the SQLite write lock before the seq is read back, so concurrent
+    senders in the same channel get distinct, contiguous sequence numbers.
+    """
+    updated = (
+        db.query(ChannelSummary)
+        .filter(ChannelSummary.channel_id == msg.channel_id)
+        .update(
+            {
+                ChannelSummary.last_seq: ChannelSummary.last_seq + 1,
+                ChannelSummary.last_ts: func.max(func.coalesce(ChannelSummary.last_ts, 0.0), msg.timestamp),
+                ChannelSummary.last_message_id: msg.id,
+                ChannelSummary.last_sender_id: msg.sender_id,
+            },
+            synchronize_session=False,
+        )
+    )
+    if not updated:
+        db.add(ChannelSummary(
+            channel_id=msg.channel_id,
+            group_id=msg.group_id,
+            last_seq=1,
+            last_ts=msg.timestamp,
+            last_message_id=msg.id,
+            last_sender_id=msg.sender_id,
+        ))
+        db.flush()
+        return 1
+    return int(db.query(ChannelSummary.last_seq).filter(ChannelSummary.channel_id == msg.channel_id).scalar() or 1)
+
+
+def _set_read_seq(db, channel_id: str, user_id: str, seq: int) -> None:
+    rc = db.query(ReadCursor).filter(ReadCursor.channel_id == channel_id, ReadCursor.user_id == user_id).first()
+    if rc is None:
+        db.add(ReadCursor(channel_id=channel_id, user_id=user_id, read_seq=int(seq)))
+    elif int(seq) > int(rc.read_seq or 0):
+        rc.read_seq = int(seq)
+
+
+def _set_fetched_ts(db, channel_id: str, user_id: str, since_ts: float, floor_ts: float, rows: list) -> bool:
+    """Advance the member's delivered cursor (drives history-off retention); True if it moved.
+
+    fetch/sync page by timestamp from a client-supplied `since`, so a page only
+    extends the cursor when it starts at or before it (or at the member's history
+    floor); otherwise the client skipped rows it may never have received. Writes
+    only when the cursor actually advances, so idle polls stay read-only.
+    """
+    if not rows:
+        return False
+    newest = max(float(m.timestamp or 0.0) for m in rows)
+    rc = db.query(ReadCursor).filter(ReadCursor.channel_id == channel_id, ReadCursor.user_id == user_id).first()
+    current = float(rc.fetched_ts or 0.0) if rc is not None else 0.0
+    if since_ts > max(current, floor_ts) or newest <= current:
+        return False
+    if rc is None:
+        db.add(ReadCursor(channel_id=channel_id, user_id=user_id, read_seq=0, fetched_ts=newest))
+    else:
+        rc.fetched_ts = newest
+    return True
+
+
+def _init_read_cursors(db, group_id: str, user_id: str) -> None:
+    """Start a new member's read cursors at the current head so history isn't unread."""
+    for cid, last_seq in (
+        db.query(ChannelSummary.channel_id, ChannelSummary.last_seq)
+        .filter(ChannelSummary.group_id == group_id)
+        .all()
+    ):
+        _set_read_seq(db, cid, user_id, int(last_seq or 0))
+
+
+def _record_member_key(db, group_id: str, user_id: str, encrypted_key_b64: str, key_version: int) -> None:
+    """Keep the sealed key for this version so older messages stay decryptable."""
+    row = db.query(MemberKeyHistory).filter(
+        MemberKeyHistory.group_id == group_id,
+        MemberKeyHistory.user_id == user_id,
+        MemberKeyHistory.key_version == int(key_version),
+    ).first()
+    if row:
+        row.encrypted_group_key = encrypted_key_b64
+    else:
+        db.add(MemberKeyHistory(group_id=group_id, user_id=user_id, key_version=int(key_version), encrypted_group_key=encrypted_key_b64))
+
+
+def _group_info(g: Group) -> dict:
+    return {
+        "id": g.id,
+        "name": g.name,
+        "is_public": bool(g.is_public),
+        "server_distribute": bool(g.server_distribute),
+        "server_store_history": bool(getattr(g, 'server_store_history', False)),
+        "owner_id": g.owner_id,
+        "key_version": int(g.key_version or 1),
+    }
+
+
+def _channel_info(c: Channel) -> dict:
+    return {"id": c.id, "group_id": c.group_id, "name": c.name, "type": c.type, "created_at": c.created_at}
+
+
+def _message_out(m: GroupMessage) -> dict:
+    return {
+        "id": m.id,
+        "sender_id": m.sender_id,
+        "ciphertext": m.ciphertext,
+        "nonce": m.nonce,
+        "_attachment_json": m.attachment_meta,
+        "key_version": m.key_version,
+        "timestamp": m.timestamp,
+        "seq": m.seq,
+    }
+
+
 @router.post("/create", response_model=CreateGroupResponse)
 def create_group(req: CreateGroupRequest):
     db = SessionLocal()
@@ -59,7 +217,10 @@ def create_group(req: CreateGroupRequest):
         # Owner as member (owner role); encrypted_group_key set by clients later
         gm = GroupMember(group_id=g.id, user_id=req.owner_id, role="owner", encrypted_group_key=None, key_version=1, pending=False)
         db.add(gm)
+        db.flush()
+        search.index_group(db, g.id)
         db.commit()
+        search.clear_cache()
         return CreateGroupResponse(id=g.id, invite_code=invite_code)
     finally:
         db.close()
@@ -90,6 +251,7 @@ def join_group(req: JoinGroupRequest):
                 existing.pending = False
             else:
                 db.add(GroupMember(group_id=g.id, user_id=req.user_id, role="member", encrypted_group_key=None, key_version=g.key_version, pending=False))
+            _init_read_cursors(db, g.id, req.user_id)
             db.commit()
             return {"status": "joined", "group_id": g.id, "key_version": g.key_version}
         else:
@@ -120,6 +282,7 @@ def approve_member(req: JoinGroupRequest):
         if not pending:
             raise HTTPException(status_code=404, detail="Pending request not found")
         pending.pending = False
+        _init_read_cursors(db, g.id, req.approve_user_id)
         db.commit()
         return {"status": "approved"}
     finally:
@@ -196,33 +359,52 @@ def get_group_info(group_id: str, user_id: str):
         db.close()
 
 
-@router.get("/discover")
-def discover_public_groups(query: Optional[str] = None, limit: int = 50):
-    db = SessionLocal()
-    try:
+def _public_group_page(db, query: Optional[str], limit: int, cursor: Optional[str]) -> tuple[list, Optional[str]]:
+    """One page of public groups: ranked FTS prefix matches for a query, else newest first."""
+    limit = max(1, min(int(limit), 500))
+    offset = search.decode_cursor(cursor)
+    if query and search.FTS_AVAILABLE and search.match_expression(query):
+        ids = search.search_ids(db, query, limit + 1, offset)
+        by_id = {g.id: g for g in db.query(Group).filter(Group.id.in_(ids)).all()} if ids else {}
+        groups = [by_id[i] for i in ids if i in by_id]
+    else:
         q = db.query(Group).filter(Group.is_public == True)
         if query:
             # SQLite lacks ILIKE; emulate case-insensitive search
-            pattern = f"%{query.lower()}%"
-            from sqlalchemy import func
-            q = q.filter(func.lower(Group.name).like(pattern))
-        q = q.order_by(Group.created_at.desc()).limit(int(limit))
-        items = [
-            {
-                "id": g.id,
-                "name": g.name,
-                "server_distribute": bool(g.server_distribute),
+            q = q.filter(func.lower(Group.name).like(f"%{query.lower()}%"))
+        groups = q.order_by(Group.created_at.desc(), Group.id).offset(offset).limit(limit + 1).all()
+    next_cursor = search.encode_cursor(offset + limit) if len(groups) > limit else None
+    return groups[:limit], next_cursor
+
+
+@router.get("/discover")
+def discover_public_groups(query: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None):
+    """Public groups matching query (ranked prefix search over names and channel topics).
+
+    Pass the returned next_cursor back as `cursor` for the next page.
+    """
+    def compute():
+        db = SessionLocal()
+        try:
+            groups, next_cursor = _public_group_page(db, query, limit, cursor)
+            items = [
+                {
+                    "id": g.id,
+                    "name": g.name,
+                    "server_distribute": bool(g.server_distribute),
                     "server_store_history": bool(getattr(g, 'server_store_history', False)),
-                "owner_id": g.owner_id,
-                "invite_code": g.invite_code,
-                "key_version": int(g.key_version or 1),
-                "created_at": g.created_at,
-            }
-            for g in q.all()
-        ]
-        return {"groups": items}
-    finally:
-        db.close()
+                    "owner_id": g.owner_id,
+                    "invite_code": g.invite_code,
+                    "key_version": int(g.key_version or 1),
+                    "created_at": g.created_at,
+                }
+                for g in groups
+            ]
+            return {"groups": items, "next_cursor": next_cursor}
+        finally:
+            db.close()
+
+    return search.cached(("discover", (query or "").strip().lower(), int(limit), cursor or ""), compute)
 
 
 @router.post("/channels/create")
@@ -253,7 +435,10 @@ def rename_group(group_id: str = Body(...), new_name: str = Body(...), user_id:
         if not actor or actor.role not in ("owner", "admin"):
             raise HTTPException(status_code=403, detail="Insufficient permissions")
         g.name = new_name
+        db.flush()
+        search.index_group(db, group_id)
         db.commit()
+        search.clear_cache()
         return {"status": "renamed", "name": g.name}
     finally:
         db.close()
@@ -290,8 +475,15 @@ def delete_channel(channel_id: str, user_id: str):
         if gm.role not in ("owner", "admin"):
             raise HTTPException(status_code=403, detail="Insufficient permissions")
         # Deleting channel will cascade delete its messages due to FK ondelete
+        db.query(ChannelSummary).filter(ChannelSummary.channel_id == channel_id).delete(synchronize_session=False)
+        db.query(ReadCursor).filter(ReadCursor.channel_id == channel_id).delete(synchronize_session=False)
+        db.query(ChannelMeta).filter(ChannelMeta.channel_id == channel_id).delete(synchronize_session=False)
+        group_id = ch.group_id
         db.delete(ch)
+        db.flush()
+        search.index_group(db, group_id)
         db.commit()
+        search.clear_cache()
         return {"status": "deleted"}
     finally:
         db.close()
@@ -345,12 +537,75 @@ def set_channel_meta(channel_id: str, user_id: str, topic: str | None = None, de
             db.add(meta)
         meta.topic = topic
         meta.description = description
+        db.flush()
+        search.index_group(db, ch.group_id)
         db.commit()
+        search.clear_cache()
         return {"status": "ok"}
     finally:
         db.close()
 
 
+@router.get("/channels/summaries")
+def list_channel_summaries(user_id: str, group_id: Optional[str] = None):
+    """Unread count and latest activity for every channel of my groups (or one group).
+
+    Served from channel_summaries + read_cursors in a single query; no message rows are read.
+    """
+    db = SessionLocal()
+    try:
+        q = (
+            db.query(
+                Channel.id,
+                Channel.group_id,
+                ChannelSummary.last_seq,
+                ChannelSummary.last_ts,
+                ChannelSummary.last_message_id,
+                ChannelSummary.last_sender_id,
+                ReadCursor.read_seq,
+            )
+            .join(GroupMember, and_(GroupMember.group_id == Channel.group_id, GroupMember.user_id == user_id, GroupMember.pending == False))
+            .outerjoin(ChannelSummary, ChannelSummary.channel_id == Channel.id)
+            .outerjoin(ReadCursor, and_(ReadCursor.channel_id == Channel.id, ReadCursor.user_id == user_id))
+        )
+        if group_id:
+            q = q.filter(Channel.group_id == group_id)
+        return {
+            "summaries": [
+                {
+                    "channel_id": cid,
+                    "group_id": gid,
+                    "last_seq": int(last_seq or 0),
+                    "last_ts": last_ts,
+                    "last_message_id": last_mid,
+                    "last_sender_id": last_sender,
+                    "unread": max(0, int(last_seq or 0) - int(read_seq or 0)),
+                }
+                for (cid, gid, last_seq, last_ts, last_mid, last_sender, read_seq) in q.all()
+            ]
+        }
+    finally:
+        db.close()
+
+
+@router.post("/channels/read")
+def mark_channel_read(channel_id: str, user_id: str, seq: Optional[int] = None):
+    """Advance my read cursor for a channel to `seq` (default: the latest message)."""
+    db = SessionLocal()
+    try:
+        ch = db.query(Channel).filter(Channel.id == channel_id).first()
+        if not ch:
+            raise HTTPException(status_code=404, detail="Channel not found")
+        _require_member(db, ch.group_id, user_id)
+        if seq is None:
+            seq = int(db.query(ChannelSummary.last_seq).filter(ChannelSummary.channel_id == channel_id).scalar() or 0)
+        _set_read_seq(db, channel_id, user_id, int(seq))
+        db.commit()
+        return {"status": "ok", "read_seq": int(seq)}
+    finally:
+        db.close()
+
+
 @router.get("/channels/role")
 def get_my_role(group_id: str, user_id: str):
     db = SessionLocal()
@@ -376,6 +631,7 @@ def send_group_message(req: SendGroupMessageRequest):
             raise HTTPException(status_code=409, detail="Key version mismatch")
         # Save ciphertext only
         msg = GroupMessage(
+            id=gen_id(),
             group_id=req.group_id,
             channel_id=req.channel_id,
             sender_id=req.sender_id,
@@ -385,9 +641,12 @@ def send_group_message(req: SendGroupMessageRequest):
             key_version=req.key_version,
             timestamp=req.timestamp or time.time(),
         )
+        msg.seq = _bump_channel_summary(db, msg)
         db.add(msg)
+        # The sender has obviously read their own message
+        _set_read_seq(db, req.channel_id, req.sender_id, msg.seq)
         db.commit()
-        return {"status": "ok", "id": msg.id, "timestamp": msg.timestamp}
+        return {"status": "ok", "id": msg.id, "timestamp": msg.timestamp, "seq": msg.seq}
     finally:
         db.close()
 
@@ -404,16 +663,7 @@ def fetch_group_messages(req: FetchGroupMessagesRequest, user_id: str):
         if not g:
             raise HTTPException(status_code=404, detail="Group not found")
 
-        # Determine earliest timestamp allowed. If server_store_history is False,
-        # do not return messages older than the member's join time (prevents new members
-        # from reading history before they joined). If True, server will return messages
-        # regardless of join time (clients still must handle decryption/key versions).
-        requested_since = float(req.since or 0.0)
-        if not bool(getattr(g, 'server_store_history', False)):
-            allowed_since = float(gm.joined_at or 0.0)
-            since_ts = max(requested_since, allowed_since)
-        else:
-            since_ts = requested_since
+        since_ts = _history_floor(g, gm, float(req.since or 0.0))
 
         q = (
             db.query(GroupMessage)
@@ -427,19 +677,104 @@ def fetch_group_messages(req: FetchGroupMessagesRequest, user_id: str):
         if req.limit:
             q = q.limit(int(req.limit))
         rows = q.all()
+        out = [_message_out(m) for m in rows]
+        if _set_fetched_ts(db, req.channel_id, user_id, since_ts, _history_floor(g, gm, 0.0), rows):
+            db.commit()
+        return {"messages": out}
+    finally:
+        db.close()
+
+
+@router.post("/sync")
+def sync(req: SyncRequest, user_id: str):
+    """Return everything a client needs on cold start or reconnect in one response.
+
+    - groups / channels / memberships changed after `since` (all of them when `since` is None)
+    - the full id lists of my groups and their channels so clients can drop deleted ones
+    - new ciphertext for each channel in `cursors`, newer than the given timestamp and
+      bounded by `limit_per_channel` (`has_more` tells the client to sync again)
+
+    `server_time` should be passed back as `since` on the next call.
+    """
+    server_time = time.time()
+    limit = max(1, min(int(req.limit_per_channel or 100), 500))
+    db = SessionLocal()
+    try:
+        memberships = (
+            db.query(GroupMember)
+            .filter(GroupMember.user_id == user_id, GroupMember.pending == False)
+            .all()
+        )
+        my = {m.group_id: m for m in memberships}
+        group_ids = list(my.keys())
+        if not group_ids:
+            return {"server_time": server_time, "group_ids": [], "groups": [], "memberships": [],
+                    "channel_ids": {}, "channels": [], "messages": {}, "has_more": {}}
+
+        groups = {g.id: g for g in db.query(Group).filter(Group.id.in_(group_ids)).all()}
+        channels = (
+            db.query(Channel)
+            .filter(Channel.group_id.in_(group_ids))
+            .order_by(Channel.created_at.asc())
+            .all()
+        )
+        channel_ids: dict[str, list[str]] = {gid: [] for gid in group_ids}
+        channel_group: dict[str, str] = {}
+        for c in channels:
+            channel_ids.setdefault(c.group_id, []).append(c.id)
+            channel_group[c.id] = c.group_id
+
+        def _changed(updated_at, fallback) -> bool:
+            if req.since is None:
+                return True
+            return float(updated_at or fallback or 0.0) > float(req.since)
+
+        changed_groups = [_group_info(g) for g in groups.values() if _changed(g.updated_at, g.created_at)]
+        changed_channels = [_channel_info(c) for c in channels if _changed(c.updated_at, c.created_at)]
+        changed_memberships = [
+            {
+                "group_id": m.group_id,
+                "role": m.role,
+                "key_version": int(m.key_version or 1),
+                "encrypted_group_key": m.encrypted_group_key,
+            }
+            for m in memberships
+            if _changed(m.updated_at, m.joined_at)
+        ]
+
+        messages: dict[str, list] = {}
+        has_more: dict[str, bool] = {}
+        advanced = False
+        for cid, cursor in (req.cursors or {}).items():
+            gid = channel_group.get(cid)
+            if gid is None or gid not in groups:
+                # Unknown channel or not a member of its group: silently skip
+                continue
+            since_ts = _history_floor(groups[gid], my[gid], float(cursor or 0.0))
+            rows = (
+                db.query(GroupMessage)
+                .filter(GroupMessage.channel_id == cid, GroupMessage.timestamp > since_ts)
+                .order_by(GroupMessage.timestamp.asc())
+                .limit(limit + 1)
+                .all()
+            )
+            has_more[cid] = len(rows) > limit
+            messages[cid] = [_message_out(m) for m in rows[:limit]]
+            if _set_fetched_ts(db, cid, user_id, since_ts, _history_floor(groups[gid], my[gid], 0.0), rows[:limit]):
+                advanced = True
+        # All cursor advances of this sync in one write; none at all for an idle poll
+        if advanced:
+            db.commit()
+
         return {
-            "messages": [
-                {
-                    "id": m.id,
-                    "sender_id": m.sender_id,
-                    "ciphertext": m.ciphertext,
-                    "nonce": m.nonce,
-                    "_attachment_json": m.attachment_meta,
-                    "key_version": m.key_version,
-                    "timestamp": m.timestamp,
-                }
-                for m in rows
-            ]
+            "server_time": server_time,
+            "group_ids": group_ids,
+            "groups": changed_groups,
+            "memberships": changed_memberships,
+            "channel_ids": channel_ids,
+            "channels": changed_channels,
+            "messages": messages,
+            "has_more": has_more,
         }
     finally:
         db.close()
@@ -479,6 +814,23 @@ def get_member_keys(group_id: str):
         db.close()
 
 
+@router.get("/members/keys/history")
+def get_my_key_history(group_id: str, user_id: str, key_version: Optional[int] = None):
+    """My sealed group keys by version (all of them, or just key_version)."""
+    db = SessionLocal()
+    try:
+        _require_member(db, group_id, user_id)
+        q = db.query(MemberKeyHistory).filter(MemberKeyHistory.group_id == group_id, MemberKeyHistory.user_id == user_id)
+        if key_version is not None:
+            q = q.filter(MemberKeyHistory.key_version == int(key_version))
+        rows = q.order_by(MemberKeyHistory.key_version.asc()).all()
+        if key_version is not None and not rows:
+            raise HTTPException(status_code=404, detail="No key for this version")
+        return {"keys": [{"key_version": r.key_version, "encrypted_group_key": r.encrypted_group_key} for r in rows]}
+    finally:
+        db.close()
+
+
 @router.post("/members/keys/update")
 def update_member_key(group_id: str, user_id: str, encrypted_key_b64: str, key_version: int):
     db = SessionLocal()
@@ -488,12 +840,50 @@ def update_member_key(group_id: str, user_id: str, encrypted_key_b64: str, key_v
             raise HTTPException(status_code=404, detail="Member not found")
         m.encrypted_group_key = encrypted_key_b64
         m.key_version = key_version
+        _record_member_key(db, group_id, user_id, encrypted_key_b64, key_version)
         db.commit()
         return {"status": "ok"}
     finally:
         db.close()
 
 
+@router.post("/members/keys/bulk_update")
+def bulk_update_member_keys(req: BulkMemberKeysRequest, user_id: str):
+    """Owner/Admin: store sealed group keys for many members in one transaction."""
+    db = SessionLocal()
+    try:
+        actor = db.query(GroupMember).filter(GroupMember.group_id == req.group_id, GroupMember.user_id == user_id).first()
+        if not actor or actor.role not in ("owner", "admin"):
+            raise HTTPException(status_code=403, detail="Insufficient permissions")
+        ids = list(req.keys.keys())
+        found = set()
+        # Stay well below SQLite's bound-parameter limit
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            for m in db.query(GroupMember).filter(GroupMember.group_id == req.group_id, GroupMember.user_id.in_(batch)).all():
+                m.encrypted_group_key = req.keys[m.user_id]
+                m.key_version = req.key_version
+                found.add(m.user_id)
+            have = {
+                h.user_id: h for h in db.query(MemberKeyHistory).filter(
+                    MemberKeyHistory.group_id == req.group_id,
+                    MemberKeyHistory.key_version == req.key_version,
+                    MemberKeyHistory.user_id.in_(batch),
+                ).all()
+            }
+            for uid in batch:
+                if uid not in found:
+                    continue
+                if uid in have:
+                    have[uid].encrypted_group_key = req.keys[uid]
+                else:
+                    db.add(MemberKeyHistory(group_id=req.group_id, user_id=uid, key_version=req.key_version, encrypted_group_key=req.keys[uid]))
+        db.commit()
+        return {"status": "ok", "updated": len(found), "missing": [u for u in ids if u not in found]}
+    finally:
+        db.close()
+
+
 @router.post("/invites/rotate")
 def rotate_invite(group_id: str, user_id: str):
     db = SessionLocal()
@@ -594,6 +984,7 @@ def set_group_public(group_id: str, is_public: bool, user_id: str):
             raise HTTPException(status_code=403, detail="Insufficient permissions")
         g.is_public = bool(is_public)
         db.commit()
+        search.clear_cache()
         return {"is_public": bool(g.is_public)}
     finally:
         db.close()
@@ -681,36 +1072,85 @@ async def set_group_server_store_history(group_id: Optional[str] = None, enabled
         db.close()
 
 
-# ----- Admin / management endpoints -----
-@router.get("/public/list")
-def list_all_public_groups(query: Optional[str] = None, limit: int = 200):
-    """Return all public groups (for admin/management UI). Supports optional case-insensitive name filter."""
+@router.get('/retention')
+def get_retention_policy(group_id: str, user_id: str):
     db = SessionLocal()
     try:
-        q = db.query(Group).filter(Group.is_public == True)
-        if query:
-            pattern = f"%{query.lower()}%"
-            from sqlalchemy import func
-            q = q.filter(func.lower(Group.name).like(pattern))
-        q = q.order_by(Group.created_at.desc()).limit(int(limit))
-        items = [
-            {
-                "id": g.id,
-                "name": g.name,
-                "owner_id": g.owner_id,
-                "invite_code": g.invite_code,
-                "key_version": int(g.key_version or 1),
-                "created_at": g.created_at,
-            }
-            for g in q.all()
-        ]
-        return {"groups": items}
+        _require_member(db, group_id, user_id)
+        p = db.query(RetentionPolicy).filter(RetentionPolicy.group_id == group_id).first()
+        return {
+            "group_id": group_id,
+            "max_age_seconds": p.max_age_seconds if p else None,
+            "max_rows_per_channel": p.max_rows_per_channel if p else None,
+            "archive": bool(p.archive) if p and p.archive is not None else True,
+        }
     finally:
         db.close()
 
 
+@router.post('/retention/set')
+def set_retention_policy(group_id: str, user_id: str, max_age_seconds: Optional[int] = None, max_rows_per_channel: Optional[int] = None, archive: bool = True):
+    """Owner/Admin sets how long the server keeps this group's ciphertext.
+
+    0 or omitted limits mean "no limit". With server_store_history off, rows are also
+    purged once every current member has fetched them, regardless of this policy.
+    """
+    db = SessionLocal()
+    try:
+        g = db.query(Group).filter(Group.id == group_id).first()
+        if not g:
+            raise HTTPException(status_code=404, detail="Group not found")
+        actor = db.query(GroupMember).filter(GroupMember.group_id == group_id, GroupMember.user_id == user_id).first()
+        if not actor or actor.role not in ("owner", "admin"):
+            raise HTTPException(status_code=403, detail="Insufficient permissions")
+        if (max_age_seconds or 0) < 0 or (max_rows_per_channel or 0) < 0:
+            raise HTTPException(status_code=400, detail="Limits must be non-negative")
+        p = db.query(RetentionPolicy).filter(RetentionPolicy.group_id == group_id).first()
+        if not p:
+            p = RetentionPolicy(group_id=group_id)
+            db.add(p)
+        p.max_age_seconds = int(max_age_seconds) if max_age_seconds else None
+        p.max_rows_per_channel = int(max_rows_per_channel) if max_rows_per_channel else None
+        p.archive = bool(archive)
+        db.commit()
+        return {
+            "group_id": group_id,
+            "max_age_seconds": p.max_age_seconds,
+            "max_rows_per_channel": p.max_rows_per_channel,
+            "archive": bool(p.archive),
+        }
+    finally:
+        db.close()
+
+
+# ----- Admin / management endpoints -----
+@router.get("/public/list")
+def list_all_public_groups(query: Optional[str] = None, limit: int = 200, cursor: Optional[str] = None):
+    """Return all public groups (for admin/management UI). Supports optional name/topic search and paging."""
+    def compute():
+        db = SessionLocal()
+        try:
+            groups, next_cursor = _public_group_page(db, query, limit, cursor)
+            items = [
+                {
+                    "id": g.id,
+                    "name": g.name,
+                    "owner_id": g.owner_id,
+                    "invite_code": g.invite_code,
+                    "key_version": int(g.key_version or 1),
+                    "created_at": g.created_at,
+                }
+                for g in groups
+            ]
+            return {"groups": items, "next_cursor": next_cursor}
+        finally:
+            db.close()
+
+    return search.cached(("public_list", (query or "").strip().lower(), int(limit), cursor or ""), compute)
+
+
 @router.delete("/delete")
-def delete_group(group_id: str, user_id: Optional[str] = None, authorization: Optional[str] = Header(None)):
+def delete_group(group_id: str, user_id: Optional[str] = None, is_admin_token: bool = Depends(admin_token)):
     """Delete a group and its associated data.
 
     If `user_id` is supplied, require that the actor be owner/admin; if omitted
@@ -722,20 +1162,8 @@ def delete_group(group_id: str, user_id: Optional[str] = None, authorization: Op
         g = db.query(Group).filter(Group.id == group_id).first()
         if not g:
             raise HTTPException(status_code=404, detail="Group not found")
-        # If an Authorization header with a bearer token is present and decodes
-        # to the configured admin username, allow deletion as an admin action.
-        # Otherwise, if a user_id is provided enforce owner/admin membership.
-        from server_utils.analytics_backend.core.security import decode_token
-        from server_utils.analytics_backend.core.config import get_settings
-
-        settings = get_settings()
-        is_admin_token = False
-        if authorization and authorization.lower().startswith('bearer '):
-            token = authorization.split()[1]
-            sub = decode_token(token)
-            if sub and sub == settings.admin_username:
-                is_admin_token = True
-
+        # A bearer token of the configured admin (analytics UI) allows deletion as
+        # an admin action; otherwise require an owner/admin user_id.
         if not is_admin_token:
             # Require explicit user_id and membership check for non-admins
             if not user_id:
@@ -745,23 +1173,26 @@ def delete_group(group_id: str, user_id: Optional[str] = None, authorization: Op
                 raise HTTPException(status_code=403, detail="Insufficient permissions")
         # Deleting the group will cascade to channels, messages, members due to FK ondelete
         db.delete(g)
+        search.remove_group(db, group_id)
         db.commit()
+        search.clear_cache()
+        # Attachments stay on disk until the blob GC finds them unreferenced
+        try:
+            blob_store.release("group", group_id)
+        except Exception:
+            pass
         return {"status": "deleted"}
     finally:
         db.close()
 
 
-# Attachment storage directory (raw encrypted blobs sent by clients)
-ATT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../data/attachments'))
-os.makedirs(ATT_DIR, exist_ok=True)
-
-
 @router.post('/attachments/upload')
 async def upload_attachment(group_id: str, user_id: str, request: Request, file: bytes = Body(None), upload_file: UploadFile = File(None)):
     """Accept an already-encrypted attachment blob from a group member and store it.
 
     The client is expected to encrypt attachments end-to-end. The server stores the raw
-    bytes under a deterministic sha256 filename and returns the attachment id.
+    bytes in the shared content-addressed blob store (written once per distinct sha256)
+    and returns the attachment id.
     """
     db = SessionLocal()
     try:
@@ -804,39 +1235,161 @@ async def upload_attachment(group_id: str, user_id: str, request: Request, file:
 
         if not data:
             raise HTTPException(status_code=400, detail="No file provided")
+        if len(data) > uploads.MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Attachment too large")
+
+        # Hashing and the fsynced write stay off the event loop
+        h = await run_in_threadpool(lambda: hashlib.sha256(data).hexdigest())
+        try:
+            stored = await run_in_threadpool(blob_store.put, data, h, "group", group_id, owner=user_id)
+        except blob_store.QuotaExceeded:
+            raise HTTPException(status_code=413, detail="Attachment quota exceeded")
+        return {"id": h, "size": stored["size"]}
+    finally:
+        db.close()
+
 
-        h = hashlib.sha256(data).hexdigest()
-        path = os.path.join(ATT_DIR, f"{h}.bin")
-        if not os.path.exists(path):
-            tmp = path + '.tmp'
-            with open(tmp, 'wb') as f:
-                f.write(data)
-                try: f.flush(); os.fsync(f.fileno())
-                except Exception: pass
-            os.replace(tmp, path)
-        return {"id": h, "size": len(data)}
+@router.post('/attachments/uploads/init')
+def init_chunked_upload(group_id: str, user_id: str, size: int, sha256: str, chunk_size: Optional[int] = None):
+    """Start (or resume) a chunked upload of an encrypted attachment.
+
+    Returns the session with the chunk indexes the server already has; if the caller
+    (or this group) already references a stored blob with this sha256 it is linked
+    right away and `complete` is set.
+    """
+    db = SessionLocal()
+    try:
+        _require_member(db, group_id, user_id)
+        stored = None
+        if blob_store.holds(sha256, user_id, "group", group_id):
+            try:
+                stored = blob_store.link(sha256, "group", group_id, owner=user_id)
+            except blob_store.QuotaExceeded:
+                raise HTTPException(status_code=413, detail="Attachment quota exceeded")
+        if stored:
+            return {"complete": True, "id": stored["id"], "size": stored["size"]}
+        try:
+            uploads.sweep_stale()
+        except Exception:
+            pass
+        try:
+            st = uploads.init_session(group_id, user_id, size, sha256, chunk_size)
+        except uploads.UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except blob_store.QuotaExceeded:
+            raise HTTPException(status_code=413, detail="Attachment quota exceeded")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"complete": False, **st}
+    finally:
+        db.close()
+
+
+def _load_upload(upload_id: str, user_id: str) -> dict:
+    try:
+        m = uploads.load(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if m.get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return m
+
+
+@router.get('/attachments/uploads/{upload_id}')
+def get_chunked_upload(upload_id: str, user_id: str):
+    _load_upload(upload_id, user_id)
+    return uploads.status(upload_id)
+
+
+@router.put('/attachments/uploads/{upload_id}/chunks/{index}')
+async def put_upload_chunk(upload_id: str, index: int, user_id: str, request: Request):
+    """Write one chunk (raw body) at its offset; the body is streamed to disk.
+
+    Async only to stream the body: every file operation runs in the threadpool so a
+    slow disk never stalls the event loop.
+    """
+    m = await run_in_threadpool(_load_upload, upload_id, user_id)
+    try:
+        offset, length = uploads.chunk_span(m, index)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    written = 0
+    fd = await run_in_threadpool(uploads.open_data, upload_id)
+    try:
+        async for piece in request.stream():
+            if not piece:
+                continue
+            if written + len(piece) > length:
+                raise HTTPException(status_code=400, detail="Chunk larger than expected")
+            await run_in_threadpool(os.pwrite, fd, piece, offset + written)
+            written += len(piece)
+        if written != length:
+            raise HTTPException(status_code=400, detail=f"Chunk length {written} != {length}")
+        await run_in_threadpool(os.fsync, fd)
+    finally:
+        os.close(fd)
+    await run_in_threadpool(uploads.mark_chunk, upload_id, index)
+    return {"index": index, "size": written}
+
+
+@router.post('/attachments/uploads/{upload_id}/finalize')
+def finalize_chunked_upload(upload_id: str, user_id: str, sha256: str):
+    m = _load_upload(upload_id, user_id)
+    if blob_store.normalize_id(sha256) != m.get("sha256"):
+        raise HTTPException(status_code=400, detail="sha256 does not match the upload")
+    db = SessionLocal()
+    try:
+        _require_member(db, m["group_id"], user_id)
+    finally:
+        db.close()
+    try:
+        stored = uploads.finalize(upload_id, "group", m["group_id"], owner=user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except blob_store.QuotaExceeded:
+        raise HTTPException(status_code=413, detail="Attachment quota exceeded")
+    return {"id": stored["id"], "size": stored["size"]}
+
+
+@router.delete('/attachments/uploads/{upload_id}')
+def abort_chunked_upload(upload_id: str, user_id: str):
+    _load_upload(upload_id, user_id)
+    uploads.abort(upload_id)
+    return {"status": "aborted"}
+
+
+@router.post('/attachments/link')
+def link_attachment(group_id: str, user_id: str, att_id: str):
+    """Reference an attachment the server already stores instead of uploading it again.
+
+    Clients hash locally and call this first; 404 means the bytes must be uploaded.
+    Only blobs the caller or this group already references can be linked: knowing a
+    sha256 is not proof of holding the bytes.
+    """
+    db = SessionLocal()
+    try:
+        _require_member(db, group_id, user_id)
+        if not blob_store.holds(att_id, user_id, "group", group_id):
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        try:
+            stored = blob_store.link(att_id, "group", group_id, owner=user_id)
+        except blob_store.QuotaExceeded:
+            raise HTTPException(status_code=413, detail="Attachment quota exceeded")
+        if not stored:
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        return {"id": stored["id"], "size": stored["size"]}
     finally:
         db.close()
 
 
 @router.get('/attachments/{att_id}')
-def download_attachment(att_id: str, group_id: str = None, user_id: Optional[str] = None, authorization: Optional[str] = Header(None)):
+def download_attachment(att_id: str, group_id: str = None, user_id: Optional[str] = None, is_admin_token: bool = Depends(admin_token)):
     """Stream back the raw attachment blob if the requester is a group member or an admin token.
 
     If group_id and user_id are omitted, an admin bearer token (analytics) is required.
     """
     db = SessionLocal()
     try:
-        is_admin_token = False
-        if authorization and authorization.lower().startswith('bearer '):
-            from server_utils.analytics_backend.core.security import decode_token
-            from server_utils.analytics_backend.core.config import get_settings
-            settings = get_settings()
-            token = authorization.split()[1]
-            sub = decode_token(token)
-            if sub and sub == settings.admin_username:
-                is_admin_token = True
-
         if not is_admin_token:
             if not group_id or not user_id:
                 raise HTTPException(status_code=401, detail='Authentication required')
@@ -847,9 +1400,8 @@ def download_attachment(att_id: str, group_id: str = None, user_id: Optional[str
         if not isinstance(att_id, str) or not re.fullmatch(r"[0-9a-f]{64}", att_id):
             raise HTTPException(status_code=404, detail='Attachment not found')
 
-        path = os.path.join(ATT_DIR, f"{att_id}.bin")
-        real = os.path.realpath(path)
-        if not real.startswith(os.path.realpath(ATT_DIR)):
+        path = blob_store.locate(att_id)
+        if not path:
             raise HTTPException(status_code=404, detail="Attachment not found")
 
         def iterfile():
@@ -1,4 +1,4 @@
-from typing import Optional, List
+from typing import Optional, List, Dict
 from pydantic import BaseModel
 
 
@@ -66,3 +66,18 @@ class FetchGroupMessagesRequest(BaseModel):
     channel_id: str
     since: Optional[float] = None
     limit: Optional[int] = 200
+
+
+class SyncRequest(BaseModel):
+    # channel_id -> timestamp of the newest message the client already has
+    cursors: Dict[str, float] = {}
+    # server_time returned by the previous sync; None means full metadata snapshot
+    since: Optional[float] = None
+    limit_per_channel: Optional[int] = 100
+
+
+class BulkMemberKeysRequest(BaseModel):
+    group_id: str
+    key_version: int
+    # member user_id -> group key sealed to that member (base64)
+    keys: Dict[str, str]
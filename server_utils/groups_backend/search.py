@@ -0,0 +1,135 @@
+"""Full-text index over group names and channel topics for public discovery.
+
+group_search is an FTS5 table (one row per group: name + the topics of its
+channels' ChannelMeta) with prefix indexes, queried with per-token prefix
+matches and ranked by bm25 (name weighted above topics). Routes call
+index_group()/remove_group() in the same transaction as the change they make.
+
+Results are cached for CACHE_TTL_SECONDS per (query, limit, cursor); routes
+call clear_cache() once an index change has committed. If the SQLite build has no FTS5 the routes fall back
+to LIKE filtering.
+"""
+import base64
+import json
+import re
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import text
+
+from .db import engine
+
+
+CACHE_TTL_SECONDS = 30
+CACHE_MAX_ENTRIES = 256
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_cache: dict = {}
+_cache_lock = threading.Lock()
+FTS_AVAILABLE = False
+
+
+def init_index() -> bool:
+    """Create the index (and fill it from existing groups); call after init_db()."""
+    global FTS_AVAILABLE
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS group_search USING fts5("
+                "group_id UNINDEXED, name, topics, prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+            ))
+            empty = conn.execute(text("SELECT 1 FROM group_search LIMIT 1")).first() is None
+            if empty:
+                conn.execute(text(
+                    "INSERT INTO group_search(group_id, name, topics) "
+                    "SELECT g.id, g.name, COALESCE(("
+                    "  SELECT group_concat(m.topic, ' ') FROM channels c JOIN channel_meta m ON m.channel_id = c.id"
+                    "  WHERE c.group_id = g.id AND m.topic IS NOT NULL), '') FROM groups g"
+                ))
+        FTS_AVAILABLE = True
+    except Exception as e:
+        print(f"[groups search] FTS5 unavailable, falling back to LIKE: {e}")
+        FTS_AVAILABLE = False
+    return FTS_AVAILABLE
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+def index_group(db, group_id: str) -> None:
+    """(Re)index one group from its current name and channel topics.
+
+    Runs inside the caller's transaction; call clear_cache() after it commits, or a
+    concurrent search could cache the pre-commit results again.
+    """
+    if not FTS_AVAILABLE:
+        return
+    db.execute(text("DELETE FROM group_search WHERE group_id = :gid"), {"gid": group_id})
+    db.execute(text(
+        "INSERT INTO group_search(group_id, name, topics) "
+        "SELECT g.id, g.name, COALESCE(("
+        "  SELECT group_concat(m.topic, ' ') FROM channels c JOIN channel_meta m ON m.channel_id = c.id"
+        "  WHERE c.group_id = g.id AND m.topic IS NOT NULL), '') FROM groups g WHERE g.id = :gid"
+    ), {"gid": group_id})
+
+
+def remove_group(db, group_id: str) -> None:
+    if FTS_AVAILABLE:
+        db.execute(text("DELETE FROM group_search WHERE group_id = :gid"), {"gid": group_id})
+
+
+def match_expression(query: str) -> Optional[str]:
+    """'foo ba' -> '"foo"* "ba"*' (every token as a prefix, all required); None if no tokens."""
+    tokens = _TOKEN_RE.findall(query or "")
+    if not tokens:
+        return None
+    return " ".join('"' + t.replace('"', '""') + '"*' for t in tokens[:8])
+
+
+def encode_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"o": int(offset)}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        pad = "=" * (-len(cursor) % 4)
+        return max(0, int(json.loads(base64.urlsafe_b64decode(cursor + pad)).get("o", 0)))
+    except Exception:
+        return 0
+
+
+def search_ids(db, query: str, limit: int, offset: int) -> list[str]:
+    """Ids of public groups matching query, best match first."""
+    expr = match_expression(query)
+    if not expr:
+        return []
+    rows = db.execute(text(
+        "SELECT s.group_id FROM group_search s JOIN groups g ON g.id = s.group_id "
+        "WHERE group_search MATCH :q AND g.is_public = 1 "
+        "ORDER BY bm25(group_search, 0.0, 10.0, 1.0), g.created_at DESC LIMIT :lim OFFSET :off"
+    ), {"q": expr, "lim": int(limit), "off": int(offset)}).fetchall()
+    return [r[0] for r in rows]
+
+
+def cached(key: tuple, compute):
+    """Return compute() memoized under key for CACHE_TTL_SECONDS."""
+    now = time.time()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+    value = compute()
+    with _cache_lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            # Drop expired entries first, then the oldest ones
+            for k in [k for k, v in _cache.items() if v[0] <= now]:
+                _cache.pop(k, None)
+            while len(_cache) >= CACHE_MAX_ENTRIES:
+                _cache.pop(next(iter(_cache)))
+        _cache[key] = (now + CACHE_TTL_SECONDS, value)
+    return value
@@ -0,0 +1,244 @@
+"""Resumable chunked upload sessions for large group attachments.
+
+A session is a directory under data/uploads/<upload_id>/ holding:
+- manifest.json: group, uploader, declared size/sha256 and chunk size
+- data.bin: the file, preallocated to its final size; each chunk is written at
+  its own offset, so chunks can arrive concurrently and in any order
+- <n>.ok: marker created after chunk n has been fsynced
+
+The upload id is derived from (group, uploader, sha256, size, chunk size), so a
+client that lost its connection simply calls init again and gets the same session
+back with the list of chunks the server already holds. Finalize hashes data.bin in
+one streaming pass and moves it into the shared blob store; nothing is ever held
+in memory beyond one network read.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Optional
+
+from server_utils import blob_store
+
+
+UPLOAD_DIR = os.path.join(blob_store.DATA_DIR, "uploads")
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# Overridden by configure() with the server's group_attachment_max_size_bytes
+MAX_UPLOAD_BYTES = 4 * 1024 * 1024 * 1024
+# Open sessions per uploader (their declared sizes also count against the blob quota)
+MAX_SESSIONS_PER_USER = 8
+# Sessions untouched for this long are discarded
+SESSION_TTL_SECONDS = 24 * 3600
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_lock = threading.Lock()
+
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+
+class UploadTooLarge(ValueError):
+    """Declared size over MAX_UPLOAD_BYTES, or too many open sessions."""
+
+
+def configure(max_upload_bytes: Optional[int] = None, max_sessions_per_user: Optional[int] = None) -> None:
+    global MAX_UPLOAD_BYTES, MAX_SESSIONS_PER_USER
+    if max_upload_bytes is not None and int(max_upload_bytes) > 0:
+        MAX_UPLOAD_BYTES = int(max_upload_bytes)
+    if max_sessions_per_user is not None:
+        MAX_SESSIONS_PER_USER = max(1, int(max_sessions_per_user))
+
+
+def _session_dir(upload_id: str) -> str:
+    if not isinstance(upload_id, str) or not _ID_RE.fullmatch(upload_id):
+        raise KeyError("unknown upload")
+    return os.path.join(UPLOAD_DIR, upload_id)
+
+
+def _total_chunks(size: int, chunk_size: int) -> int:
+    return max(1, (size + chunk_size - 1) // chunk_size)
+
+
+def _received(path: str) -> list[int]:
+    try:
+        return sorted(int(n[:-3]) for n in os.listdir(path) if n.endswith(".ok") and n[:-3].isdigit())
+    except FileNotFoundError:
+        return []
+
+
+def load(upload_id: str) -> dict:
+    """Return the session manifest; KeyError if it does not exist."""
+    path = _session_dir(upload_id)
+    try:
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise KeyError("unknown upload")
+
+
+def status(upload_id: str) -> dict:
+    m = load(upload_id)
+    received = _received(_session_dir(upload_id))
+    return {
+        "upload_id": upload_id,
+        "size": m["size"],
+        "sha256": m["sha256"],
+        "chunk_size": m["chunk_size"],
+        "total_chunks": m["total_chunks"],
+        "received": received,
+    }
+
+
+def _open_sessions(user_id: str) -> list[tuple[str, dict]]:
+    out = []
+    for name in os.listdir(UPLOAD_DIR):
+        try:
+            m = load(name)
+        except (KeyError, ValueError, OSError):
+            continue
+        if m.get("user_id") == user_id:
+            out.append((name, m))
+    return out
+
+
+def _check_limits(user_id: str, upload_id: str, size: int) -> None:
+    """A new session must fit the per-user session count and blob quota (counting open sessions)."""
+    others = [m for name, m in _open_sessions(user_id) if name != upload_id]
+    if len(others) >= MAX_SESSIONS_PER_USER:
+        raise UploadTooLarge(f"too many open uploads (max {MAX_SESSIONS_PER_USER})")
+    quota = blob_store.QUOTA_BYTES_PER_USER
+    if quota > 0:
+        pending = sum(int(m.get("size") or 0) for m in others)
+        if blob_store.usage(user_id) + pending + size > quota:
+            raise blob_store.QuotaExceeded(f"attachment quota of {quota} bytes exceeded")
+
+
+def init_session(group_id: str, user_id: str, size: int, sha256: str, chunk_size: Optional[int] = None) -> dict:
+    """Create (or resume) the session for this file.
+
+    Raises ValueError on bad input, UploadTooLarge over the size or session limit,
+    blob_store.QuotaExceeded if the file would not fit the uploader's quota.
+    """
+    sha = blob_store.normalize_id(sha256)
+    if not sha:
+        raise ValueError("invalid sha256")
+    size = int(size)
+    if size <= 0:
+        raise ValueError("invalid size")
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge(f"attachment larger than {MAX_UPLOAD_BYTES} bytes")
+    cs = int(chunk_size or DEFAULT_CHUNK_SIZE)
+    cs = max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, cs))
+    upload_id = hashlib.sha256(f"{group_id}:{user_id}:{sha}:{size}:{cs}".encode()).hexdigest()[:32]
+    path = _session_dir(upload_id)
+    with _lock:
+        if not os.path.exists(os.path.join(path, "manifest.json")):
+            _check_limits(user_id, upload_id, size)
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, "data.bin"), "wb") as f:
+                f.truncate(size)
+            manifest = {
+                "group_id": group_id,
+                "user_id": user_id,
+                "size": size,
+                "sha256": sha,
+                "chunk_size": cs,
+                "total_chunks": _total_chunks(size, cs),
+                "created_at": time.time(),
+            }
+            tmp = os.path.join(path, "manifest.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp, os.path.join(path, "manifest.json"))
+    _touch(path)
+    return status(upload_id)
+
+
+def _touch(path: str) -> None:
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def chunk_span(manifest: dict, index: int) -> tuple[int, int]:
+    """(offset, length) of chunk index; ValueError when out of range."""
+    total = int(manifest["total_chunks"])
+    if index < 0 or index >= total:
+        raise ValueError("chunk index out of range")
+    cs = int(manifest["chunk_size"])
+    offset = index * cs
+    return offset, min(cs, int(manifest["size"]) - offset)
+
+
+def open_data(upload_id: str) -> int:
+    """Writable fd on the session's data file (caller closes it)."""
+    return os.open(os.path.join(_session_dir(upload_id), "data.bin"), os.O_WRONLY)
+
+
+def mark_chunk(upload_id: str, index: int) -> None:
+    path = _session_dir(upload_id)
+    with open(os.path.join(path, f"{int(index)}.ok"), "wb"):
+        pass
+    _touch(path)
+
+
+def finalize(upload_id: str, kind: str, ref_id: str, owner: Optional[str] = None) -> dict:
+    """Verify all chunks and the sha256, then move the file into the blob store.
+
+    Raises ValueError if chunks are missing or the content does not match the hash
+    (the session is kept so the client can re-send), or blob_store.QuotaExceeded.
+    """
+    m = load(upload_id)
+    path = _session_dir(upload_id)
+    missing = sorted(set(range(int(m["total_chunks"]))) - set(_received(path)))
+    if missing:
+        raise ValueError(f"missing chunks: {missing[:20]}")
+    data_path = os.path.join(path, "data.bin")
+    sha = m["sha256"]
+    # Verified even when the blob is already stored: linking needs proof of the bytes
+    h = hashlib.sha256()
+    with open(data_path, "rb") as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            h.update(block)
+    if h.hexdigest() != sha:
+        # Corrupt chunks can't be identified individually: start over
+        for n in _received(path):
+            try:
+                os.remove(os.path.join(path, f"{n}.ok"))
+            except OSError:
+                pass
+        raise ValueError("sha256 mismatch")
+    stored = blob_store.put_file(data_path, sha, kind, ref_id, owner=owner)
+    abort(upload_id)
+    return stored
+
+
+def abort(upload_id: str) -> None:
+    shutil.rmtree(_session_dir(upload_id), ignore_errors=True)
+
+
+def sweep_stale(ttl_seconds: int = SESSION_TTL_SECONDS) -> int:
+    """Remove sessions with no activity for ttl_seconds. Returns sessions removed."""
+    cutoff = time.time() - ttl_seconds
+    removed = 0
+    try:
+        names = os.listdir(UPLOAD_DIR)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        p = os.path.join(UPLOAD_DIR, name)
+        try:
+            if os.path.isdir(p) and os.path.getmtime(p) < cutoff:
+                shutil.rmtree(p, ignore_errors=True)
+                removed += 1
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,75 @@
+"""Local storage benchmark: messages saved per second.
+
+    python -m utils.bench_storage [--messages N] [--pin-messages N] [--batch N]
+
+Runs against a throwaway database in a temporary directory (the real
+data/whispr_messages.db is never touched) and compares saving with a
+SessionKeyring against passing the bare PIN, which re-derives the key with
+scrypt on every call, and one save per message against save_messages_bulk.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from utils import db
+from utils.chat_storage import save_message, save_messages_bulk
+
+BENCH_PIN = "bench-pin-1234"
+PEER = "ab" * 32
+
+
+def _rate(label: str, count: int, keys) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        save_message(PEER, "peer", f"{label} message {i}", keys, timestamp=time.time() + i * 1e-6)
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"{label:>10}: {count} messages in {elapsed:.2f}s -> {rate:.1f} msg/s")
+    return rate
+
+
+def _bulk_rate(count: int, batch: int, keys) -> float:
+    start = time.perf_counter()
+    base = time.time()
+    for first in range(0, count, batch):
+        save_messages_bulk([
+            {"pub_hex": PEER, "sender": "peer", "text": f"bulk message {i}", "timestamp": base + i * 1e-6}
+            for i in range(first, min(count, first + batch))
+        ], keys)
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"{'bulk':>10}: {count} messages in {elapsed:.2f}s -> {rate:.1f} msg/s (batches of {batch})")
+    return rate
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200, help="messages saved with the session keyring")
+    parser.add_argument("--pin-messages", type=int, default=20, help="messages saved with the bare PIN (slow)")
+    parser.add_argument("--batch", type=int, default=500, help="messages per save_messages_bulk call")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="whispr_bench_") as tmp:
+        db.DB_PATH = os.path.join(tmp, "whispr_messages.db")
+        db.DB_SALT_PATH = os.path.join(tmp, "db_salt.bin")
+        print(f"engine: {'SQLCipher' if db.IS_SQLCIPHER else 'sqlite3 + encrypted page log'}")
+
+        start = time.perf_counter()
+        keyring = db.unlock_storage(BENCH_PIN)
+        print(f"    unlock: {(time.perf_counter() - start) * 1000:.1f} ms (one scrypt derivation)")
+        try:
+            fast = _rate("keyring", args.messages, keyring)
+            if args.pin_messages > 0:
+                slow = _rate("pin", args.pin_messages, BENCH_PIN)
+                print(f"   speedup: {fast / slow:.1f}x")
+            bulk = _bulk_rate(args.messages, max(1, args.batch), keyring)
+            print(f"   speedup: {bulk / fast:.1f}x over single saves")
+            assert db.count_messages(keyring, PEER) == 2 * args.messages + max(0, args.pin_messages)
+        finally:
+            db.close_store()
+            keyring.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,11 @@ from concurrent.futures import ProcessPoolExecutor, as_completed
 import json
 
 from utils.chat_storage import (
+    IncomingMessageBuffer,
     load_messages,
     save_message,
 )
-from utils.db import query_messages_before, has_older_messages
+from utils.db import query_messages_before, query_messages_from, has_older_messages
 from utils.crypto import decrypt_message, verify_signature, decrypt_blob
 from utils.network import fetch_messages, send_message, send_attachment
 from utils.attachment_envelope import parse_attachment_envelope
@@ -50,6 +51,12 @@ class ChatManager:
         self._oldest_ts = {}
         # Track per-chat loading state for older-message prefetch
         self._loading_older = {}
+        # Messages shown on each side of a search hit
+        self.search_context = 25
+        # Chats whose cache holds a mid-history window (search jump), not the latest messages
+        self._windowed = set()
+        # Received messages (polling and WebSocket) are saved in batches
+        self.incoming = IncomingMessageBuffer(lambda: self.app.keyring)
 
         # Start background threads
         threading.Thread(target=self.fetch_loop, daemon=True).start()
@@ -175,6 +182,10 @@ class ChatManager:
         if not pub_hex:
             return []
         with self._cache_lock:
+            if pub_hex in self._windowed:
+                # Reopening the chat after a search jump: start again from the newest messages
+                self._windowed.discard(pub_hex)
+                self._chat_cache.pop(pub_hex, None)
             if pub_hex in self._chat_cache:
                 return self._chat_cache[pub_hex]
 
@@ -182,7 +193,7 @@ class ChatManager:
         try:
             # Fetch newest messages first so we can display recent chat instantly
             qlimit = limit if limit is not None else self.initial_message_limit
-            msgs = load_messages(pub_hex, self.app.pin, limit=qlimit, order_asc=False)
+            msgs = load_messages(pub_hex, self.app.keyring, limit=qlimit, order_asc=False)
             with self._cache_lock:
                 self._chat_cache[pub_hex] = list(msgs)
                 if msgs:
@@ -194,7 +205,7 @@ class ChatManager:
             msgs = []
 
         # Fallback: load full history ascending if limited query failed
-        msgs = load_messages(pub_hex, self.app.pin, limit=None, order_asc=True)
+        msgs = load_messages(pub_hex, self.app.keyring, limit=None, order_asc=True)
         with self._cache_lock:
             self._chat_cache[pub_hex] = msgs
             if msgs:
@@ -212,7 +223,7 @@ class ChatManager:
         if oldest is None:
             return False
         try:
-            return has_older_messages(self.app.pin, pub_hex, float(oldest))
+            return has_older_messages(self.app.keyring, pub_hex, float(oldest))
         except Exception:
             return False
 
@@ -236,7 +247,7 @@ class ChatManager:
 
         def _bg_fetch():
             try:
-                older = query_messages_before(self.app.pin, pub_hex, float(oldest), int(count))
+                older = query_messages_before(self.app.keyring, pub_hex, float(oldest), int(count))
             except Exception as e:
                 print(f"[chat_manager] lazy load older failed: {e}")
                 with self._cache_lock:
@@ -261,6 +272,70 @@ class ChatManager:
 
         threading.Thread(target=_bg_fetch, daemon=True).start()
 
+    # --------------- Search jumps ---------------
+    def jump_to_message(self, pub_hex: str, timestamp: float, context: int | None = None):
+        """Open the conversation around one message (a search hit) and scroll to it.
+
+        Loads `context` messages on each side with query_messages_before /
+        query_messages_from; scrolling up then pages older messages as usual.
+        """
+        app = self.app
+        if not pub_hex:
+            return
+        if app.recipient_pub_hex != pub_hex:
+            app.recipient_pub_hex = pub_hex
+            try:
+                app.sidebar.update_list(selected_pub=pub_hex)
+            except Exception:
+                pass
+            try:
+                if hasattr(app, 'update_unknown_contact_banner'):
+                    app.update_unknown_contact_banner()
+            except Exception:
+                pass
+        context = int(context or self.search_context)
+
+        def _bg_load():
+            try:
+                older = query_messages_before(app.keyring, pub_hex, float(timestamp), context)
+                # One extra row tells whether the window reaches the newest message
+                newer = query_messages_from(app.keyring, pub_hex, float(timestamp), context + 2)
+            except Exception as e:
+                print(f"[chat_manager] search jump failed: {e}")
+                return
+            at_tail = len(newer) <= context + 1
+            window = list(older) + list(newer[:context + 1])
+            with self._cache_lock:
+                if at_tail:
+                    self._windowed.discard(pub_hex)
+                else:
+                    self._windowed.add(pub_hex)
+                self._chat_cache[pub_hex] = window
+                if window:
+                    self._oldest_ts[pub_hex] = window[0].get('timestamp', timestamp)
+            try:
+                self.app.after(0, self._render_messages_batched, pub_hex, window, True, max(1, len(window)))
+                self.app.after(150, self._scroll_to_message, pub_hex, len(older))
+            except Exception:
+                pass
+
+        threading.Thread(target=_bg_load, daemon=True).start()
+
+    def _scroll_to_message(self, pub_hex: str, index: int):
+        if self.app.recipient_pub_hex != pub_hex:
+            return
+        c = self.app.messages_container
+        try:
+            c.update_idletasks()
+            children = c.winfo_children()
+            if not children:
+                return
+            target = children[min(index, len(children) - 1)]
+            total = max(1, c.winfo_height())
+            c._parent_canvas.yview_moveto(max(0.0, target.winfo_y() / total - 0.05))
+        except Exception as e:
+            print(f"[chat_manager] scroll to search hit failed: {e}")
+
     def _prepend_messages_ui(self, pub_hex: str, messages: list):
         if self.app.recipient_pub_hex != pub_hex:
             return
@@ -348,6 +423,7 @@ class ChatManager:
 
                 # Decrypt in parallel
                 results = self._decrypt_messages_parallel(msgs)
+                newest_ts = self.last_fetch_ts
                 for ok, plaintext, msg in results:
                     if not ok or plaintext is None:
                         continue
@@ -401,12 +477,11 @@ class ChatManager:
                     if attachment_meta:
                         msg_dict["_attachment"] = attachment_meta
 
-                    # Save locally and update cache/UI
-                    save_message(
+                    # Queue for the batched local save and update cache/UI
+                    self.incoming.add(
                         sender_pub,
                         msg_dict["sender"],
                         msg_dict["text"],
-                        self.app.pin,
                         timestamp=timestamp,
                         attachment=attachment_meta
                     )
@@ -424,7 +499,11 @@ class ChatManager:
                         except Exception:
                             pass
 
-                    self.last_fetch_ts = max(self.last_fetch_ts, timestamp)
+                    newest_ts = max(newest_ts, timestamp)
+
+                # One transaction for the whole fetched batch; only then move the cursor
+                self.incoming.flush()
+                self.last_fetch_ts = newest_ts
 
             except Exception as e:
                 print("Fetch Error:", e)
@@ -489,9 +568,9 @@ class ChatManager:
                             if env is None:
                                 # fallback: construct minimal envelope
                                 env = {"type": "file", "name": item.get("filename"), "att_id": item.get("att_id"), "sha256": item.get("att_id"), "size": len(item.get("data") or b"")}
-                            append_outbox_message(recipient_pub, "ATTACH:" + json.dumps(env, separators=(',', ':')), self.app.pin, timestamp=ts)
+                            append_outbox_message(recipient_pub, "ATTACH:" + json.dumps(env, separators=(',', ':')), self.app.keyring, timestamp=ts)
                         else:
-                            append_outbox_message(recipient_pub, text, self.app.pin, timestamp=ts)
+                            append_outbox_message(recipient_pub, text, self.app.keyring, timestamp=ts)
                         # Optional gentle notice; avoid blocking UX
                         try:
                             self.app.notifier.show("Offline: message queued", type_="warning")
@@ -536,7 +615,7 @@ class ChatManager:
             # Save placeholder message pointing to attachment instead of full text
             placeholder = f"[File sent: {fname} ({self._human_size(size_bytes)})]"
             try:
-                save_message(recipient_pub, "You", placeholder, self.app.pin, timestamp=ts, attachment={"type": "file", "name": fname, "att_id": att_id, "size": size_bytes})
+                save_message(recipient_pub, "You", placeholder, self.app.keyring, timestamp=ts, attachment={"type": "file", "name": fname, "att_id": att_id, "size": size_bytes})
             except Exception as e:
                 print(f"[chat_manager] save_message (attachment) failed: {e}")
             try:
@@ -555,7 +634,7 @@ class ChatManager:
 
         # Optimistic local render and persistence
         try:
-            save_message(recipient_pub, "You", text, self.app.pin, timestamp=ts)
+            save_message(recipient_pub, "You", text, self.app.keyring, timestamp=ts)
         except Exception as e:
             print(f"[chat_manager] save_message failed: {e}")
         try:
@@ -574,6 +653,10 @@ class ChatManager:
     # ---------------- Stop ChatManager ----------------
     def stop(self):
         self.stop_event.set()
+        try:
+            self.incoming.flush()
+        except Exception as e:
+            print(f"[chat_manager] failed to save received messages: {e}")
         try:
             self._proc_pool.shutdown(wait=False, cancel_futures=True)
         except Exception:
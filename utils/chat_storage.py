@@ -1,21 +1,119 @@
+import threading
 from time import time
-from typing import Optional
+from typing import Callable, Optional
 
-from utils.db import insert_message, query_messages
+from utils.db import insert_message, insert_messages, query_messages
+from utils.session_keys import SessionKeyring
 
 
-def save_message(pub_hex: str, sender: str, text: str, pin: str, timestamp: float | None = None, attachment: dict | None = None):
+def save_message(pub_hex: str, sender: str, text: str, keys: "SessionKeyring | str", timestamp: float | None = None, attachment: dict | None = None):
     """Save a message directly into the encrypted SQLCipher database."""
     if timestamp is None:
         timestamp = time()
-    insert_message(pin, pub_hex, sender, text, float(timestamp), attachment)
+    insert_message(keys, pub_hex, sender, text, float(timestamp), attachment)
 
 
-def load_messages(pub_hex: str, pin: str, limit: int | None = None, order_asc: bool = True) -> list:
+def save_messages_bulk(messages: list, keys: "SessionKeyring | str") -> int:
+    """Save many messages in one transaction.
+
+    messages: dicts with pub_hex, sender, text and optional timestamp/attachment.
+    """
+    now = time()
+    rows = [
+        (m["pub_hex"], m["sender"], m["text"], float(m.get("timestamp") or now), m.get("attachment"))
+        for m in messages
+    ]
+    return insert_messages(keys, rows)
+
+
+def load_messages(pub_hex: str, keys: "SessionKeyring | str", limit: int | None = None, order_asc: bool = True) -> list:
     """Load messages from SQLCipher database.
 
     - order_asc=True: ascending (oldest->newest)
     - order_asc=False: descending (newest->oldest)
     Optional limit constrains row count.
     """
-    return query_messages(pin, pub_hex, limit=limit, order_asc=order_asc)
+    return query_messages(keys, pub_hex, limit=limit, order_asc=order_asc)
+
+
+def _pending_key(m: dict) -> tuple:
+    return (m["pub_hex"], m["timestamp"], m["sender"], m["text"])
+
+
+# Longest wait between retries of a failed background flush
+FLUSH_RETRY_MAX_DELAY = 30.0
+
+
+class IncomingMessageBuffer:
+    """Collects received messages and saves them with save_messages_bulk.
+
+    The polling loop adds a fetched batch and calls flush(); the WebSocket
+    receiver adds messages one at a time and relies on the delayed flush, so a
+    burst of pushes becomes one transaction. Also flushes once max_pending
+    messages are waiting.
+
+    Pending messages are deduplicated by (pub_hex, timestamp, sender, text): a
+    failed flush re-queues its batch and leaves the fetch cursor where it was,
+    so the next poll adds the same messages again. A failed delayed flush is
+    retried with exponential backoff even if no further messages arrive.
+    """
+
+    def __init__(self, get_keys: Callable[[], "SessionKeyring | str"], flush_delay: float = 0.25, max_pending: int = 500):
+        self._get_keys = get_keys
+        self.flush_delay = flush_delay
+        self.max_pending = max_pending
+        self._pending: list = []
+        self._keys: set = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._retry_delay = 0.0
+
+    def add(self, pub_hex: str, sender: str, text: str, timestamp: float | None = None, attachment: dict | None = None) -> None:
+        m = {"pub_hex": pub_hex, "sender": sender, "text": text, "timestamp": timestamp, "attachment": attachment}
+        key = _pending_key(m)
+        with self._lock:
+            if key in self._keys:
+                return
+            self._keys.add(key)
+            self._pending.append(m)
+            full = len(self._pending) >= self.max_pending
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_delay, self._flush_quietly)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self._flush_quietly()
+
+    def _flush_quietly(self) -> None:
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[chat_storage] failed to save received messages: {e}")
+            with self._lock:
+                if self._pending and self._timer is None:
+                    self._retry_delay = min(FLUSH_RETRY_MAX_DELAY, max(self.flush_delay, self._retry_delay * 2))
+                    self._timer = threading.Timer(self._retry_delay, self._flush_quietly)
+                    self._timer.daemon = True
+                    self._timer.start()
+            return
+        self._retry_delay = 0.0
+
+    def flush(self) -> int:
+        """Save everything pending now. On failure the messages stay queued and the error is raised."""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                batch, self._pending = self._pending, []
+                keys, self._keys = self._keys, set()
+            if not batch:
+                return 0
+            try:
+                return save_messages_bulk(batch, self._get_keys())
+            except Exception:
+                with self._lock:
+                    self._pending = batch + [m for m in self._pending if _pending_key(m) not in keys]
+                    self._keys |= keys
+                raise
@@ -1,6 +1,9 @@
+import atexit
 import os
 import sys
 import json
+import threading
+import time
 from typing import Optional
 
 # Prefer sqlcipher3 (sqlcipher3-wheels). Fallbacks are best-effort for dev.
@@ -18,17 +21,19 @@ from nacl.utils import random as nacl_random
 from nacl.secret import SecretBox
 
 from utils.path_utils import get_resource_path
-from utils.crypto import derive_master_key, zero_bytes
+from utils.local_store import LocalStore
+from utils.segment_log import SegmentLog, WalTracker, is_segment_log
+from utils.session_keys import SessionKeyring
 import tempfile
 import shutil
 
 # Detect whether the imported DB module is a real SQLCipher binding or the
-# stdlib sqlite3 fallback. When using stdlib sqlite3 we provide an
-# application-level encrypted file wrapper so the on-disk DB (and schema)
-# aren't visible in plaintext.
+# stdlib sqlite3 fallback. When using stdlib sqlite3 the on-disk DB is an
+# encrypted page log (utils/segment_log.py) so the data (and schema) aren't
+# visible in plaintext.
 IS_SQLCIPHER = getattr(sqlcipher, '__name__', '') != 'sqlite3'
 
-# File header magic for application-level encrypted DB files
+# File header magic of the older whole-file encrypted DB (read for conversion only)
 APP_DB_MAGIC = b'WHISPRDBv1'
 
 
@@ -41,7 +46,7 @@ def _is_app_encrypted_file(path: str) -> bool:
         return False
 
 
-def _decrypt_db_file_to_temp(pin: str, temp_path: str) -> None:
+def _decrypt_db_file_to_temp(keys: SessionKeyring, temp_path: str) -> None:
     """Decrypt DB_PATH (app-encrypted) into plaintext at temp_path.
 
     Raises ValueError if DB_PATH is not app-encrypted. Raises other exceptions
@@ -54,38 +59,11 @@ def _decrypt_db_file_to_temp(pin: str, temp_path: str) -> None:
     with open(DB_PATH, 'rb') as f:
         data = f.read()[len(APP_DB_MAGIC):]
     ct = base64.b64decode(data)
-    box = _enc_box_from_pin(pin)
-    pt = box.decrypt(ct)
+    pt = keys.box().decrypt(ct)
     with open(temp_path, 'wb') as f:
         f.write(pt)
 
 
-def _encrypt_temp_db_to_file(pin: str, temp_path: str) -> None:
-    """Encrypt the plaintext DB at temp_path and atomically write to DB_PATH."""
-    with open(temp_path, 'rb') as f:
-        pt = f.read()
-    box = _enc_box_from_pin(pin)
-    # Use a fresh random nonce for each encryption to avoid deterministic output
-    nonce = nacl_random(SecretBox.NONCE_SIZE)
-    ct = box.encrypt(pt, nonce)
-    b64 = base64.b64encode(ct)
-    dirpath = os.path.dirname(DB_PATH)
-    fd, tmp_out = tempfile.mkstemp(dir=dirpath)
-    try:
-        with os.fdopen(fd, 'wb') as out:
-            out.write(APP_DB_MAGIC + b64)
-        try:
-            os.replace(tmp_out, DB_PATH)
-        except Exception:
-            os.rename(tmp_out, DB_PATH)
-    finally:
-        if os.path.exists(tmp_out):
-            try:
-                os.remove(tmp_out)
-            except Exception:
-                pass
-
-
 if getattr(sys, "frozen", False):
     BASE_DIR = os.path.dirname(sys.executable)
 else:
@@ -114,418 +92,546 @@ def _ensure_db_salt() -> bytes:
     return salt
 
 
-def _key_from_pin(pin: str) -> bytes:
-    salt = _ensure_db_salt()
-    key = derive_master_key(pin, salt)
-    # Use first 32 bytes as raw key for SQLCipher (avoids double KDF when using x'..')
-    key_bytes = bytes(key[:32])
-    zero_bytes(key)
-    return key_bytes
-
+def unlock_storage(pin: str) -> SessionKeyring:
+    """Derive the local database key once for this session.
 
-def _enc_box_from_pin(pin: str) -> SecretBox:
-    """Derive a SecretBox (symmetric) from the user's PIN and the DB salt.
-
-    Returns a SecretBox instance. This function attempts to zero sensitive
-    intermediate buffers as soon as possible.
+    The returned SessionKeyring is what the storage functions below expect;
+    close it when the app locks or exits.
+    """
+    return SessionKeyring.derive(pin, _ensure_db_salt())
+
+
+def _as_keyring(keys: "SessionKeyring | str") -> SessionKeyring:
+    # A bare PIN still works but pays a full scrypt derivation per call
+    if isinstance(keys, SessionKeyring):
+        return keys
+    return unlock_storage(keys)
+
+
+# Storage format of messages.text / messages.sender, recorded per row in messages.fmt.
+# SEALED: base64(SecretBox) under the session key, used by the sqlite3 fallback
+# whose working file is plaintext while the app runs. PLAIN: stored as is, used
+# under SQLCipher, which already encrypts every page (and lets the unique index
+# deduplicate). Older SQLCipher databases are converted online after opening.
+MESSAGE_FORMAT_SEALED = 1
+MESSAGE_FORMAT_PLAIN = 2
+MESSAGE_FORMAT = MESSAGE_FORMAT_PLAIN if IS_SQLCIPHER else MESSAGE_FORMAT_SEALED
+# Rows converted per write while migrating to MESSAGE_FORMAT_PLAIN
+FORMAT_MIGRATION_BATCH = 500
+
+
+# ---- Schema (PRAGMA user_version migrations) ----
+def _migrate_v1(cur) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pub_hex TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            text TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            attachment_meta TEXT NULL
+        );
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_pub_ts ON messages(pub_hex, timestamp);")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_unique ON messages(pub_hex, timestamp, sender, text);")
+    # Groups schema (client-side local cache + keys)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS groups (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            owner_id TEXT NOT NULL,
+            is_public INTEGER DEFAULT 0,
+            invite_code TEXT,
+            key_version INTEGER DEFAULT 1,
+            created_at REAL
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS group_members (
+            group_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            role TEXT DEFAULT 'member',
+            joined_at REAL,
+            encrypted_group_key TEXT,
+            key_version INTEGER DEFAULT 1,
+            PRIMARY KEY (group_id, user_id)
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS channels (
+            id TEXT PRIMARY KEY,
+            group_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            type TEXT DEFAULT 'text',
+            created_at REAL
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS group_messages (
+            id TEXT PRIMARY KEY,
+            group_id TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            sender_id TEXT NOT NULL,
+            ciphertext TEXT NOT NULL,
+            nonce TEXT NOT NULL,
+            key_version INTEGER DEFAULT 1,
+            timestamp REAL
+        );
+        """
+    )
+    # Local secure store of my group keys (encrypted with PIN-derived SecretBox)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS my_group_keys (
+            group_id TEXT PRIMARY KEY,
+            key_version INTEGER NOT NULL,
+            enc_blob TEXT NOT NULL
+        );
+        """
+    )
+    # Every group key version I have held, so pre-rekey messages stay readable
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS group_keyring (
+            group_id TEXT NOT NULL,
+            key_version INTEGER NOT NULL,
+            enc_blob TEXT NOT NULL,
+            PRIMARY KEY (group_id, key_version)
+        );
+        """
+    )
+
+
+def _migrate_v2(cur) -> None:
+    """Offline outbox and the group message cache columns (previously created lazily per call)."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_pub TEXT NOT NULL,
+            text TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        );
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_outbox_ts ON outbox(timestamp);")
+    cols = [r[1] for r in cur.execute("PRAGMA table_info('group_messages')").fetchall()]
+    if 'attachment_meta' not in cols:
+        cur.execute("ALTER TABLE group_messages ADD COLUMN attachment_meta TEXT")
+    if 'seq' not in cols:
+        cur.execute("ALTER TABLE group_messages ADD COLUMN seq INTEGER")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_group_messages_channel_ts ON group_messages(channel_id, timestamp)")
+
+
+def _migrate_v3(cur) -> None:
+    """Per-row message storage format (existing rows are MESSAGE_FORMAT_SEALED)."""
+    cols = [r[1] for r in cur.execute("PRAGMA table_info('messages')").fetchall()]
+    if 'fmt' not in cols:
+        cur.execute(f"ALTER TABLE messages ADD COLUMN fmt INTEGER NOT NULL DEFAULT {MESSAGE_FORMAT_SEALED}")
+    # Partial index: finds rows still waiting for the plaintext conversion, empty once it is done
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_messages_sealed ON messages(id) WHERE fmt = {MESSAGE_FORMAT_SEALED}")
+
+
+def _migrate_v4(cur) -> None:
+    """Full-text index over message text (see search_messages).
+
+    External-content FTS5 table: it stores only the index and reads snippets back
+    from messages.text, so it covers MESSAGE_FORMAT_PLAIN rows only (SQLCipher,
+    where the index is encrypted with the rest of the file). Sealed rows are
+    added by the update trigger as the format migration converts them.
+    Builds without FTS5 skip this step and search by scanning instead.
     """
-    # derive_master_key returns a mutable bytearray
-    master_key = derive_master_key(pin, _ensure_db_salt())
     try:
-        enc_key = bytes(master_key[:32])
-        box = SecretBox(enc_key)
-        return box
-    finally:
-        # Zero sensitive material we created
+        cur.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+            "text, content='messages', content_rowid='id', tokenize='unicode61')"
+        )
+    except Exception as e:
+        print(f"[db] full-text search unavailable: {e}")
+        return
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages
+        WHEN new.fmt = {MESSAGE_FORMAT_PLAIN} BEGIN
+            INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages
+        WHEN old.fmt = {MESSAGE_FORMAT_PLAIN} BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END;
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF text, fmt ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, text)
+                SELECT 'delete', old.id, old.text WHERE old.fmt = {MESSAGE_FORMAT_PLAIN};
+            INSERT INTO messages_fts(rowid, text)
+                SELECT new.id, new.text WHERE new.fmt = {MESSAGE_FORMAT_PLAIN};
+        END;
+        """
+    )
+    cur.execute(f"INSERT INTO messages_fts(rowid, text) SELECT id, text FROM messages WHERE fmt = {MESSAGE_FORMAT_PLAIN}")
+
+
+# (version, step) in order; a step runs once, in the same transaction that bumps user_version
+_MIGRATIONS = [
+    (1, _migrate_v1),
+    (2, _migrate_v2),
+    (3, _migrate_v3),
+    (4, _migrate_v4),
+]
+SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
+
+def _migrate(conn) -> int:
+    cur = conn.cursor()
+    version = int(cur.execute("PRAGMA user_version;").fetchone()[0])
+    for target, step in _MIGRATIONS:
+        if version < target:
+            step(cur)
+            cur.execute(f"PRAGMA user_version = {int(target)};")
+            version = target
+    return version
+
+
+# ---- Connections ----
+def _connect(path: str, keys: Optional[SessionKeyring]):
+    conn = sqlcipher.connect(path, check_same_thread=False)
+    cur = conn.cursor()
+    if keys is not None:
         try:
-            zero_bytes(master_key)
+            cur.execute(f"PRAGMA key = x'{keys.sqlcipher_key_hex()}';")
         except Exception:
             pass
+    # Pragmas for performance
+    try:
+        cur.execute("PRAGMA journal_mode=WAL;")
+        cur.execute("PRAGMA synchronous=NORMAL;")
+        cur.execute("PRAGMA temp_store=MEMORY;")
+        cur.execute("PRAGMA cache_size=-20000;")  # ~20MB page cache
+        cur.execute("PRAGMA busy_timeout=5000;")
+        # Rows dropped by UPDATE OR REPLACE must fire messages_fts_ad too
+        cur.execute("PRAGMA recursive_triggers=ON;")
+    except Exception:
+        pass
+    return conn
+
+
+def _open_sqlcipher_store(keys: SessionKeyring) -> LocalStore:
+    store = LocalStore(lambda: _connect(DB_PATH, keys))
+    try:
+        store.write(_migrate)
+    except Exception:
+        store.close()
+        # If the DB is unreadable with current key (or an old plaintext sqlite DB), back it up and recreate
         try:
-            zero_bytes(enc_key)
+            if os.path.exists(DB_PATH):
+                shutil.move(DB_PATH, DB_PATH + ".bak")
         except Exception:
             pass
+        store = LocalStore(lambda: _connect(DB_PATH, keys))
+        store.write(_migrate)
+    _start_format_migration(store, keys)
+    return store
 
 
-def get_connection(pin: str):
-    """Return an opened connection keyed with the user's PIN.
-
-    Uses SQLCipher when available. Otherwise decrypts the application-encrypted
-    DB file into a temp plaintext DB and returns a wrapper that will
-    re-encrypt the temp DB back to disk when closed.
+def _open_row(box: Optional[SecretBox], value):
+    # Sealed values that fail to open were stored in plaintext (see _encode_row)
+    if value is None or box is None:
+        return value
+    try:
+        return box.decrypt(base64.b64decode(value)).decode()
+    except Exception:
+        return value
+
+
+def _convert_sealed_batch(store: LocalStore, box: SecretBox) -> int:
+    rows = store.read(lambda conn: conn.execute(
+        f"SELECT id, sender, text FROM messages WHERE fmt = {MESSAGE_FORMAT_SEALED} ORDER BY id LIMIT ?",
+        (FORMAT_MIGRATION_BATCH,),
+    ).fetchall())
+    if not rows:
+        return 0
+    updates = [(_open_row(box, sender), _open_row(box, text), rid) for rid, sender, text in rows]
+    # OR REPLACE: a converted row that now equals an existing plaintext row replaces it (dedupe)
+    store.write(lambda conn: conn.executemany(
+        f"UPDATE OR REPLACE messages SET sender = ?, text = ?, fmt = {MESSAGE_FORMAT_PLAIN} WHERE id = ? AND fmt = {MESSAGE_FORMAT_SEALED}",
+        updates,
+    ))
+    return len(rows)
+
+
+def _start_format_migration(store: LocalStore, keys: SessionKeyring) -> None:
+    """Convert SEALED rows to PLAIN in the background, in small transactions.
+
+    Readers handle both formats, so the app is usable while this runs; it
+    resumes on the next open if the session ends first.
     """
-    # SQLCipher available: use DB-level encryption
-    if IS_SQLCIPHER:
-        conn = sqlcipher.connect(DB_PATH)
-        cur = conn.cursor()
-        try:
-            key_bytes = _key_from_pin(pin)
-            hex_key = key_bytes.hex()
-            cur.execute(f"PRAGMA key = x'{hex_key}';")
-        except Exception:
-            pass
+    if MESSAGE_FORMAT != MESSAGE_FORMAT_PLAIN:
+        return
+    pending = store.read(lambda conn: conn.execute(
+        f"SELECT 1 FROM messages WHERE fmt = {MESSAGE_FORMAT_SEALED} LIMIT 1"
+    ).fetchone())
+    if not pending:
+        return
 
-        # Pragmas for performance
+    def _run():
+        converted = 0
         try:
-            cur.execute("PRAGMA journal_mode=WAL;")
-            cur.execute("PRAGMA synchronous=NORMAL;")
-            cur.execute("PRAGMA temp_store=MEMORY;")
-            cur.execute("PRAGMA cache_size=-20000;")  # ~20MB page cache
-        except Exception:
-            pass
+            box = keys.box()
+            while not store.closed:
+                n = _convert_sealed_batch(store, box)
+                if not n:
+                    print(f"[db] converted {converted} messages to the plaintext storage format")
+                    return
+                converted += n
+                time.sleep(0.05)  # leave the writer to interactive saves between batches
+        except Exception as e:
+            if not store.closed:
+                print(f"[db] message format migration stopped: {e}")
+
+    threading.Thread(target=_run, name="whispr-db-format-migration", daemon=True).start()
+
+
+# Plaintext working copies of the app-encrypted DB (fallback without SQLCipher)
+WORK_PREFIX = 'whispr_db_'
+WORK_SUFFIXES = ('', '-wal', '-shm')
+# Delay before retrying a snapshot the commit hook could not take
+SNAPSHOT_RETRY_SECONDS = 2.0
+
+
+def _try_lock(f) -> bool:
+    """Non-blocking exclusive lock on an open file, held until it is closed."""
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
 
-        # Initialize schema; handle cases where an old plaintext sqlite DB exists
-        try:
-            cur.execute("PRAGMA user_version;")
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    pub_hex TEXT NOT NULL,
-                    sender TEXT NOT NULL,
-                    text TEXT NOT NULL,
-                    timestamp REAL NOT NULL,
-                    attachment_meta TEXT NULL
-                );
-                """
-            )
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_pub_ts ON messages(pub_hex, timestamp);")
-            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_unique ON messages(pub_hex, timestamp, sender, text);")
-            # Groups schema (client-side local cache + keys)
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS groups (
-                    id TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    owner_id TEXT NOT NULL,
-                    is_public INTEGER DEFAULT 0,
-                    invite_code TEXT,
-                    key_version INTEGER DEFAULT 1,
-                    created_at REAL
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS group_members (
-                    group_id TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
-                    role TEXT DEFAULT 'member',
-                    joined_at REAL,
-                    encrypted_group_key TEXT,
-                    key_version INTEGER DEFAULT 1,
-                    PRIMARY KEY (group_id, user_id)
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS channels (
-                    id TEXT PRIMARY KEY,
-                    group_id TEXT NOT NULL,
-                    name TEXT NOT NULL,
-                    type TEXT DEFAULT 'text',
-                    created_at REAL
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS group_messages (
-                    id TEXT PRIMARY KEY,
-                    group_id TEXT NOT NULL,
-                    channel_id TEXT NOT NULL,
-                    sender_id TEXT NOT NULL,
-                    ciphertext TEXT NOT NULL,
-                    nonce TEXT NOT NULL,
-                    key_version INTEGER DEFAULT 1,
-                    timestamp REAL
-                );
-                """
-            )
-            # Local secure store of my group keys (encrypted with PIN-derived SecretBox)
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS my_group_keys (
-                    group_id TEXT PRIMARY KEY,
-                    key_version INTEGER NOT NULL,
-                    enc_blob TEXT NOT NULL
-                );
-                """
-            )
-            conn.commit()
-        except Exception:
-            # If the DB is unreadable with current key, back it up and recreate
-            try:
-                backup = DB_PATH + ".bak"
-                if os.path.exists(DB_PATH):
-                    shutil.move(DB_PATH, backup)
-            except Exception:
-                pass
-            conn.close()
-            conn = sqlcipher.connect(DB_PATH)
-            cur = conn.cursor()
-            try:
-                key_bytes = _key_from_pin(pin)
-                hex_key = key_bytes.hex()
-                cur.execute(f"PRAGMA key = x'{hex_key}';")
-            except Exception:
-                pass
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    pub_hex TEXT NOT NULL,
-                    sender TEXT NOT NULL,
-                    text TEXT NOT NULL,
-                    timestamp REAL NOT NULL,
-                    attachment_meta TEXT NULL
-                );
-                """
-            )
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_pub_ts ON messages(pub_hex, timestamp);")
-            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_unique ON messages(pub_hex, timestamp, sender, text);")
-            # Groups schema
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS groups (
-                    id TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    owner_id TEXT NOT NULL,
-                    is_public INTEGER DEFAULT 0,
-                    invite_code TEXT,
-                    key_version INTEGER DEFAULT 1,
-                    created_at REAL
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS group_members (
-                    group_id TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
-                    role TEXT DEFAULT 'member',
-                    joined_at REAL,
-                    encrypted_group_key TEXT,
-                    key_version INTEGER DEFAULT 1,
-                    PRIMARY KEY (group_id, user_id)
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS channels (
-                    id TEXT PRIMARY KEY,
-                    group_id TEXT NOT NULL,
-                    name TEXT NOT NULL,
-                    type TEXT DEFAULT 'text',
-                    created_at REAL
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS group_messages (
-                    id TEXT PRIMARY KEY,
-                    group_id TEXT NOT NULL,
-                    channel_id TEXT NOT NULL,
-                    sender_id TEXT NOT NULL,
-                    ciphertext TEXT NOT NULL,
-                    nonce TEXT NOT NULL,
-                    key_version INTEGER DEFAULT 1,
-                    timestamp REAL
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS my_group_keys (
-                    group_id TEXT PRIMARY KEY,
-                    key_version INTEGER NOT NULL,
-                    enc_blob TEXT NOT NULL
-                );
-                """
-            )
-            conn.commit()
-        return conn
 
-    # Application-level encrypted file path: decrypt to a temp file and return a
-    # wrapper that re-encrypts on close.
-    dirpath = os.path.dirname(DB_PATH)
-    os.makedirs(dirpath, exist_ok=True)
-    fd, temp_path = tempfile.mkstemp(prefix='whispr_db_', dir=dirpath)
-    os.close(fd)
+def _remove_quietly(path: str) -> None:
     try:
+        if os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        pass
+
+
+def _sweep_stale_working_copies() -> None:
+    """Remove plaintext working DBs left behind by a session that crashed.
+
+    Older versions kept them next to DB_PATH. They now live in the system temp
+    dir, each next to a .lock file its session keeps locked while it runs.
+    """
+    try:
+        names = os.listdir(DATA_DIR)
+    except OSError:
+        names = []
+    for name in names:
+        if name.startswith(WORK_PREFIX):
+            _remove_quietly(os.path.join(DATA_DIR, name))
+    tmpdir = tempfile.gettempdir()
+    try:
+        names = os.listdir(tmpdir)
+    except OSError:
+        return
+    for name in names:
+        if not (name.startswith(WORK_PREFIX) and name.endswith('.lock')):
+            continue
+        lock_path = os.path.join(tmpdir, name)
+        try:
+            f = open(lock_path, 'a+')
+        except OSError:
+            continue
         try:
-            _decrypt_db_file_to_temp(pin, temp_path)
-            need_init = not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0
-        except ValueError:
+            if not _try_lock(f):
+                continue  # another session is using it
+            for suffix in WORK_SUFFIXES:
+                _remove_quietly(lock_path[:-len('.lock')] + suffix)
+        finally:
+            f.close()
+        _remove_quietly(lock_path)
+
+
+def _open_app_encrypted_store(keys: SessionKeyring) -> LocalStore:
+    """Replay the encrypted segment log into a temp DB once for the session.
+
+    Each committed write batch appends only the pages it changed to DB_PATH
+    (see utils/segment_log.py). The plaintext temp DB lives in the system temp
+    dir, not DATA_DIR, and is removed when the store closes (or by the next
+    session's sweep if this one crashes).
+    A DB_PATH in the older whole-file format is converted on first open.
+    """
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    _sweep_stale_working_copies()
+    fd, lock_path = tempfile.mkstemp(prefix=WORK_PREFIX, suffix='.lock')
+    lock_file = os.fdopen(fd, 'a+')
+    _try_lock(lock_file)
+    temp_path = lock_path[:-len('.lock')]
+
+    def _remove_working_copy() -> None:
+        for suffix in WORK_SUFFIXES:
+            _remove_quietly(temp_path + suffix)
+        lock_file.close()
+        _remove_quietly(lock_path)
+
+    log = SegmentLog(DB_PATH, keys.box())
+    needs_snapshot = [False]
+    retry_timer = [None]
+    try:
+        os.close(os.open(temp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        if is_segment_log(DB_PATH):
+            log.replay_into(temp_path)
+        elif _is_app_encrypted_file(DB_PATH):
+            _decrypt_db_file_to_temp(keys, temp_path)
+            needs_snapshot[0] = True
+        elif os.path.exists(DB_PATH):
             # Existing DB was plaintext or not app-encrypted: back it up
             try:
-                if os.path.exists(DB_PATH):
-                    shutil.move(DB_PATH, DB_PATH + '.bak')
+                shutil.move(DB_PATH, DB_PATH + '.bak')
             except Exception:
                 pass
-            need_init = True
+    except Exception:
+        _remove_working_copy()
+        raise
 
-        conn = sqlcipher.connect(temp_path)
-        cur = conn.cursor()
-        # Apply performance pragmas where supported
+    wal = WalTracker(temp_path + '-wal')
+
+    def _retry_snapshot() -> None:
+        retry_timer[0] = None
         try:
-            cur.execute("PRAGMA journal_mode=WAL;")
-            cur.execute("PRAGMA synchronous=NORMAL;")
-            cur.execute("PRAGMA temp_store=MEMORY;")
-            cur.execute("PRAGMA cache_size=-20000;")
+            if not store.closed:
+                store.write(lambda conn: None)  # an empty commit runs _persist again
         except Exception:
             pass
 
-        # Initialize schema if needed
+    def _persist(conn) -> None:
         try:
-            cur.execute("PRAGMA user_version;")
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    pub_hex TEXT NOT NULL,
-                    sender TEXT NOT NULL,
-                    text TEXT NOT NULL,
-                    timestamp REAL NOT NULL,
-                    attachment_meta TEXT NULL
-                );
-                """
-            )
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_pub_ts ON messages(pub_hex, timestamp);")
-            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_unique ON messages(pub_hex, timestamp, sender, text);")
-            # Groups schema
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS groups (
-                    id TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    owner_id TEXT NOT NULL,
-                    is_public INTEGER DEFAULT 0,
-                    invite_code TEXT,
-                    key_version INTEGER DEFAULT 1,
-                    created_at REAL
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS group_members (
-                    group_id TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
-                    role TEXT DEFAULT 'member',
-                    joined_at REAL,
-                    encrypted_group_key TEXT,
-                    key_version INTEGER DEFAULT 1,
-                    PRIMARY KEY (group_id, user_id)
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS channels (
-                    id TEXT PRIMARY KEY,
-                    group_id TEXT NOT NULL,
-                    name TEXT NOT NULL,
-                    type TEXT DEFAULT 'text',
-                    created_at REAL
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS group_messages (
-                    id TEXT PRIMARY KEY,
-                    group_id TEXT NOT NULL,
-                    channel_id TEXT NOT NULL,
-                    sender_id TEXT NOT NULL,
-                    ciphertext TEXT NOT NULL,
-                    nonce TEXT NOT NULL,
-                    key_version INTEGER DEFAULT 1,
-                    timestamp REAL
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS my_group_keys (
-                    group_id TEXT PRIMARY KEY,
-                    key_version INTEGER NOT NULL,
-                    enc_blob TEXT NOT NULL
-                );
-                """
-            )
-            conn.commit()
-        except Exception:
-            # On schema init failure, clean up and re-raise
-            try:
-                conn.close()
-            except Exception:
-                pass
+            pages, db_pages, page_size = wal.committed_pages()
+            if not needs_snapshot[0]:
+                log.append(pages, db_pages, page_size)
+        except Exception as e:
+            # The log no longer matches the temp DB; rewrite it in full below
+            needs_snapshot[0] = True
+            print(f"[db] segment append failed, taking a snapshot: {e}")
+        busy, wal_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()
+        page_size = conn.execute("PRAGMA page_size;").fetchone()[0]
+        # A snapshot needs every committed page in the main file (no reader pinning the WAL)
+        if not busy and wal_frames == checkpointed:
+            if needs_snapshot[0] or log.should_compact(os.path.getsize(temp_path)):
+                try:
+                    log.snapshot(temp_path, page_size)
+                    needs_snapshot[0] = False
+                except Exception as e:
+                    print(f"[db] snapshot failed: {e}")
+        if needs_snapshot[0] and retry_timer[0] is None:
+            # Until a snapshot lands the last commits exist only in the plaintext temp DB
+            retry_timer[0] = threading.Timer(SNAPSHOT_RETRY_SECONDS, _retry_snapshot)
+            retry_timer[0].daemon = True
+            retry_timer[0].start()
+
+    def _cleanup() -> None:
+        if retry_timer[0] is not None:
+            retry_timer[0].cancel()
+        if needs_snapshot[0]:
+            # Closing the last connection folded the WAL into the temp DB
             try:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-            except Exception:
-                pass
-            raise
+                with open(temp_path, 'rb') as f:
+                    header = f.read(100)
+                page_size = int.from_bytes(header[16:18], 'big') if len(header) >= 18 else 0
+                log.snapshot(temp_path, 65536 if page_size == 1 else page_size or 4096)
+            except Exception as e:
+                print(f"[db] final snapshot failed: {e}")
+        _remove_working_copy()
+
+    def _connect_temp():
+        conn = _connect(temp_path, None)
+        # Checkpoints only happen in _persist, after the WAL frames were logged
+        conn.execute("PRAGMA wal_autocheckpoint=0;")
+        return conn
 
+    store = LocalStore(_connect_temp, after_commit=_persist, on_close=_cleanup)
+    try:
+        store.write(_migrate)
     except Exception:
-        try:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-        except Exception:
-            pass
+        store.close()
         raise
+    return store
 
-    class EncryptedConnectionWrapper:
-        def __init__(self, conn, temp_path, pin):
-            self._conn = conn
-            self._temp_path = temp_path
-            self._pin = pin
 
-        def cursor(self):
-            return self._conn.cursor()
+_store: Optional[LocalStore] = None
+_store_keys: Optional[SessionKeyring] = None
+_store_lock = threading.Lock()
 
-        def commit(self):
-            return self._conn.commit()
 
-        def execute(self, *args, **kwargs):
-            return self._conn.execute(*args, **kwargs)
+def get_store(keys: "SessionKeyring | str") -> LocalStore:
+    """Return the session's LocalStore, opening it (and migrating the schema) on first use.
 
-        def executemany(self, *args, **kwargs):
-            return self._conn.executemany(*args, **kwargs)
-
-        def close(self):
-            try:
-                self._conn.commit()
-            except Exception:
-                pass
-            try:
-                self._conn.close()
-            except Exception:
-                pass
-            try:
-                _encrypt_temp_db_to_file(self._pin, self._temp_path)
-            finally:
-                try:
-                    if os.path.exists(self._temp_path):
-                        os.remove(self._temp_path)
-                except Exception:
-                    pass
-
-        def __getattr__(self, name):
-            return getattr(self._conn, name)
-
-    return EncryptedConnectionWrapper(conn, temp_path, pin)
-
-
-def insert_message(pin: str, pub_hex: str, sender: str, text: str, timestamp: float, attachment_meta: Optional[dict] = None):
+    Uses SQLCipher when available. Otherwise the application-encrypted DB file is
+    decrypted into a temp plaintext DB once per session.
+    """
+    global _store, _store_keys
+    with _store_lock:
+        open_ = _store is not None and not _store.closed and _store_keys is not None and not _store_keys.closed
+        if open_ and keys is _store_keys:
+            return _store
+        keys = _as_keyring(keys)
+        if open_ and keys.same_key(_store_keys):
+            # Same key reached through a bare PIN
+            return _store
+        if _store is not None:
+            _store.close()
+        _store = _open_sqlcipher_store(keys) if IS_SQLCIPHER else _open_app_encrypted_store(keys)
+        _store_keys = keys
+        return _store
+
+
+def close_store() -> None:
+    """Flush pending writes and close the session's connections (call before closing the keyring)."""
+    global _store, _store_keys
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+        _store = None
+        _store_keys = None
+
+
+atexit.register(close_store)
+
+
+_INSERT_MESSAGE_SQL = "INSERT OR IGNORE INTO messages(pub_hex, sender, text, timestamp, attachment_meta, fmt) VALUES(?,?,?,?,?,?)"
+
+
+def _encode_row(box: Optional[SecretBox], pub_hex: str, sender: str, text: str, timestamp: float, attachment_meta: Optional[dict]) -> tuple:
+    att = json.dumps(attachment_meta) if attachment_meta else None
+    if MESSAGE_FORMAT == MESSAGE_FORMAT_PLAIN:
+        # SQLCipher encrypts the whole database; a second layer would only cost space and CPU
+        return (pub_hex, sender, text, timestamp, att, MESSAGE_FORMAT_PLAIN)
     # Encrypt the message text at-rest using a symmetric key derived from the PIN.
-    # This provides message-level encryption even when SQLCipher is not available.
-    try:
-        box = _enc_box_from_pin(pin)
+    # This protects the fallback engine's plaintext working file.
+    stored_text = text
+    stored_sender = sender
+    if box is not None:
         try:
             # Use explicit nonce to ensure different ciphertexts for same plaintext
             cipher = box.encrypt(text.encode(), nacl_random(SecretBox.NONCE_SIZE))
@@ -538,142 +644,249 @@ def insert_message(pin: str, pub_hex: str, sender: str, text: str, timestamp: fl
             stored_sender = base64.b64encode(sender_cipher).decode()
         except Exception:
             stored_sender = sender
+    return (pub_hex, stored_sender, stored_text, timestamp, att, MESSAGE_FORMAT_SEALED)
+
+
+def _row_box(keys: "SessionKeyring | str") -> tuple:
+    try:
+        keys = _as_keyring(keys)
+        return keys, keys.box()
     except Exception:
         # If deriving key fails (e.g., PIN too short), store plaintext to avoid data loss
-        stored_text = text
-        stored_sender = sender
+        return keys, None
 
-    conn = get_connection(pin)
-    try:
-        cur = conn.cursor()
-        att = json.dumps(attachment_meta) if attachment_meta else None
-        cur.execute(
-            "INSERT OR IGNORE INTO messages(pub_hex, sender, text, timestamp, attachment_meta) VALUES(?,?,?,?,?)",
-            (pub_hex, stored_sender, stored_text, timestamp, att),
-        )
-        conn.commit()
-    finally:
-        conn.close()
 
+def insert_message(keys: "SessionKeyring | str", pub_hex: str, sender: str, text: str, timestamp: float, attachment_meta: Optional[dict] = None):
+    keys, box = _row_box(keys)
+    row = _encode_row(box, pub_hex, sender, text, timestamp, attachment_meta)
+    get_store(keys).write(lambda conn: conn.execute(_INSERT_MESSAGE_SQL, row))
 
-def query_messages(pin: str, pub_hex: str, limit: Optional[int] = None, since_ts: Optional[float] = None, order_asc: bool = True) -> list:
-    conn = get_connection(pin)
-    try:
-        cur = conn.cursor()
-        params = [pub_hex]
-        where = "WHERE pub_hex = ?"
-        if since_ts is not None:
-            where += " AND timestamp >= ?"
-            params.append(since_ts)
-        order = "ASC" if order_asc else "DESC"
-        lim = f" LIMIT {int(limit)}" if limit else ""
-        sql = f"SELECT sender, text, timestamp, attachment_meta FROM messages {where} ORDER BY timestamp {order}{lim}"
-        rows = cur.execute(sql, params).fetchall()
-        msgs = []
-        # Attempt to derive box once per query to avoid repeated KDF calls
-        try:
-            box = _enc_box_from_pin(pin)
-        except Exception:
-            box = None
 
-        for sender, text, ts, att_json in rows:
+def insert_messages(keys: "SessionKeyring | str", messages: list) -> int:
+    """Insert many (pub_hex, sender, text, timestamp, attachment_meta) rows in one transaction.
+
+    Rows are encrypted with the session key up front and written with a single
+    executemany; duplicates are ignored as in insert_message. Returns the row count.
+    """
+    if not messages:
+        return 0
+    keys, box = _row_box(keys)
+    rows = [_encode_row(box, *m) for m in messages]
+    get_store(keys).write(lambda conn: conn.executemany(_INSERT_MESSAGE_SQL, rows))
+    return len(rows)
+
+
+def _decode_rows(box: Optional[SecretBox], rows) -> list:
+    msgs = []
+    for sender, text, ts, att_json, fmt in rows:
+        if fmt == MESSAGE_FORMAT_SEALED:
             # Try to decrypt stored text and sender; if it fails, assume plaintext
-            decoded_text = text
-            decoded_sender = sender
-            if text is not None and box is not None:
-                try:
-                    # Stored format is base64(ciphertext)
-                    ct = base64.b64decode(text)
-                    decoded_text = box.decrypt(ct).decode()
-                except Exception:
-                    decoded_text = text
-            if sender is not None and box is not None:
-                try:
-                    cs = base64.b64decode(sender)
-                    decoded_sender = box.decrypt(cs).decode()
-                except Exception:
-                    decoded_sender = sender
-
-            # Defer JSON parsing to render-time to reduce CPU during bulk loads
-            m = {"sender": decoded_sender, "text": decoded_text, "timestamp": ts, "_attachment_json": att_json}
-            msgs.append(m)
-        if not order_asc:
-            msgs.reverse()
-        return msgs
-    finally:
-        conn.close()
-
-
-def query_messages_before(pin: str, pub_hex: str, before_ts: float, limit: int) -> list:
-    """Return up to 'limit' messages older than 'before_ts' ordered ascending."""
-    conn = get_connection(pin)
+            sender = _open_row(box, sender)
+            text = _open_row(box, text)
+        # Defer JSON parsing to render-time to reduce CPU during bulk loads
+        msgs.append({"sender": sender, "text": text, "timestamp": ts, "_attachment_json": att_json})
+    return msgs
+
+
+def query_messages(keys: "SessionKeyring | str", pub_hex: str, limit: Optional[int] = None, since_ts: Optional[float] = None, order_asc: bool = True) -> list:
+    keys = _as_keyring(keys)
+    params = [pub_hex]
+    where = "WHERE pub_hex = ?"
+    if since_ts is not None:
+        where += " AND timestamp >= ?"
+        params.append(since_ts)
+    order = "ASC" if order_asc else "DESC"
+    lim = f" LIMIT {int(limit)}" if limit else ""
+    sql = f"SELECT sender, text, timestamp, attachment_meta, fmt FROM messages {where} ORDER BY timestamp {order}{lim}"
+    rows = get_store(keys).read(lambda conn: conn.execute(sql, params).fetchall())
     try:
-        cur = conn.cursor()
-        rows = cur.execute(
-            "SELECT sender, text, timestamp, attachment_meta FROM messages WHERE pub_hex = ? AND timestamp < ? ORDER BY timestamp DESC LIMIT ?",
-            (pub_hex, before_ts, int(limit)),
-        ).fetchall()
-        msgs = []
-        try:
-            box = _enc_box_from_pin(pin)
-        except Exception:
-            box = None
+        box = keys.box()
+    except Exception:
+        box = None
+    msgs = _decode_rows(box, rows)
+    if not order_asc:
+        msgs.reverse()
+    return msgs
 
-        for sender, text, ts, att_json in rows:
-            decoded_text = text
-            decoded_sender = sender
-            if text is not None and box is not None:
-                try:
-                    ct = base64.b64decode(text)
-                    decoded_text = box.decrypt(ct).decode()
-                except Exception:
-                    decoded_text = text
-            if sender is not None and box is not None:
-                try:
-                    cs = base64.b64decode(sender)
-                    decoded_sender = box.decrypt(cs).decode()
-                except Exception:
-                    decoded_sender = sender
-            msgs.append({"sender": decoded_sender, "text": decoded_text, "timestamp": ts, "_attachment_json": att_json})
-        msgs.reverse()  # return ascending
-        return msgs
-    finally:
-        conn.close()
-
-
-def has_older_messages(pin: str, pub_hex: str, before_ts: float) -> bool:
-    conn = get_connection(pin)
+
+def query_messages_before(keys: "SessionKeyring | str", pub_hex: str, before_ts: float, limit: int) -> list:
+    """Return up to 'limit' messages older than 'before_ts' ordered ascending."""
+    keys = _as_keyring(keys)
+    rows = get_store(keys).read(lambda conn: conn.execute(
+        "SELECT sender, text, timestamp, attachment_meta, fmt FROM messages WHERE pub_hex = ? AND timestamp < ? ORDER BY timestamp DESC LIMIT ?",
+        (pub_hex, before_ts, int(limit)),
+    ).fetchall())
     try:
-        cur = conn.cursor()
-        row = cur.execute(
-            "SELECT 1 FROM messages WHERE pub_hex = ? AND timestamp < ? LIMIT 1",
-            (pub_hex, before_ts),
-        ).fetchone()
-        return bool(row)
-    finally:
-        conn.close()
-
-
-def count_messages(pin: str, pub_hex: str) -> int:
-    conn = get_connection(pin)
+        box = keys.box()
+    except Exception:
+        box = None
+    msgs = _decode_rows(box, rows)
+    msgs.reverse()  # return ascending
+    return msgs
+
+
+def query_messages_from(keys: "SessionKeyring | str", pub_hex: str, from_ts: float, limit: int) -> list:
+    """Return up to 'limit' messages at or after 'from_ts' ordered ascending."""
+    keys = _as_keyring(keys)
+    rows = get_store(keys).read(lambda conn: conn.execute(
+        "SELECT sender, text, timestamp, attachment_meta, fmt FROM messages WHERE pub_hex = ? AND timestamp >= ? ORDER BY timestamp ASC LIMIT ?",
+        (pub_hex, from_ts, int(limit)),
+    ).fetchall())
     try:
-        cur = conn.cursor()
-        row = cur.execute("SELECT COUNT(1) FROM messages WHERE pub_hex = ?", (pub_hex,)).fetchone()
-        return int(row[0] if row else 0)
-    finally:
-        conn.close()
+        box = keys.box()
+    except Exception:
+        box = None
+    return _decode_rows(box, rows)
+
+
+def has_older_messages(keys: "SessionKeyring | str", pub_hex: str, before_ts: float) -> bool:
+    row = get_store(keys).read(lambda conn: conn.execute(
+        "SELECT 1 FROM messages WHERE pub_hex = ? AND timestamp < ? LIMIT 1",
+        (pub_hex, before_ts),
+    ).fetchone())
+    return bool(row)
+
+
+def count_messages(keys: "SessionKeyring | str", pub_hex: str) -> int:
+    row = get_store(keys).read(lambda conn: conn.execute(
+        "SELECT COUNT(1) FROM messages WHERE pub_hex = ?", (pub_hex,)
+    ).fetchone())
+    return int(row[0] if row else 0)
+
+
+# ---- Full-text search ----
+SEARCH_MARKS = ("\u00ab", "\u00bb")
+SEARCH_SNIPPET_TOKENS = 12
+SEARCH_SNIPPET_CHARS = 80
+# Rows decrypted per read when searching without the FTS index
+SEARCH_SCAN_BATCH = 500
+
+
+def _search_terms(query: str) -> list:
+    return [t for t in (query or "").split() if t.strip('"')]
+
+
+def _fts_query(terms: list) -> str:
+    # Every term as a quoted phrase (user input is never parsed as FTS syntax), the last as a prefix
+    phrases = ['"' + t.replace('"', '""') + '"' for t in terms]
+    phrases[-1] += "*"
+    return " ".join(phrases)
+
+
+def _has_search_index(conn) -> bool:
+    return bool(conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'").fetchone())
+
+
+def _scan_snippet(text: str, terms: list) -> Optional[str]:
+    lowered = text.lower()
+    hits = [lowered.find(t.lower()) for t in terms]
+    if any(h < 0 for h in hits):
+        return None
+    first = min(hits)
+    term_len = len(terms[hits.index(first)])
+    start = max(0, first - SEARCH_SNIPPET_CHARS // 2)
+    end = min(len(text), first + term_len + SEARCH_SNIPPET_CHARS // 2)
+    open_mark, close_mark = SEARCH_MARKS
+    return (
+        ("\u2026" if start > 0 else "")
+        + text[start:first] + open_mark + text[first:first + term_len] + close_mark
+        + text[first + term_len:end]
+        + ("\u2026" if end < len(text) else "")
+    )
+
+
+def _scan_messages(store: LocalStore, box: Optional[SecretBox], terms: list, pub_hex: Optional[str], limit: int, offset: int) -> list:
+    """Newest-first decrypt-and-match over the rows; used when the FTS index cannot serve the query."""
+    results: list = []
+    skipped = 0
+    cursor = None  # (timestamp, id) of the last row seen, for keyset paging
+    while len(results) < limit:
+        where, params = [], []
+        if pub_hex:
+            where.append("pub_hex = ?")
+            params.append(pub_hex)
+        if cursor is not None:
+            where.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        sql = "SELECT id, pub_hex, text, timestamp, fmt FROM messages"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params.append(SEARCH_SCAN_BATCH)
+        rows = store.read(lambda conn: conn.execute(sql, params).fetchall())
+        if not rows:
+            break
+        for rid, row_pub, text, ts, fmt in rows:
+            if fmt == MESSAGE_FORMAT_SEALED:
+                text = _open_row(box, text)
+            snippet = _scan_snippet(text or "", terms)
+            if snippet is None:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            results.append((row_pub, ts, snippet))
+            if len(results) >= limit:
+                break
+        cursor = (rows[-1][3], rows[-1][0])
+    return results
+
+
+def search_messages(keys: "SessionKeyring | str", query: str, pub_hex: Optional[str] = None, limit: int = 20, offset: int = 0) -> list:
+    """Search message text, newest first. Returns [(pub_hex, timestamp, snippet)].
+
+    Matches messages containing every word of 'query' (the last word as a
+    prefix); the matched word is wrapped in SEARCH_MARKS in the snippet.
+    Page with limit/offset; pass pub_hex to search one conversation.
+
+    Served by the messages_fts index under SQLCipher. The sqlite3 fallback keeps
+    message text sealed in its working file, so nothing is indexed there and the
+    rows are decrypted and matched in batches instead (as are rows still waiting
+    for the format migration).
+    """
+    terms = _search_terms(query)
+    if not terms or limit <= 0:
+        return []
+    keys = _as_keyring(keys)
+    store = get_store(keys)
+    try:
+        box = keys.box()
+    except Exception:
+        box = None
+    limit, offset = int(limit), max(0, int(offset))
+    if MESSAGE_FORMAT != MESSAGE_FORMAT_PLAIN or not store.read(_has_search_index):
+        return _scan_messages(store, box, terms, pub_hex, limit, offset)
+    pending = store.read(lambda conn: conn.execute(
+        f"SELECT 1 FROM messages WHERE fmt = {MESSAGE_FORMAT_SEALED} LIMIT 1"
+    ).fetchone())
+    if pending:
+        return _scan_messages(store, box, terms, pub_hex, limit, offset)
+    open_mark, close_mark = SEARCH_MARKS
+    sql = (
+        "SELECT m.pub_hex, m.timestamp, snippet(messages_fts, 0, ?, ?, ?, ?) "
+        "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+        "WHERE messages_fts MATCH ?"
+    )
+    params: list = [open_mark, close_mark, "\u2026", SEARCH_SNIPPET_TOKENS, _fts_query(terms)]
+    if pub_hex:
+        sql += " AND m.pub_hex = ?"
+        params.append(pub_hex)
+    sql += " ORDER BY m.timestamp DESC LIMIT ? OFFSET ?"
+    params.extend([limit, offset])
+    rows = store.read(lambda conn: conn.execute(sql, params).fetchall())
+    return [(row_pub, ts, snippet) for row_pub, ts, snippet in rows]
 
 
 # ---- Group key local vault helpers ----
-def store_my_group_key(pin: str, group_id: str, key_bytes: bytes, key_version: int) -> None:
-    box = _enc_box_from_pin(pin)
+def store_my_group_key(keys: "SessionKeyring | str", group_id: str, key_bytes: bytes, key_version: int) -> None:
+    keys = _as_keyring(keys)
+    box = keys.box()
     nonce = nacl_random(SecretBox.NONCE_SIZE)
     ct = box.encrypt(key_bytes, nonce)
     b64 = base64.b64encode(ct).decode()
-    conn = get_connection(pin)
-    try:
-        cur = conn.cursor()
-        cur.execute(
+
+    def _write(conn):
+        conn.execute(
             """
             INSERT INTO my_group_keys(group_id, key_version, enc_blob)
             VALUES(?,?,?)
@@ -681,21 +894,56 @@ def store_my_group_key(pin: str, group_id: str, key_bytes: bytes, key_version: i
             """,
             (group_id, int(key_version), b64),
         )
-        conn.commit()
-    finally:
-        conn.close()
+        conn.execute(
+            "INSERT OR REPLACE INTO group_keyring(group_id, key_version, enc_blob) VALUES(?,?,?)",
+            (group_id, int(key_version), b64),
+        )
 
+    get_store(keys).write(_write)
 
-def load_my_group_key(pin: str, group_id: str) -> tuple[bytes, int] | None:
-    conn = get_connection(pin)
-    try:
-        cur = conn.cursor()
-        row = cur.execute("SELECT key_version, enc_blob FROM my_group_keys WHERE group_id = ?", (group_id,)).fetchone()
-        if not row:
-            return None
-        kv, b64 = int(row[0]), row[1]
-        box = _enc_box_from_pin(pin)
-        pt = box.decrypt(base64.b64decode(b64))
-        return pt, kv
-    finally:
-        conn.close()
+
+def load_my_group_key(keys: "SessionKeyring | str", group_id: str) -> tuple[bytes, int] | None:
+    keys = _as_keyring(keys)
+    row = get_store(keys).read(lambda conn: conn.execute(
+        "SELECT key_version, enc_blob FROM my_group_keys WHERE group_id = ?", (group_id,)
+    ).fetchone())
+    if not row:
+        return None
+    kv, b64 = int(row[0]), row[1]
+    pt = keys.box().decrypt(base64.b64decode(b64))
+    return pt, kv
+
+
+def store_group_key_version(keys: "SessionKeyring | str", group_id: str, key_bytes: bytes, key_version: int) -> None:
+    """Add a (possibly historical) key version to the keyring without changing my current key."""
+    keys = _as_keyring(keys)
+    box = keys.box()
+    ct = box.encrypt(key_bytes, nacl_random(SecretBox.NONCE_SIZE))
+    b64 = base64.b64encode(ct).decode()
+    get_store(keys).write(lambda conn: conn.execute(
+        "INSERT OR REPLACE INTO group_keyring(group_id, key_version, enc_blob) VALUES(?,?,?)",
+        (group_id, int(key_version), b64),
+    ))
+
+
+def load_group_keyring(keys: "SessionKeyring | str", group_id: str) -> dict[int, bytes]:
+    """Return {key_version: key} for every version of the group key stored locally."""
+    keys = _as_keyring(keys)
+
+    def _read(conn):
+        rows = conn.execute("SELECT key_version, enc_blob FROM group_keyring WHERE group_id = ?", (group_id,)).fetchall()
+        # Keys stored before the keyring existed only live in my_group_keys
+        cur_row = conn.execute("SELECT key_version, enc_blob FROM my_group_keys WHERE group_id = ?", (group_id,)).fetchone()
+        if cur_row:
+            rows = list(rows) + [cur_row]
+        return rows
+
+    rows = get_store(keys).read(_read)
+    box = keys.box()
+    out: dict[int, bytes] = {}
+    for kv, b64 in rows:
+        try:
+            out[int(kv)] = box.decrypt(base64.b64decode(b64))
+        except Exception:
+            pass
+    return out
@@ -3,9 +3,10 @@ Process worker utilities for CPU-bound crypto operations.
 
 Designed to be importable on Windows (spawn) without side effects.
 """
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
-from nacl.public import PrivateKey, SealedBox
+from nacl.bindings import crypto_aead_chacha20poly1305_ietf_decrypt
+from nacl.public import PrivateKey, PublicKey, SealedBox
 from nacl.signing import VerifyKey
 import base64
 
@@ -33,3 +34,33 @@ def verify_and_decrypt(enc_b64: str, priv_bytes: bytes, from_sign_hex: Optional[
         return True, pt
     except Exception:
         return False, None
+
+
+def seal_key_batch(key: bytes, member_pub_hexes: List[str]) -> List[Tuple[str, Optional[str]]]:
+    """Seal key to each member's X25519 public key.
+
+    Returns [(pub_hex, sealed_b64 or None)] in input order; invalid keys map to None.
+    """
+    out = []
+    for pub in member_pub_hexes:
+        try:
+            sealed = SealedBox(PublicKey(bytes.fromhex(pub))).encrypt(key)
+            out.append((pub, base64.b64encode(sealed).decode()))
+        except Exception:
+            out.append((pub, None))
+    return out
+
+
+def decrypt_group_batch(items: List[Tuple[str, str, bytes]]) -> List[Optional[str]]:
+    """Decrypt [(ciphertext_b64, nonce_b64, group_key)] with ChaCha20-Poly1305.
+
+    Returns plaintexts in input order; failures map to None.
+    """
+    out = []
+    b64d = base64.b64decode
+    for ct_b64, nonce_b64, key in items:
+        try:
+            out.append(crypto_aead_chacha20poly1305_ietf_decrypt(b64d(ct_b64), b"", b64d(nonce_b64), key).decode())
+        except Exception:
+            out.append(None)
+    return out
@@ -1,5 +1,15 @@
+import hashlib
+import threading
 import requests
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+
+# Attachments above this size use the chunked upload session API
+CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_WORKERS = 4
+UPLOAD_CHUNK_RETRIES = 3
 
 
 class GroupClient:
@@ -65,14 +75,76 @@ class GroupClient:
     def upload_attachment(self, group_id: str, file_bytes: bytes) -> dict:
         """Upload a raw attachment blob to the groups backend. The server will return {id, size}.
 
-        Notes: the server accepts the raw bytes in the request body and computes the sha256 id.
+        Blobs are content-addressed on the server, so first try to link an identical blob
+        that is already stored (by its sha256) and only send the bytes when that 404s.
         """
         params = {"group_id": group_id, "user_id": self.app.my_pub_hex}
+        if len(file_bytes) > CHUNKED_UPLOAD_THRESHOLD:
+            return self.upload_attachment_chunked(group_id, file_bytes)
+        att_id = hashlib.sha256(file_bytes).hexdigest()
+        r = requests.post(f"{self.app.SERVER_URL}/groups/attachments/link", params={**params, "att_id": att_id}, verify=self.app.SERVER_CERT, timeout=10)
+        if r.status_code != 404:
+            r.raise_for_status()
+            return r.json()
         # POST raw bytes in the body
         r = requests.post(f"{self.app.SERVER_URL}/groups/attachments/upload", params=params, data=file_bytes, verify=self.app.SERVER_CERT, timeout=60)
         r.raise_for_status()
         return r.json()
 
+    def upload_attachment_chunked(self, group_id: str, file_bytes: bytes, chunk_size: int = UPLOAD_CHUNK_SIZE,
+                                  max_workers: int = UPLOAD_WORKERS, progress: Optional[Callable[[int, int], None]] = None) -> dict:
+        """Upload a large blob in concurrent chunks; calling again after a failure resumes.
+
+        The server keys the session on (group, me, sha256, size, chunk size) and reports
+        which chunks it already holds, so only the missing ones are sent.
+        progress(done_chunks, total_chunks) is called from worker threads.
+        """
+        base = f"{self.app.SERVER_URL}/groups/attachments/uploads"
+        me = self.app.my_pub_hex
+        sha = hashlib.sha256(file_bytes).hexdigest()
+        r = requests.post(f"{base}/init", params={"group_id": group_id, "user_id": me, "size": len(file_bytes), "sha256": sha, "chunk_size": chunk_size}, verify=self.app.SERVER_CERT, timeout=15)
+        r.raise_for_status()
+        session = r.json()
+        if session.get("complete"):
+            return {"id": session["id"], "size": session["size"]}
+        upload_id = session["upload_id"]
+        cs = int(session["chunk_size"])
+        total = int(session["total_chunks"])
+        have = set(session.get("received") or [])
+        todo = [i for i in range(total) if i not in have]
+        done = [len(have)]
+        done_lock = threading.Lock()
+        view = memoryview(file_bytes)
+
+        def _put(i: int) -> None:
+            last = None
+            for _ in range(UPLOAD_CHUNK_RETRIES):
+                try:
+                    cr = requests.put(f"{base}/{upload_id}/chunks/{i}", params={"user_id": me}, data=bytes(view[i * cs:(i + 1) * cs]),
+                                      headers={"Content-Type": "application/octet-stream"}, verify=self.app.SERVER_CERT, timeout=60)
+                    cr.raise_for_status()
+                    break
+                except requests.RequestException as e:
+                    last = e
+            else:
+                raise last
+            with done_lock:
+                done[0] += 1
+                n = done[0]
+            if progress:
+                try:
+                    progress(n, total)
+                except Exception:
+                    pass
+
+        if todo:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(todo)))) as ex:
+                # list() re-raises the first chunk failure; the session stays resumable
+                list(ex.map(_put, todo))
+        r = requests.post(f"{base}/{upload_id}/finalize", params={"user_id": me, "sha256": sha}, verify=self.app.SERVER_CERT, timeout=120)
+        r.raise_for_status()
+        return r.json()
+
     def get_channel_meta(self, channel_id: str) -> dict:
         r = requests.get(f"{self.app.SERVER_URL}/groups/channels/meta", params={"channel_id": channel_id, "user_id": self.app.my_pub_hex}, verify=self.app.SERVER_CERT, timeout=10)
         r.raise_for_status()
@@ -84,6 +156,23 @@ class GroupClient:
         r.raise_for_status()
         return r.json()
 
+    def get_channel_summaries(self, group_id: str | None = None) -> dict:
+        """Unread counts and latest activity for my channels without fetching message bodies."""
+        params = {"user_id": self.app.my_pub_hex}
+        if group_id:
+            params["group_id"] = group_id
+        r = requests.get(f"{self.app.SERVER_URL}/groups/channels/summaries", params=params, verify=self.app.SERVER_CERT, timeout=10)
+        r.raise_for_status()
+        return r.json()
+
+    def mark_channel_read(self, channel_id: str, seq: int | None = None) -> dict:
+        params = {"channel_id": channel_id, "user_id": self.app.my_pub_hex}
+        if seq is not None:
+            params["seq"] = seq
+        r = requests.post(f"{self.app.SERVER_URL}/groups/channels/read", params=params, verify=self.app.SERVER_CERT, timeout=10)
+        r.raise_for_status()
+        return r.json()
+
     def get_my_role(self, group_id: str) -> dict:
         r = requests.get(f"{self.app.SERVER_URL}/groups/channels/role", params={"group_id": group_id, "user_id": self.app.my_pub_hex}, verify=self.app.SERVER_CERT, timeout=10)
         r.raise_for_status()
@@ -110,6 +199,17 @@ class GroupClient:
         r.raise_for_status()
         return r.json()
 
+    def sync(self, cursors: dict[str, float] | None = None, since: float | None = None, limit_per_channel: int = 100) -> dict:
+        """One-round-trip snapshot of groups, channels, memberships and new ciphertext per channel.
+
+        `cursors` maps channel_id -> newest message timestamp already held locally.
+        Pass the returned `server_time` as `since` next time to only receive changes.
+        """
+        payload = {"cursors": cursors or {}, "since": since, "limit_per_channel": limit_per_channel}
+        r = requests.post(f"{self.app.SERVER_URL}/groups/sync", params={"user_id": self.app.my_pub_hex}, json=payload, verify=self.app.SERVER_CERT, timeout=20)
+        r.raise_for_status()
+        return r.json()
+
     def get_member_keys(self, group_id: str) -> dict:
         r = requests.get(f"{self.app.SERVER_URL}/groups/members/keys", params={"group_id": group_id}, verify=self.app.SERVER_CERT, timeout=10)
         r.raise_for_status()
@@ -120,12 +220,34 @@ class GroupClient:
         r.raise_for_status()
         return r.json()
 
+    def get_key_history(self, group_id: str, key_version: int | None = None) -> dict:
+        """My sealed group keys by version: {"keys": [{key_version, encrypted_group_key}]}."""
+        params = {"group_id": group_id, "user_id": self.app.my_pub_hex}
+        if key_version is not None:
+            params["key_version"] = key_version
+        r = requests.get(f"{self.app.SERVER_URL}/groups/members/keys/history", params=params, verify=self.app.SERVER_CERT, timeout=10)
+        r.raise_for_status()
+        return r.json()
+
     def update_member_key(self, group_id: str, user_id: str, encrypted_key_b64: str, key_version: int) -> dict:
         params = {"group_id": group_id, "user_id": user_id, "encrypted_key_b64": encrypted_key_b64, "key_version": key_version}
         r = requests.post(f"{self.app.SERVER_URL}/groups/members/keys/update", params=params, verify=self.app.SERVER_CERT, timeout=10)
         r.raise_for_status()
         return r.json()
 
+    def bulk_update_member_keys(self, group_id: str, key_version: int, keys: dict[str, str]) -> dict:
+        """Store {user_id: sealed_key} for key_version in one request/transaction per batch."""
+        items = list(keys.items())
+        updated, missing = 0, []
+        for i in range(0, max(1, len(items)), 2000):
+            payload = {"group_id": group_id, "key_version": key_version, "keys": dict(items[i:i + 2000])}
+            r = requests.post(f"{self.app.SERVER_URL}/groups/members/keys/bulk_update", params={"user_id": self.app.my_pub_hex}, json=payload, verify=self.app.SERVER_CERT, timeout=30)
+            r.raise_for_status()
+            res = r.json()
+            updated += int(res.get("updated", 0))
+            missing.extend(res.get("missing") or [])
+        return {"status": "ok", "updated": updated, "missing": missing}
+
     def rotate_invite(self, group_id: str) -> dict:
         params = {"group_id": group_id, "user_id": self.app.my_pub_hex}
         r = requests.post(f"{self.app.SERVER_URL}/groups/invites/rotate", params=params, verify=self.app.SERVER_CERT, timeout=10)
@@ -146,10 +268,13 @@ class GroupClient:
         r.raise_for_status()
         return r.json()
 
-    def discover_public(self, query: str | None = None, limit: int = 50) -> dict:
+    def discover_public(self, query: str | None = None, limit: int = 50, cursor: str | None = None) -> dict:
+        """Public groups (ranked when query is given); pass back next_cursor for the next page."""
         params = {"limit": limit}
         if query:
             params["query"] = query
+        if cursor:
+            params["cursor"] = cursor
         r = requests.get(f"{self.app.SERVER_URL}/groups/discover", params=params, verify=self.app.SERVER_CERT, timeout=10)
         r.raise_for_status()
         return r.json()
@@ -184,6 +309,22 @@ class GroupClient:
         r.raise_for_status()
         return r.json()
 
+    def get_retention(self, group_id: str) -> dict:
+        params = {"group_id": group_id, "user_id": self.app.my_pub_hex}
+        r = requests.get(f"{self.app.SERVER_URL}/groups/retention", params=params, verify=self.app.SERVER_CERT, timeout=10)
+        r.raise_for_status()
+        return r.json()
+
+    def set_retention(self, group_id: str, max_age_seconds: int | None = None, max_rows_per_channel: int | None = None, archive: bool = True) -> dict:
+        params = {"group_id": group_id, "user_id": self.app.my_pub_hex, "archive": archive}
+        if max_age_seconds:
+            params["max_age_seconds"] = int(max_age_seconds)
+        if max_rows_per_channel:
+            params["max_rows_per_channel"] = int(max_rows_per_channel)
+        r = requests.post(f"{self.app.SERVER_URL}/groups/retention/set", params=params, verify=self.app.SERVER_CERT, timeout=10)
+        r.raise_for_status()
+        return r.json()
+
     def rename_group(self, group_id: str, new_name: str) -> dict:
         payload = {"group_id": group_id, "new_name": new_name, "user_id": self.app.my_pub_hex}
         r = requests.post(f"{self.app.SERVER_URL}/groups/rename", json=payload, verify=self.app.SERVER_CERT, timeout=10)
@@ -1,22 +1,43 @@
+import atexit
+import threading
 import time
-from typing import Optional, Dict, List
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional, Dict, List
+
+import requests
 
 from .group_client import GroupClient
 from .group_crypto import (
     generate_group_key,
     encrypt_group_key_for_member,
+    seal_group_key_for_members,
+    decrypt_texts_with_group_keys,
+    DECRYPT_PARALLEL_MIN,
     decrypt_group_key_for_me,
     encrypt_text_with_group_key,
-    decrypt_text_with_group_key,
 )
 import json
-from .db import store_my_group_key, load_my_group_key
+from .group_storage import store_group_messages, load_group_messages
+from .db import store_my_group_key, load_my_group_key, store_group_key_version, load_group_keyring
+
+
+# Decrypted group messages kept in memory, keyed by message id
+PLAINTEXT_CACHE_SIZE = 5000
 
 
 class GroupManager:
     def __init__(self, app):
         self.app = app
         self.client = GroupClient(app)
+        self._proc_pool = None
+        # group_id -> {key_version: key}, filled from the local keyring on first use
+        self._keyring: Dict[str, Dict[int, bytes]] = {}
+        # (group_id, key_version) -> time the server last had no key for it
+        self._keyring_misses: Dict[tuple, float] = {}
+        self._keyring_lock = threading.Lock()
+        self._plaintext_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._plaintext_lock = threading.Lock()
 
     # ----- Group lifecycle -----
     def create_group(self, name: str, is_public: bool = False) -> Dict:
@@ -25,7 +46,7 @@ class GroupManager:
         invite_code = res["invite_code"]
         # Generate initial group key and store locally (version 1)
         key = generate_group_key()
-        store_my_group_key(self.app.pin, group_id, key, 1)
+        self._store_current_key(group_id, key, 1)
         # Distribute to myself via server member key update
         ek = encrypt_group_key_for_member(key, self.app.my_pub_hex)
         self.client.update_member_key(group_id, self.app.my_pub_hex, ek, 1)
@@ -41,7 +62,7 @@ class GroupManager:
             my_entry = next((m for m in info.get("members", []) if m.get("user_id") == self.app.my_pub_hex), None)
             if my_entry and my_entry.get("encrypted_group_key"):
                 key = decrypt_group_key_for_me(my_entry["encrypted_group_key"], self.app.private_key)
-                store_my_group_key(self.app.pin, gid, key, kv)
+                self._store_current_key(gid, key, kv)
         return res
 
     def leave_group(self, group_id: str) -> Dict:
@@ -54,10 +75,24 @@ class GroupManager:
     def create_channel(self, group_id: str, name: str, type_: str = "text") -> Dict:
         return self.client.create_channel(group_id, name, type_)
 
+    def unread_counts(self, group_id: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """Return {"channels": {channel_id: unread}, "groups": {group_id: unread}} from server summaries."""
+        res = self.client.get_channel_summaries(group_id)
+        channels: Dict[str, int] = {}
+        groups: Dict[str, int] = {}
+        for s in res.get("summaries", []):
+            n = int(s.get("unread", 0) or 0)
+            channels[s.get("channel_id")] = n
+            groups[s.get("group_id")] = groups.get(s.get("group_id"), 0) + n
+        return {"channels": channels, "groups": groups}
+
+    def mark_channel_read(self, channel_id: str, seq: Optional[int] = None) -> Dict:
+        return self.client.mark_channel_read(channel_id, seq)
+
     # ----- Messages -----
     def send_text(self, group_id: str, channel_id: str, plaintext: str, timestamp: Optional[float] = None) -> Dict:
         # Ensure we have a group key locally; fetch from server if missing
-        loaded = load_my_group_key(self.app.pin, group_id)
+        loaded = load_my_group_key(self.app.keyring, group_id)
         if not loaded:
             loaded = self._ensure_have_group_key(group_id)
         if not loaded:
@@ -67,22 +102,111 @@ class GroupManager:
         return self.client.send_message(group_id, channel_id, ct_b64, nonce_b64, kv, timestamp)
 
     def fetch_messages(self, group_id: str, channel_id: str, since: Optional[float] = None, limit: int = 200) -> List[Dict]:
-        loaded = load_my_group_key(self.app.pin, group_id)
-        if not loaded:
-            loaded = self._ensure_have_group_key(group_id)
-        if not loaded:
+        if not self._group_keys(group_id) and not self._ensure_have_group_key(group_id):
             # Still no key: cannot decrypt or send. Return empty list gracefully.
             return []
-        key, kv = loaded
         res = self.client.fetch_messages(group_id, channel_id, since, limit)
-        out = []
-        for m in res.get("messages", []):
-            if int(m.get("key_version", 0)) != int(kv):
-                # Skip messages for old/new version until rekey handled
+        raw = res.get("messages", [])
+        self._cache_messages(group_id, channel_id, raw)
+        return self._decrypt_messages(group_id, raw)
+
+    def cached_messages(self, group_id: str, channel_id: str, limit: int = 200) -> List[Dict]:
+        """Decrypted messages from the local cache only (no network), oldest first.
+
+        Lets a channel render immediately; callers then fetch the delta since the
+        newest returned timestamp with fetch_messages(), which adds it to the cache.
+        """
+        try:
+            raw = load_group_messages(self.app.keyring, channel_id, limit)
+        except Exception:
+            return []
+        return self._decrypt_messages(group_id, raw)
+
+    def _cache_messages(self, group_id: str, channel_id: str, raw: List[Dict]) -> None:
+        if not raw:
+            return
+        try:
+            store_group_messages(self.app.keyring, [{**m, "group_id": group_id, "channel_id": channel_id} for m in raw])
+        except Exception:
+            pass
+
+    def sync(self, cursors: Optional[Dict[str, float]] = None, since: Optional[float] = None, limit_per_channel: int = 100) -> Dict:
+        """Fetch groups, channels, my memberships and new messages in a single request.
+
+        Messages are decrypted per group with the locally stored key; a membership entry
+        carrying a newer sealed key than the one held locally is unsealed and stored first.
+        Returns the server response with `messages` replaced by decrypted dicts.
+        """
+        res = self.client.sync(cursors, since, limit_per_channel)
+        for m in res.get("memberships", []):
+            ek = m.get("encrypted_group_key")
+            if not ek:
                 continue
             try:
-                pt = decrypt_text_with_group_key(m.get("ciphertext"), m.get("nonce"), key)
+                kv = int(m.get("key_version", 1))
+                loaded = load_my_group_key(self.app.keyring, m["group_id"])
+                if not loaded or int(loaded[1]) != kv:
+                    self._store_current_key(m["group_id"], decrypt_group_key_for_me(ek, self.app.private_key), kv)
             except Exception:
+                pass
+        channel_group = {cid: gid for gid, cids in res.get("channel_ids", {}).items() for cid in cids}
+        out: Dict[str, List[Dict]] = {}
+        to_cache: List[Dict] = []
+        for cid, raw in res.get("messages", {}).items():
+            gid = channel_group.get(cid)
+            if gid is None:
+                continue
+            to_cache.extend({**m, "group_id": gid, "channel_id": cid} for m in raw)
+            out[cid] = self._decrypt_messages(gid, raw)
+        if to_cache:
+            # One transaction for every channel's delta
+            try:
+                store_group_messages(self.app.keyring, to_cache)
+            except Exception:
+                pass
+        res["messages"] = out
+        return res
+
+    def _decrypt_messages(self, group_id: str, raw: List[Dict]) -> List[Dict]:
+        """Decrypt each message with the key of its own key_version (see _key_for_version).
+
+        Plaintext is memoized by message id; the misses are decrypted as one ordered
+        batch (on the process pool when large). Messages without a usable key or that
+        fail authentication are dropped.
+        """
+        texts: List[Optional[str]] = [None] * len(raw)
+        todo_idx: List[int] = []
+        todo: List[tuple] = []
+        with self._plaintext_lock:
+            for i, m in enumerate(raw):
+                mid = m.get("id")
+                if mid is not None and mid in self._plaintext_cache:
+                    self._plaintext_cache.move_to_end(mid)
+                    texts[i] = self._plaintext_cache[mid]
+                else:
+                    todo_idx.append(i)
+        for i in todo_idx:
+            m = raw[i]
+            key = self._key_for_version(group_id, int(m.get("key_version", 0) or 0))
+            if key is None:
+                # No key for this version anywhere (e.g. sent before I joined)
+                continue
+            todo.append((i, (m.get("ciphertext"), m.get("nonce"), key)))
+        if todo:
+            # Don't spin up a pool for batches that will be decrypted inline anyway
+            pool = self._crypto_pool() if len(todo) >= DECRYPT_PARALLEL_MIN else None
+            results = decrypt_texts_with_group_keys([t for _, t in todo], pool=pool)
+            with self._plaintext_lock:
+                for (i, _), pt in zip(todo, results):
+                    texts[i] = pt
+                    mid = raw[i].get("id")
+                    if pt is not None and mid is not None:
+                        self._plaintext_cache[mid] = pt
+                while len(self._plaintext_cache) > PLAINTEXT_CACHE_SIZE:
+                    self._plaintext_cache.popitem(last=False)
+        out = []
+        for m, pt in zip(raw, texts):
+            if pt is None:
                 continue
             # Attachments: backend returns optional _attachment_json string
             att = None
@@ -97,28 +221,130 @@ class GroupManager:
                 "sender_id": m.get("sender_id"),
                 "text": pt,
                 "timestamp": m.get("timestamp"),
+                "seq": m.get("seq"),
                 "attachment_meta": att,
             })
         return out
 
+    # ----- Keyring -----
+    def _group_keys(self, group_id: str) -> Dict[int, bytes]:
+        with self._keyring_lock:
+            keys = self._keyring.get(group_id)
+        if keys is None:
+            try:
+                keys = load_group_keyring(self.app.keyring, group_id)
+            except Exception:
+                keys = {}
+            with self._keyring_lock:
+                keys = self._keyring.setdefault(group_id, keys)
+        return keys
+
+    def _store_current_key(self, group_id: str, key: bytes, key_version: int) -> None:
+        store_my_group_key(self.app.keyring, group_id, key, key_version)
+        with self._keyring_lock:
+            self._keyring.setdefault(group_id, {})[int(key_version)] = key
+
+    def _key_for_version(self, group_id: str, key_version: int) -> Optional[bytes]:
+        """Key for key_version from memory, else my sealed copy from the server (then cached).
+
+        A version the server has no key for is not asked for again for 5 minutes.
+        """
+        key = self._group_keys(group_id).get(key_version)
+        if key is not None:
+            return key
+        miss = (group_id, key_version)
+        with self._keyring_lock:
+            if time.time() - self._keyring_misses.get(miss, 0) < 300:
+                return None
+        try:
+            # Fetch every version at once: one missing version usually means several
+            res = self.client.get_key_history(group_id)
+        except Exception:
+            res = {}
+        keys = self._group_keys(group_id)
+        for e in res.get("keys", []):
+            kv = int(e.get("key_version", 0) or 0)
+            if kv in keys or not e.get("encrypted_group_key"):
+                continue
+            try:
+                k = decrypt_group_key_for_me(e["encrypted_group_key"], self.app.private_key)
+            except Exception:
+                continue
+            try:
+                store_group_key_version(self.app.keyring, group_id, k, kv)
+            except Exception:
+                pass
+            with self._keyring_lock:
+                keys[kv] = k
+        key = keys.get(key_version)
+        if key is None:
+            with self._keyring_lock:
+                self._keyring_misses[miss] = time.time()
+        return key
+
     # ----- Rekeying -----
-    def rekey_group(self, group_id: str, member_pub_hexes: list[str]) -> int:
+    def rekey_group(self, group_id: str, member_pub_hexes: list[str], progress: Optional[Callable[[int, int], None]] = None) -> int:
         """Owner/Admin rotates group key and updates encrypted keys for members.
 
-        Returns new key_version.
+        progress(done, total) reports sealing progress. Returns new key_version.
         """
         # Bump version client-side by checking server-reported version
         # Ask server to bump key_version
         resp = self.client.rekey(group_id)
         new_version = int(resp.get("key_version", 1))
         key = generate_group_key()
-        store_my_group_key(self.app.pin, group_id, key, new_version)
-        for uid in member_pub_hexes:
-            ek = encrypt_group_key_for_member(key, uid)
-            self.client.update_member_key(group_id, uid, ek, new_version)
+        self._store_current_key(group_id, key, new_version)
+        self._distribute_member_keys(group_id, key, new_version, member_pub_hexes, progress)
         return new_version
 
     # ----- Helpers -----
+    def _crypto_pool(self):
+        """Process pool for bulk sealing/decryption: ChatManager's when running, else our own (lazy)."""
+        cm = getattr(self.app, 'chat_manager', None)
+        pool = getattr(cm, '_proc_pool', None)
+        if pool is not None:
+            return pool
+        if self._proc_pool is None:
+            self._proc_pool = ProcessPoolExecutor(max_workers=2)
+            # In case close() is never reached (e.g. the window is killed)
+            atexit.register(self.close)
+        return self._proc_pool
+
+    def close(self) -> None:
+        """Shut down this manager's own process pool, if it started one. Idempotent."""
+        pool, self._proc_pool = self._proc_pool, None
+        if pool is not None:
+            try:
+                pool.shutdown(wait=False, cancel_futures=True)
+            except Exception:
+                pass
+
+    def _distribute_member_keys(self, group_id: str, key: bytes, key_version: int, member_ids: List[str],
+                                progress: Optional[Callable[[int, int], None]] = None) -> int:
+        """Seal key for every member (across a process pool) and upload them with one bulk request.
+
+        Falls back to per-member updates against servers without the bulk endpoint.
+        Returns the number of members updated.
+        """
+        member_ids = [u for u in dict.fromkeys(member_ids) if u]
+        if not member_ids:
+            return 0
+        sealed = seal_group_key_for_members(key, member_ids, pool=self._crypto_pool(), progress=progress)
+        try:
+            res = self.client.bulk_update_member_keys(group_id, int(key_version), sealed)
+            return int(res.get("updated", 0))
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in (404, 405):
+                raise
+        updated = 0
+        for uid, ek in sealed.items():
+            try:
+                self.client.update_member_key(group_id, uid, ek, int(key_version))
+                updated += 1
+            except Exception:
+                pass
+        return updated
+
     def _ensure_have_group_key(self, group_id: str) -> tuple[bytes, int] | None:
         """If local key is missing, try to fetch my encrypted group key from the server and store it.
 
@@ -130,7 +356,7 @@ class GroupManager:
             my_entry = next((m for m in info.get("members", []) if m.get("user_id") == self.app.my_pub_hex), None)
             if my_entry and my_entry.get("encrypted_group_key"):
                 key = decrypt_group_key_for_me(my_entry["encrypted_group_key"], self.app.private_key)
-                store_my_group_key(self.app.pin, group_id, key, kv)
+                self._store_current_key(group_id, key, kv)
                 return key, kv
         except Exception:
             pass
@@ -144,15 +370,15 @@ class GroupManager:
         except Exception:
             return False
 
-    def reconcile_member_keys(self, group_id: str) -> int:
+    def reconcile_member_keys(self, group_id: str, progress: Optional[Callable[[int, int], None]] = None) -> int:
         """Owner/Admin: ensure all members have the current encrypted group key.
 
-        Returns the number of members updated.
+        progress(done, total) reports sealing progress. Returns the number of members updated.
         """
         try:
             if not self.is_admin_or_owner(group_id):
                 return 0
-            loaded = load_my_group_key(self.app.pin, group_id)
+            loaded = load_my_group_key(self.app.keyring, group_id)
             if not loaded:
                 # Try to fetch my own key first
                 loaded = self._ensure_have_group_key(group_id)
@@ -160,18 +386,13 @@ class GroupManager:
                 return 0
             key, kv = loaded
             info = self.client.get_member_keys(group_id)
-            updated = 0
+            stale = []
             for m in (info.get("members", []) if isinstance(info, dict) else []):
                 uid = m.get("user_id")
                 m_kv = int(m.get("key_version", 0) or 0)
                 has_key = bool(m.get("encrypted_group_key"))
                 if uid and (not has_key or m_kv != int(kv)):
-                    try:
-                        ek = encrypt_group_key_for_member(key, uid)
-                        self.client.update_member_key(group_id, uid, ek, int(kv))
-                        updated += 1
-                    except Exception:
-                        pass
-            return updated
+                    stale.append(uid)
+            return self._distribute_member_keys(group_id, key, int(kv), stale, progress)
         except Exception:
             return 0
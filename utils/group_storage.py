@@ -1,129 +1,149 @@
 from typing import Optional, List, Dict
 import time
 
-from .db import get_connection
-
-
-def upsert_group(pin: str, group: Dict):
-    conn = get_connection(pin)
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO groups(id, name, owner_id, is_public, invite_code, key_version, created_at)
-            VALUES(?,?,?,?,?,?,?)
-            ON CONFLICT(id) DO UPDATE SET
-                name=excluded.name,
-                owner_id=excluded.owner_id,
-                is_public=excluded.is_public,
-                invite_code=excluded.invite_code,
-                key_version=excluded.key_version,
-                created_at=excluded.created_at
-            ;
-            """,
-            (
-                group.get("id"),
-                group.get("name"),
-                group.get("owner_id"),
-                1 if group.get("is_public") else 0,
-                group.get("invite_code"),
-                int(group.get("key_version", 1)),
-                float(group.get("created_at") or time.time()),
-            ),
-        )
-        conn.commit()
-    finally:
-        conn.close()
-
-
-def upsert_member(pin: str, group_id: str, user_id: str, role: str, encrypted_group_key: Optional[str], key_version: int):
-    conn = get_connection(pin)
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO group_members(group_id, user_id, role, joined_at, encrypted_group_key, key_version)
-            VALUES(?,?,?,?,?,?)
-            ON CONFLICT(group_id, user_id) DO UPDATE SET
-                role=excluded.role,
-                encrypted_group_key=excluded.encrypted_group_key,
-                key_version=excluded.key_version
-            ;
-            """,
-            (group_id, user_id, role, time.time(), encrypted_group_key, int(key_version)),
-        )
-        conn.commit()
-    finally:
-        conn.close()
-
-
-def upsert_channel(pin: str, channel: Dict):
-    conn = get_connection(pin)
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO channels(id, group_id, name, type, created_at)
-            VALUES(?,?,?,?,?)
-            ON CONFLICT(id) DO UPDATE SET
-                name=excluded.name,
-                type=excluded.type
-            ;
-            """,
-            (
-                channel.get("id"),
-                channel.get("group_id"),
-                channel.get("name"),
-                channel.get("type", "text"),
-                float(channel.get("created_at") or time.time()),
-            ),
-        )
-        conn.commit()
-    finally:
-        conn.close()
-
-
-def store_group_message(pin: str, msg: Dict):
-    conn = get_connection(pin)
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT OR REPLACE INTO group_messages(id, group_id, channel_id, sender_id, ciphertext, nonce, key_version, timestamp)
-            VALUES(?,?,?,?,?,?,?,?)
-            """,
-            (
-                msg.get("id"),
-                msg.get("group_id"),
-                msg.get("channel_id"),
-                msg.get("sender_id"),
-                msg.get("ciphertext"),
-                msg.get("nonce"),
-                int(msg.get("key_version", 1)),
-                float(msg.get("timestamp") or time.time()),
-            ),
-        )
-        conn.commit()
-    finally:
-        conn.close()
-
-
-def get_groups(pin: str) -> list[dict]:
-    conn = get_connection(pin)
-    try:
-        cur = conn.cursor()
-        rows = cur.execute("SELECT id, name, owner_id, is_public, invite_code, key_version, created_at FROM groups").fetchall()
-        return [
-            {
-                "id": rid,
-                "name": name,
-                "owner_id": owner,
-                "is_public": bool(is_pub),
-                "invite_code": inv,
-                "key_version": int(kv or 1),
-                "created_at": ts,
-            }
-            for (rid, name, owner, is_pub, inv, kv, ts) in rows
-        ]
-    finally:
-        conn.close()
+from .db import get_store
+from .session_keys import SessionKeyring
+
+
+def upsert_group(keys: "SessionKeyring | str", group: Dict):
+    row = (
+        group.get("id"),
+        group.get("name"),
+        group.get("owner_id"),
+        1 if group.get("is_public") else 0,
+        group.get("invite_code"),
+        int(group.get("key_version", 1)),
+        float(group.get("created_at") or time.time()),
+    )
+    get_store(keys).write(lambda conn: conn.execute(
+        """
+        INSERT INTO groups(id, name, owner_id, is_public, invite_code, key_version, created_at)
+        VALUES(?,?,?,?,?,?,?)
+        ON CONFLICT(id) DO UPDATE SET
+            name=excluded.name,
+            owner_id=excluded.owner_id,
+            is_public=excluded.is_public,
+            invite_code=excluded.invite_code,
+            key_version=excluded.key_version,
+            created_at=excluded.created_at
+        ;
+        """,
+        row,
+    ))
+
+
+def upsert_member(keys: "SessionKeyring | str", group_id: str, user_id: str, role: str, encrypted_group_key: Optional[str], key_version: int):
+    row = (group_id, user_id, role, time.time(), encrypted_group_key, int(key_version))
+    get_store(keys).write(lambda conn: conn.execute(
+        """
+        INSERT INTO group_members(group_id, user_id, role, joined_at, encrypted_group_key, key_version)
+        VALUES(?,?,?,?,?,?)
+        ON CONFLICT(group_id, user_id) DO UPDATE SET
+            role=excluded.role,
+            encrypted_group_key=excluded.encrypted_group_key,
+            key_version=excluded.key_version
+        ;
+        """,
+        row,
+    ))
+
+
+def upsert_channel(keys: "SessionKeyring | str", channel: Dict):
+    row = (
+        channel.get("id"),
+        channel.get("group_id"),
+        channel.get("name"),
+        channel.get("type", "text"),
+        float(channel.get("created_at") or time.time()),
+    )
+    get_store(keys).write(lambda conn: conn.execute(
+        """
+        INSERT INTO channels(id, group_id, name, type, created_at)
+        VALUES(?,?,?,?,?)
+        ON CONFLICT(id) DO UPDATE SET
+            name=excluded.name,
+            type=excluded.type
+        ;
+        """,
+        row,
+    ))
+
+
+def _message_row(msg: Dict) -> tuple:
+    return (
+        msg.get("id"),
+        msg.get("group_id"),
+        msg.get("channel_id"),
+        msg.get("sender_id"),
+        msg.get("ciphertext"),
+        msg.get("nonce"),
+        int(msg.get("key_version", 1)),
+        float(msg.get("timestamp") or time.time()),
+        msg.get("_attachment_json"),
+        msg.get("seq"),
+    )
+
+
+_INSERT_MESSAGE_SQL = """
+    INSERT OR REPLACE INTO group_messages(id, group_id, channel_id, sender_id, ciphertext, nonce, key_version, timestamp, attachment_meta, seq)
+    VALUES(?,?,?,?,?,?,?,?,?,?)
+"""
+
+
+def store_group_message(keys: "SessionKeyring | str", msg: Dict):
+    store_group_messages(keys, [msg])
+
+
+def store_group_messages(keys: "SessionKeyring | str", msgs: List[Dict]) -> int:
+    """Persist server message rows (still encrypted with the group key) in one transaction."""
+    rows = [_message_row(m) for m in msgs if m.get("id")]
+    if not rows:
+        return 0
+    get_store(keys).write(lambda conn: conn.executemany(_INSERT_MESSAGE_SQL, rows))
+    return len(rows)
+
+
+def load_group_messages(keys: "SessionKeyring | str", channel_id: str, limit: int = 200) -> List[Dict]:
+    """Newest `limit` cached messages of a channel, oldest first, in the server's row format."""
+    rows = get_store(keys).read(lambda conn: conn.execute(
+        """
+        SELECT id, group_id, channel_id, sender_id, ciphertext, nonce, key_version, timestamp, attachment_meta, seq
+        FROM group_messages WHERE channel_id = ? ORDER BY timestamp DESC LIMIT ?
+        """,
+        (channel_id, int(limit)),
+    ).fetchall())
+    out = [
+        {
+            "id": mid,
+            "group_id": gid,
+            "channel_id": cid,
+            "sender_id": sender,
+            "ciphertext": ct,
+            "nonce": nonce,
+            "key_version": int(kv or 1),
+            "timestamp": ts,
+            "_attachment_json": att,
+            "seq": seq,
+        }
+        for (mid, gid, cid, sender, ct, nonce, kv, ts, att, seq) in rows
+    ]
+    out.reverse()
+    return out
+
+
+def get_groups(keys: "SessionKeyring | str") -> list[dict]:
+    rows = get_store(keys).read(lambda conn: conn.execute(
+        "SELECT id, name, owner_id, is_public, invite_code, key_version, created_at FROM groups"
+    ).fetchall())
+    return [
+        {
+            "id": rid,
+            "name": name,
+            "owner_id": owner,
+            "is_public": bool(is_pub),
+            "invite_code": inv,
+            "key_version": int(kv or 1),
+            "created_at": ts,
+        }
+        for (rid, name, owner, is_pub, inv, kv, ts) in rows
+    ]
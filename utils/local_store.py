@@ -0,0 +1,159 @@
+"""Long-lived connections to the local message database.
+
+A LocalStore is opened once per unlocked session. One writer thread owns the
+only write connection: write(fn) queues fn(conn) and waits for its result.
+Queued writes are applied in arrival order and committed together, each inside
+its own SAVEPOINT so a failing write is rolled back without undoing the others.
+Reads run on a small pool of separate connections; with WAL they see the last
+committed state and never wait behind the writer.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+READER_CONNECTIONS = 2
+# Upper bound on writes grouped into one transaction
+WRITE_BATCH_MAX = 256
+
+
+class LocalStore:
+    def __init__(self, connect: Callable[[], Any], readers: int = READER_CONNECTIONS,
+                 after_commit: Optional[Callable[[Any], None]] = None,
+                 on_close: Optional[Callable[[], None]] = None):
+        """connect() returns a new keyed connection (check_same_thread=False).
+
+        after_commit(conn) runs on the writer thread after every committed batch;
+        on_close() runs once after all connections are closed.
+        """
+        self._connect = connect
+        self._after_commit = after_commit
+        self._on_close = on_close
+        self._readers: queue.LifoQueue = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(max(1, int(readers)))
+        self._writes: queue.Queue = queue.Queue()
+        self._close_lock = threading.Lock()
+        self._closed = False
+        self._writer_conn = connect()
+        self._writer_conn.isolation_level = None  # transactions are managed explicitly
+        self._writer = threading.Thread(target=self._run, name="whispr-db-writer", daemon=True)
+        self._writer.start()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def read(self, fn: Callable[[Any], Any]) -> Any:
+        """Run fn(conn) on a reader connection and return its result."""
+        if self._closed:
+            raise ValueError("local store is closed")
+        with self._reader_slots:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                return fn(conn)
+            finally:
+                self._readers.put(conn)
+
+    def write(self, fn: Callable[[Any], Any]) -> Any:
+        """Run fn(conn) on the writer connection, wait for the commit and return its result.
+
+        fn must not commit or roll back itself. Exceptions raised by fn are re-raised here.
+        """
+        if threading.current_thread() is self._writer:
+            # Nested write from inside a write function: already in the batch transaction
+            return fn(self._writer_conn)
+        if self._closed:
+            raise ValueError("local store is closed")
+        fut: Future = Future()
+        self._writes.put((fn, fut))
+        return fut.result()
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self._writes.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._apply(batch)
+
+    def _apply(self, batch: list) -> None:
+        conn = self._writer_conn
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, fut in batch:
+                conn.execute("SAVEPOINT store_write")
+                try:
+                    value = fn(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO store_write")
+                    conn.execute("RELEASE store_write")
+                    outcomes.append((fut, e, True))
+                    continue
+                conn.execute("RELEASE store_write")
+                outcomes.append((fut, value, False))
+            conn.execute("COMMIT")
+        except Exception as e:
+            try:
+                conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            for _fn, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        if self._after_commit is not None:
+            try:
+                self._after_commit(conn)
+            except Exception as e:
+                print(f"[db] post-commit hook failed: {e}")
+        for fut, value, failed in outcomes:
+            if failed:
+                fut.set_exception(value)
+            else:
+                fut.set_result(value)
+
+    def close(self) -> None:
+        """Apply queued writes, close every connection and run on_close. Idempotent."""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._writes.put(None)
+        self._writer.join()
+        # A write that raced with close() and landed behind the stop marker
+        while True:
+            try:
+                item = self._writes.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(ValueError("local store is closed"))
+        try:
+            self._writer_conn.close()
+        except Exception:
+            pass
+        while True:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+        if self._on_close is not None:
+            self._on_close()
@@ -5,7 +5,8 @@ import threading
 import time
 from typing import List, Dict
 
-from utils.db import get_connection
+from utils.db import get_store
+from utils.session_keys import SessionKeyring
 from utils.chat_storage import save_message
 from utils.network import send_message
 from utils.network import send_attachment
@@ -14,142 +15,105 @@ import json
 _lock = threading.RLock()
 
 
-def _ensure_outbox_schema(conn):
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS outbox (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                to_pub TEXT NOT NULL,
-                text TEXT NOT NULL,
-                timestamp REAL NOT NULL,
-                attempts INTEGER NOT NULL DEFAULT 0
-            );
-            """
-        )
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_outbox_ts ON outbox(timestamp);")
-        conn.commit()
-    except Exception:
-        pass
-
-
-def load_outbox(pin: str) -> List[Dict]:
+def _pending_rows(keys: "SessionKeyring | str", limit: int | None = None) -> list:
+    sql = "SELECT id, to_pub, text, timestamp, attempts FROM outbox ORDER BY timestamp ASC"
+    if limit is not None:
+        return get_store(keys).read(lambda conn: conn.execute(sql + " LIMIT ?", (int(limit),)).fetchall())
+    return get_store(keys).read(lambda conn: conn.execute(sql).fetchall())
+
+
+def load_outbox(keys: "SessionKeyring | str") -> List[Dict]:
     with _lock:
-        conn = get_connection(pin)
-        try:
-            _ensure_outbox_schema(conn)
-            cur = conn.cursor()
-            rows = cur.execute("SELECT id, to_pub, text, timestamp, attempts FROM outbox ORDER BY timestamp ASC").fetchall()
-            return [
-                {"id": r[0], "to": r[1], "text": r[2], "timestamp": r[3], "attempts": r[4]}
-                for r in rows
-            ]
-        finally:
-            conn.close()
-
-
-def append_outbox_message(to_pub: str, text: str, pin: str, timestamp: float | None = None):
+        return [
+            {"id": r[0], "to": r[1], "text": r[2], "timestamp": r[3], "attempts": r[4]}
+            for r in _pending_rows(keys)
+        ]
+
+
+def append_outbox_message(to_pub: str, text: str, keys: "SessionKeyring | str", timestamp: float | None = None):
     if not to_pub or not text:
         return
     if timestamp is None:
         timestamp = time.time()
     with _lock:
-        conn = get_connection(pin)
-        try:
-            _ensure_outbox_schema(conn)
-            cur = conn.cursor()
-            cur.execute("INSERT INTO outbox(to_pub, text, timestamp, attempts) VALUES(?,?,?,0)", (to_pub, text, float(timestamp)))
-            conn.commit()
-        finally:
-            conn.close()
+        get_store(keys).write(lambda conn: conn.execute(
+            "INSERT INTO outbox(to_pub, text, timestamp, attempts) VALUES(?,?,?,0)", (to_pub, text, float(timestamp))
+        ))
 
 
-def has_outbox(pin: str) -> bool:
+def has_outbox(keys: "SessionKeyring | str") -> bool:
     with _lock:
-        conn = get_connection(pin)
-        try:
-            _ensure_outbox_schema(conn)
-            cur = conn.cursor()
-            row = cur.execute("SELECT 1 FROM outbox LIMIT 1").fetchone()
-            return bool(row)
-        finally:
-            conn.close()
+        row = get_store(keys).read(lambda conn: conn.execute("SELECT 1 FROM outbox LIMIT 1").fetchone())
+        return bool(row)
 
 
 def flush_outbox(app, max_batch: int = 10):
-    pin = getattr(app, "pin", None)
-    if not pin:
+    keys = getattr(app, "keyring", None) or getattr(app, "pin", None)
+    if not keys:
         return
     with _lock:
-        conn = get_connection(pin)
-        try:
-            _ensure_outbox_schema(conn)
-            cur = conn.cursor()
-            rows = cur.execute("SELECT id, to_pub, text, timestamp, attempts FROM outbox ORDER BY timestamp ASC LIMIT ?", (max_batch,)).fetchall()
-            if not rows:
-                return
-
-            sent_any = False
-            for (row_id, to_pub, text, ts, attempts) in rows:
+        store = get_store(keys)
+        rows = _pending_rows(keys, max_batch)
+        if not rows:
+            return
+
+        sent_any = False
+        for (row_id, to_pub, text, ts, attempts) in rows:
+            ok = False
+            try:
+                # If outbox text is an ATTACH: envelope, attempt to resend via send_attachment
                 ok = False
-                try:
-                    # If outbox text is an ATTACH: envelope, attempt to resend via send_attachment
-                    ok = False
-                    if isinstance(text, str) and text.startswith("ATTACH:"):
-                        try:
-                            env = json.loads(text[len("ATTACH:"):])
-                            # Attempt to load local attachment blob if present
-                            att_id = env.get('att_id') or env.get('sha256')
-                            fname = env.get('name') or env.get('file_name') or 'attachment.bin'
-                            data = None
-                            if att_id:
-                                try:
-                                    from utils.attachments import load_attachment
-                                    data = load_attachment(att_id, getattr(app, 'pin', ''))
-                                except Exception:
-                                    data = None
-                            if data is not None:
-                                ok = send_attachment(app, to_pub=to_pub, signing_pub=app.signing_pub_hex, filename=fname, data=data, signing_key=app.signing_key, enc_pub=app.my_pub_hex)
-                            else:
-                                # No local blob available, fall back to sending the small envelope via send_message
-                                ok = send_message(app, to_pub=to_pub, signing_pub=app.signing_pub_hex, text=text, signing_key=app.signing_key, enc_pub=app.my_pub_hex)
-                        except Exception:
-                            ok = send_message(app, to_pub=to_pub, signing_pub=app.signing_pub_hex, text=text, signing_key=app.signing_key, enc_pub=app.my_pub_hex)
-                    else:
-                        ok = send_message(app, to_pub=to_pub, signing_pub=app.signing_pub_hex, text=text, signing_key=app.signing_key, enc_pub=app.my_pub_hex)
-                except Exception as e:
-                    print(f"[outbox] exception sending queued message: {e}")
-                    ok = False
-
-                if ok:
-                    sent_any = True
-                    # Remove from outbox
-                    cur.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
-                    conn.commit()
-                    # Persist into normal chat history with original timestamp
+                if isinstance(text, str) and text.startswith("ATTACH:"):
                     try:
-                        save_message(to_pub, "You", text, pin, timestamp=ts)
-                    except Exception as e:
-                        print(f"[outbox] failed to save delivered message to chat: {e}")
-                    # Update cache/UI
-                    try:
-                        if hasattr(app, "chat_manager") and app.chat_manager:
-                            app.chat_manager._append_cache(to_pub, {"sender": "You", "text": text, "timestamp": ts})
-                        if getattr(app, "recipient_pub_hex", None) == to_pub:
-                            app.after(0, app.display_message, app.my_pub_hex, text, ts)
+                        env = json.loads(text[len("ATTACH:"):])
+                        # Attempt to load local attachment blob if present
+                        att_id = env.get('att_id') or env.get('sha256')
+                        fname = env.get('name') or env.get('file_name') or 'attachment.bin'
+                        data = None
+                        if att_id:
+                            try:
+                                from utils.attachments import load_attachment
+                                data = load_attachment(att_id, getattr(app, 'pin', ''))
+                            except Exception:
+                                data = None
+                        if data is not None:
+                            ok = send_attachment(app, to_pub=to_pub, signing_pub=app.signing_pub_hex, filename=fname, data=data, signing_key=app.signing_key, enc_pub=app.my_pub_hex)
+                        else:
+                            # No local blob available, fall back to sending the small envelope via send_message
+                            ok = send_message(app, to_pub=to_pub, signing_pub=app.signing_pub_hex, text=text, signing_key=app.signing_key, enc_pub=app.my_pub_hex)
                     except Exception:
-                        pass
+                        ok = send_message(app, to_pub=to_pub, signing_pub=app.signing_pub_hex, text=text, signing_key=app.signing_key, enc_pub=app.my_pub_hex)
                 else:
-                    # Increment attempts and stop early
-                    cur.execute("UPDATE outbox SET attempts = ? WHERE id = ?", (attempts + 1, row_id))
-                    conn.commit()
-                    break
+                    ok = send_message(app, to_pub=to_pub, signing_pub=app.signing_pub_hex, text=text, signing_key=app.signing_key, enc_pub=app.my_pub_hex)
+            except Exception as e:
+                print(f"[outbox] exception sending queued message: {e}")
+                ok = False
 
-            if sent_any:
+            if ok:
+                sent_any = True
+                # Remove from outbox
+                store.write(lambda conn, rid=row_id: conn.execute("DELETE FROM outbox WHERE id = ?", (rid,)))
+                # Persist into normal chat history with original timestamp
                 try:
-                    app.notifier.show("Outbox flushed", type_="success")
+                    save_message(to_pub, "You", text, keys, timestamp=ts)
+                except Exception as e:
+                    print(f"[outbox] failed to save delivered message to chat: {e}")
+                # Update cache/UI
+                try:
+                    if hasattr(app, "chat_manager") and app.chat_manager:
+                        app.chat_manager._append_cache(to_pub, {"sender": "You", "text": text, "timestamp": ts})
+                    if getattr(app, "recipient_pub_hex", None) == to_pub:
+                        app.after(0, app.display_message, app.my_pub_hex, text, ts)
                 except Exception:
                     pass
-        finally:
-            conn.close()
+            else:
+                # Increment attempts and stop early
+                store.write(lambda conn, rid=row_id, n=attempts + 1: conn.execute("UPDATE outbox SET attempts = ? WHERE id = ?", (n, rid)))
+                break
+
+        if sent_any:
+            try:
+                app.notifier.show("Outbox flushed", type_="success")
+            except Exception:
+                pass
+
@@ -0,0 +1,224 @@
+"""Encrypted page log: on-disk format of the local DB when SQLCipher is unavailable.
+
+The working database is a plaintext SQLite file in WAL mode that exists only for
+the session. DB_PATH holds an append-only log of encrypted segments: after every
+commit the pages that commit wrote are read back from the WAL and appended as
+one SecretBox segment, so a write costs O(pages changed) instead of
+re-encrypting the whole database. Opening the store replays the segments into
+the working file. Once the log grows well past the database size it is
+compacted into a fresh snapshot (written to a temp file and swapped in).
+
+File layout (integers big-endian):
+    MAGIC | page_size u32 | key check (SecretBox of KEY_CHECK)
+    segment* : length u32 | SecretBox(seq u64 | db_pages u32 | count u32 | (pgno u32 | page)*)
+seq must increase by one per segment, so segments cannot be dropped or
+reordered without detection; a torn last segment (crash mid-append) is cut off.
+"""
+import os
+import struct
+import tempfile
+from typing import Dict, Optional, Tuple
+
+MAGIC = b'WHISPRDBv2'
+KEY_CHECK = b'whispr-db-key-check'
+# SecretBox nonce (24) + MAC (16)
+BOX_OVERHEAD = 40
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+WAL_MAGICS = (0x377f0682, 0x377f0683)
+SNAPSHOT_PAGES_PER_SEGMENT = 256
+COMPACT_MIN_BYTES = 4 * 1024 * 1024
+
+_HEADER = struct.Struct('>I')
+_SEGMENT_HEAD = struct.Struct('>QII')
+_PGNO = struct.Struct('>I')
+
+
+def is_segment_log(path: str) -> bool:
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except Exception:
+        return False
+
+
+class WalTracker:
+    """Returns the pages committed to a WAL file since the previous call.
+
+    Frames are trusted by their salts (the WAL belongs to our own live writer),
+    and only frames up to the last commit frame are taken.
+    """
+
+    def __init__(self, wal_path: str):
+        self.wal_path = wal_path
+        self._salts: Optional[bytes] = None
+        self._frames_done = 0
+
+    def committed_pages(self) -> Tuple[Dict[int, bytes], int, int]:
+        """Return ({pgno: page}, db_pages after the last commit, page_size); db_pages is 0 if nothing new."""
+        try:
+            f = open(self.wal_path, 'rb')
+        except FileNotFoundError:
+            return {}, 0, 0
+        with f:
+            header = f.read(WAL_HEADER_SIZE)
+            if len(header) < WAL_HEADER_SIZE or struct.unpack('>I', header[:4])[0] not in WAL_MAGICS:
+                return {}, 0, 0
+            page_size = struct.unpack('>I', header[8:12])[0]
+            salts = header[16:24]
+            start = self._frames_done if salts == self._salts else 0
+            frame_size = WAL_FRAME_HEADER_SIZE + page_size
+            f.seek(WAL_HEADER_SIZE + start * frame_size)
+            pending: Dict[int, bytes] = {}
+            committed: Dict[int, bytes] = {}
+            db_pages = 0
+            frame = start
+            while True:
+                raw = f.read(frame_size)
+                if len(raw) < frame_size or raw[8:16] != salts:
+                    break
+                pgno, commit_size = struct.unpack('>II', raw[:8])
+                pending[pgno] = raw[WAL_FRAME_HEADER_SIZE:]
+                frame += 1
+                if commit_size:
+                    committed.update(pending)
+                    pending.clear()
+                    db_pages = commit_size
+                    self._frames_done = frame
+            self._salts = salts
+            return committed, db_pages, page_size
+
+
+class SegmentLog:
+    def __init__(self, path: str, box):
+        self.path = path
+        self._box = box
+        self.page_size = 0
+        self._next_seq = 1
+        self._end = 0
+
+    def _header(self, page_size: int) -> bytes:
+        return MAGIC + _HEADER.pack(page_size) + self._box.encrypt(KEY_CHECK)
+
+    def _header_size(self) -> int:
+        return len(MAGIC) + _HEADER.size + len(KEY_CHECK) + BOX_OVERHEAD
+
+    @property
+    def size(self) -> int:
+        return self._end
+
+    def replay_into(self, db_path: str) -> None:
+        """Rebuild the plaintext database at db_path from the log.
+
+        Raises ValueError if path is not a segment log; a wrong key or a damaged
+        segment raises the SecretBox decryption error.
+        """
+        with open(self.path, 'rb') as f:
+            data_len = os.fstat(f.fileno()).st_size
+            head = f.read(self._header_size())
+            if not head.startswith(MAGIC):
+                raise ValueError("DB file is not a segment log")
+            self.page_size = _HEADER.unpack_from(head, len(MAGIC))[0]
+            if self._box.decrypt(head[len(MAGIC) + _HEADER.size:]) != KEY_CHECK:
+                raise ValueError("DB key check mismatch")
+            offset = len(head)
+            seq = 0
+            with open(db_path, 'wb') as out:
+                db_pages = 0
+                while offset < data_len:
+                    raw_len = f.read(_HEADER.size)
+                    if len(raw_len) < _HEADER.size:
+                        break
+                    (length,) = _HEADER.unpack(raw_len)
+                    ct = f.read(length)
+                    if len(ct) < length:
+                        break  # torn tail
+                    try:
+                        pt = self._box.decrypt(ct)
+                    except Exception:
+                        if offset + _HEADER.size + length >= data_len:
+                            break  # torn tail
+                        raise
+                    seg_seq, db_pages, count = _SEGMENT_HEAD.unpack_from(pt)
+                    if seg_seq != seq + 1:
+                        raise ValueError("DB segment log is out of sequence")
+                    seq = seg_seq
+                    pos = _SEGMENT_HEAD.size
+                    for _ in range(count):
+                        (pgno,) = _PGNO.unpack_from(pt, pos)
+                        pos += _PGNO.size
+                        out.seek((pgno - 1) * self.page_size)
+                        out.write(pt[pos:pos + self.page_size])
+                        pos += self.page_size
+                    offset += _HEADER.size + length
+                out.truncate(db_pages * self.page_size)
+        self._next_seq = seq + 1
+        self._end = offset
+
+    def _segment(self, seq: int, pages: Dict[int, bytes], db_pages: int) -> bytes:
+        parts = [_SEGMENT_HEAD.pack(seq, db_pages, len(pages))]
+        for pgno in sorted(pages):
+            parts.append(_PGNO.pack(pgno))
+            parts.append(pages[pgno])
+        ct = self._box.encrypt(b''.join(parts))
+        return _HEADER.pack(len(ct)) + ct
+
+    def append(self, pages: Dict[int, bytes], db_pages: int, page_size: int) -> None:
+        """Append one segment holding the pages of a commit and fsync it."""
+        if not pages:
+            return
+        if not self._end:
+            self.create_empty(page_size)
+        if page_size != self.page_size:
+            raise ValueError("page size changed; a snapshot is required")
+        record = self._segment(self._next_seq, pages, db_pages)
+        with open(self.path, 'r+b') as f:
+            f.seek(self._end)
+            f.write(record)
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        self._next_seq += 1
+        self._end += len(record)
+
+    def create_empty(self, page_size: int) -> None:
+        self._write_snapshot(None, page_size)
+
+    def should_compact(self, db_bytes: int) -> bool:
+        return self._end > COMPACT_MIN_BYTES and self._end > 2 * max(db_bytes, 1)
+
+    def snapshot(self, db_path: str, page_size: int) -> None:
+        """Replace the log with the full contents of db_path (fully checkpointed)."""
+        self._write_snapshot(db_path, page_size)
+
+    def _write_snapshot(self, db_path: Optional[str], page_size: int) -> None:
+        dirpath = os.path.dirname(self.path) or '.'
+        fd, tmp = tempfile.mkstemp(prefix='whispr_db_snap_', dir=dirpath)
+        try:
+            seq = 0
+            with os.fdopen(fd, 'wb') as out:
+                out.write(self._header(page_size))
+                if db_path is not None:
+                    db_pages = os.path.getsize(db_path) // page_size
+                    with open(db_path, 'rb') as src:
+                        pgno = 1
+                        while pgno <= db_pages:
+                            pages = {}
+                            while pgno <= db_pages and len(pages) < SNAPSHOT_PAGES_PER_SEGMENT:
+                                pages[pgno] = src.read(page_size)
+                                pgno += 1
+                            seq += 1
+                            out.write(self._segment(seq, pages, db_pages))
+                out.flush()
+                os.fsync(out.fileno())
+                end = out.tell()
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except Exception:
+                    pass
+        self.page_size = page_size
+        self._next_seq = seq + 1
+        self._end = end
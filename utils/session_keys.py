@@ -0,0 +1,126 @@
+"""Per-session key material for the local encrypted storage.
+
+The database key is derived from the PIN with scrypt once, at unlock, and kept
+in a SessionKeyring for the rest of the session instead of being re-derived on
+every read and write. The raw key lives in a bytearray that is locked in RAM
+where the OS allows it (mlock / VirtualLock, so it is not swapped out) and is
+zeroed by close() when the app locks or exits.
+"""
+import ctypes
+import ctypes.util
+import hmac
+import sys
+import threading
+from typing import Optional
+
+from nacl.secret import SecretBox
+
+from utils.crypto import derive_master_key, zero_bytes
+
+
+def _buffer_address(buf: bytearray) -> int:
+    return ctypes.addressof((ctypes.c_char * len(buf)).from_buffer(buf))
+
+
+def _lock_memory(buf: bytearray) -> bool:
+    """Best-effort: keep buf out of swap. Returns True if the OS agreed."""
+    if not buf:
+        return False
+    try:
+        addr, size = _buffer_address(buf), ctypes.c_size_t(len(buf))
+        if sys.platform == "win32":
+            return bool(ctypes.windll.kernel32.VirtualLock(ctypes.c_void_p(addr), size))
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        return libc.mlock(ctypes.c_void_p(addr), size) == 0
+    except Exception:
+        return False
+
+
+def _unlock_memory(buf: bytearray) -> None:
+    try:
+        addr, size = _buffer_address(buf), ctypes.c_size_t(len(buf))
+        if sys.platform == "win32":
+            ctypes.windll.kernel32.VirtualUnlock(ctypes.c_void_p(addr), size)
+        else:
+            ctypes.CDLL(ctypes.util.find_library("c")).munlock(ctypes.c_void_p(addr), size)
+    except Exception:
+        pass
+
+
+class SessionKeyring:
+    """Holds the derived local-storage key for one unlocked session.
+
+    Pass it to the utils.db / group_storage / outbox functions in place of the
+    PIN. After close() every use raises ValueError.
+    """
+
+    def __init__(self, db_key: bytearray):
+        if len(db_key) != SecretBox.KEY_SIZE:
+            raise ValueError("database key must be 32 bytes")
+        self._key = bytearray(db_key)
+        zero_bytes(db_key)
+        self.memory_locked = _lock_memory(self._key)
+        self._box: Optional[SecretBox] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @classmethod
+    def derive(cls, pin: str, salt: bytes) -> "SessionKeyring":
+        """Run the PIN KDF (the only scrypt call of the session) and keep the first 32 bytes."""
+        master = derive_master_key(pin, salt)
+        try:
+            return cls(master[:SecretBox.KEY_SIZE])
+        finally:
+            zero_bytes(master)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _check(self) -> None:
+        if self._closed:
+            raise ValueError("session keyring is closed")
+
+    def box(self) -> SecretBox:
+        """SecretBox over the session key, built once and shared (SecretBox is stateless)."""
+        with self._lock:
+            self._check()
+            if self._box is None:
+                self._box = SecretBox(bytes(self._key))
+            return self._box
+
+    def sqlcipher_key_hex(self) -> str:
+        """Raw key for PRAGMA key = x'...' (SQLCipher then skips its own KDF)."""
+        with self._lock:
+            self._check()
+            return self._key.hex()
+
+    def same_key(self, other: "SessionKeyring") -> bool:
+        """Constant-time check that both keyrings hold the same key."""
+        if other is self:
+            return True
+        with self._lock:
+            self._check()
+            mine = bytes(self._key)
+        with other._lock:
+            other._check()
+            theirs = bytes(other._key)
+        return hmac.compare_digest(mine, theirs)
+
+    def close(self) -> None:
+        """Zero and unlock the key. Idempotent."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # The SecretBox keeps an immutable copy; dropping it is all Python allows
+            self._box = None
+            zero_bytes(self._key)
+            if self.memory_locked:
+                _unlock_memory(self._key)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
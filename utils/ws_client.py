@@ -40,9 +40,12 @@ def _candidate_ws_urls(http_url: str, recipient_key: str):
 
 
 def start_ws_client(app):
+    """Start the push client thread. Returns stop(timeout), which closes the
+    socket and waits for the thread so no message arrives after it returns."""
     if websocket is None:
         print("[ws] websocket-client not installed; skipping real-time push")
-        return
+        return None
+    current = {"ws": None}
 
     def on_open(ws):  # noqa: ANN001
         app.ws_connected = True
@@ -147,7 +150,12 @@ def start_ws_client(app):
             except Exception:
                 conv_pub = sender_enc
 
-            save_message(conv_pub, name, save_text, app.pin, timestamp=ts, attachment=attachment_meta)
+            incoming = getattr(getattr(app, 'chat_manager', None), 'incoming', None)
+            if incoming is not None:
+                # Batched with other pushes arriving within the buffer's flush delay
+                incoming.add(conv_pub, name, save_text, timestamp=ts, attachment=attachment_meta)
+            else:
+                save_message(conv_pub, name, save_text, app.keyring, timestamp=ts, attachment=attachment_meta)
             # If this is a call invite, surface a dialog
             if isinstance(plaintext, str) and plaintext.startswith("CALL:"):
                 import json as _json
@@ -207,12 +215,28 @@ def start_ws_client(app):
                     on_error=on_error,
                     on_message=on_message,
                 )
+                current["ws"] = ws_app
+                if app.stop_event.is_set():
+                    break
                 ws_app.run_forever(sslopt=sslopt, ping_interval=30, ping_timeout=10)
             except Exception as e:  # connection or run_forever crash
                 print(f"[ws] run_forever exception: {e}")
             if app.stop_event.is_set():
                 break
-            time.sleep(backoff)
+            app.stop_event.wait(backoff)
             backoff = min(backoff * 2, 30)
 
-    threading.Thread(target=run, daemon=True).start()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    def stop(timeout: float = 2.0):
+        app.stop_event.set()
+        ws_app = current["ws"]
+        if ws_app is not None:
+            try:
+                ws_app.close()
+            except Exception:
+                pass
+        thread.join(timeout)
+
+    return stop